@@ -0,0 +1,84 @@
+"""Compare the IVF dedup index against exact search on synthetic embeddings.
+
+Reports recall@1 (how often the IVF top hit equals the exact top hit) and p50/p99 query
+latency for each store size and nprobe setting.
+
+    python benchmarks/ann_benchmark.py --sizes 10000 100000 1000000 --dim 256
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libraries.ann import IVFEmbeddingIndex
+from libraries.embeddings import EmbeddingIndex
+
+
+def synthetic_embeddings(size: int, dim: int, num_topics: int = 512, seed: int = 0) -> np.ndarray:
+    """Clustered embeddings: places about similar things sit close together, like real text embeddings."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(0, num_topics, size)] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    return vectors
+
+
+def time_queries(index, queries: np.ndarray, **options):
+    latencies, keys = [], []
+    for query in queries:
+        start = time.perf_counter()
+        result = index.search('Japan', 'Tokyo', query, k=1, **options)
+        latencies.append(time.perf_counter() - start)
+        keys.append(result[0][0] if result else -1)
+    return np.array(latencies) * 1000, np.array(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    results = []
+    for size in args.sizes:
+        vectors = synthetic_embeddings(size, args.dim)
+        # Near-duplicate queries, as produced when Gemini re-suggests a place under a slightly different name
+        picks = rng.integers(0, size, args.queries)
+        queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+        exact = EmbeddingIndex()
+        exact.add_batch('Japan', 'Tokyo', range(size), vectors)
+        exact_ms, exact_keys = time_queries(exact, queries)
+        results.append({'size': size, 'index': 'exact', 'recall_at_1': 1.0,
+                        'p50_ms': float(np.percentile(exact_ms, 50)), 'p99_ms': float(np.percentile(exact_ms, 99))})
+
+        start = time.perf_counter()
+        ivf = IVFEmbeddingIndex(min_train=min(size, 10_000))
+        ivf.add_batch('Japan', 'Tokyo', range(size), vectors)
+        build_s = time.perf_counter() - start
+
+        for nprobe in args.nprobe:
+            ivf_ms, ivf_keys = time_queries(ivf, queries, nprobe=nprobe)
+            results.append({'size': size, 'index': 'ivf', 'nprobe': nprobe, 'nlist': len(ivf._lists), 'build_s': build_s,
+                            'recall_at_1': float(np.mean(ivf_keys == exact_keys)),
+                            'p50_ms': float(np.percentile(ivf_ms, 50)), 'p99_ms': float(np.percentile(ivf_ms, 99))})
+
+    print(f"{'size':>9} {'index':>6} {'nprobe':>6} {'recall@1':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in results:
+        print(f"{row['size']:>9} {row['index']:>6} {row.get('nprobe', '-'):>6} {row['recall_at_1']:>9.3f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
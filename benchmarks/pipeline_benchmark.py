@@ -0,0 +1,190 @@
+"""Time the data, dedup, clustering, routing and map hot paths on synthetic places.db files.
+
+For each size a fresh database of synthetic places (geocodes scattered around real city
+centres, clustered embeddings, Item JSON and Google API responses) is generated, then
+save_data_to_db, load_data_from_db, load_place_table, the dedup lookup, cluster_locations,
+calculate_location_route and the map layer behind interface.py's update_map are timed.
+
+    python benchmarks/pipeline_benchmark.py --sizes 1000 10000 100000 --json results.json
+
+The JSON output records the git commit, so runs of different versions can be compared.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libraries.ann import build_dedup_index, load_dedup_index
+from libraries.data import Item, get_store, load_data_from_db, load_place_table, save_data_to_db
+from libraries.geo import cluster_locations
+from libraries.routing import calculate_location_route
+from libraries.titles import TitleIndex
+from interface import MapLayerCache
+
+try:
+    from tools import search_data_for_item
+except ImportError:
+    search_data_for_item = None
+
+# (country, destination, lat, lng) of the synthetic destinations
+CITIES = [
+    ('Japan', 'Tokyo', 35.6762, 139.6503),
+    ('Japan', 'Kyoto', 35.0116, 135.7681),
+    ('Japan', 'Osaka', 34.6937, 135.5023),
+    ('Japan', 'Sapporo', 43.0618, 141.3545),
+    ('Italy', 'Rome', 41.9028, 12.4964),
+    ('Italy', 'Florence', 43.7696, 11.2558),
+    ('Italy', 'Venice', 45.4408, 12.3155),
+    ('France', 'Paris', 48.8566, 2.3522),
+    ('France', 'Lyon', 45.7640, 4.8357),
+    ('Portugal', 'Lisbon', 38.7223, -9.1393),
+]
+TYPES = ['activity', 'food', 'accommodation', 'day trip']
+WORDS = ['Temple', 'Shrine', 'Garden', 'Market', 'Museum', 'Tower', 'Castle', 'Park', 'Ramen', 'Cafe',
+         'Bridge', 'Gallery', 'Palace', 'Street', 'Hall', 'Bar', 'Bakery', 'Onsen', 'Station', 'Harbour']
+
+
+def synthetic_places(size: int, num_destinations: int, dim: int, seed: int = 0):
+    """size place tuples spread over the first num_destinations CITIES, about 5% of them without a geocode."""
+    rng = np.random.default_rng(seed)
+    cities = CITIES[:num_destinations]
+    topics = rng.standard_normal((256, dim)).astype(np.float32)
+    places = []
+    for i in range(size):
+        country, destination, lat, lng = cities[i % len(cities)]
+        title = f"{WORDS[rng.integers(len(WORDS))]} {WORDS[rng.integers(len(WORDS))]} {i}"
+        address = f"{rng.integers(1, 300)}-{rng.integers(1, 30)} {WORDS[rng.integers(len(WORDS))]} Street, {destination}"
+        item = Item(item_title=f"Visit {title}", proper_title=title, description=f"A synthetic place in {destination}. " * 4,
+                    is_specific_location=True, street_address=address, type=TYPES[i % len(TYPES)])
+        embedding = topics[rng.integers(len(topics))] + 0.6 * rng.standard_normal(dim).astype(np.float32)
+
+        api_responses = {}
+        if rng.random() >= 0.05:
+            location = {'lat': lat + rng.normal(0, 0.05), 'lng': lng + rng.normal(0, 0.06)}
+            api_responses['geocode'] = {'formatted_address': address, 'place_id': f'synthetic-{i}',
+                                        'geometry': {'location': location, 'location_type': 'ROOFTOP'}, 'types': ['point_of_interest']}
+            api_responses['place_details'] = {'name': title, 'rating': round(float(rng.uniform(3, 5)), 1),
+                                              'user_ratings_total': int(rng.integers(0, 5000)),
+                                              'opening_hours': {'weekday_text': [f'Day {d}: 9:00 AM - 5:00 PM' for d in range(7)]}}
+        places.append((embedding, country, destination, item, api_responses))
+    return places
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_size(size: int, args, workdir: str) -> dict:
+    places = synthetic_places(size, args.destinations, args.dim)
+    db_path = os.path.join(workdir, f'places_{size}.db')
+    timings = {}
+
+    _, timings['save_insert_s'] = timed(save_data_to_db, db_path, places)
+    data, timings['load_data_from_db_s'] = timed(load_data_from_db, db_path)
+    # Re-save after editing 1% of the places: only the dirty rows should be written
+    for i in range(0, len(data), 100):
+        place = data[i]
+        item = place[3].copy(update={'description': place[3].description + ' Updated.'})
+        data[i] = place[:3] + (item,) + place[4:]
+    _, timings['save_update_1pct_s'] = timed(save_data_to_db, db_path, data)
+    table, timings['load_place_table_s'] = timed(load_place_table, db_path)
+
+    # Dedup: near-duplicate queries against the embedding index, then the title prefilter and full comparison
+    rng = np.random.default_rng(1)
+    embedding_index, timings['build_dedup_index_s'] = timed(build_dedup_index, data)
+    # The persisted index test.py uses: the first load indexes every stored place, once saved it is a single read
+    stored_index, timings['load_dedup_index_cold_s'] = timed(load_dedup_index, db_path)
+    stored_index.save(db_path)
+    _, timings['load_dedup_index_s'] = timed(load_dedup_index, db_path)
+    # Built from the table's title and address columns, as test.py does; its positions are those of data.
+    # Each destination's trigrams are computed on its first search, timed here for all of them at once
+    title_index, timings['build_title_index_s'] = timed(TitleIndex.from_places, table)
+    _, timings['index_title_trigrams_s'] = timed(lambda: [title_index.candidates(country, destination, '')
+                                                          for country, destination, _, _ in CITIES[:args.destinations]])
+    picks = rng.integers(0, len(data), args.queries)
+    latencies = []
+    for i in picks:
+        embedding, country, destination, item, _ = data[i]
+        query = embedding + 0.3 * rng.standard_normal(args.dim).astype(np.float32)
+        start = time.perf_counter()
+        if embedding_index.best_match(country, destination, query) is None:
+            candidates = [data[key] for key, _ in title_index.candidates(country, destination, item.proper_title, item.street_address)]
+            if search_data_for_item is not None and candidates:
+                search_data_for_item(None, candidates, country, destination, item)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    timings['dedup_p50_ms'] = float(np.percentile(latencies, 50))
+    timings['dedup_p99_ms'] = float(np.percentile(latencies, 99))
+
+    # One trip: every geocoded activity/food place of the first destination, over args.days days
+    destination = CITIES[0][1]
+    selected = [place for place in data if place[2] == destination and place[3].type in ('activity', 'food')][:args.max_stops]
+    clusters, timings['cluster_locations_s'] = timed(cluster_locations, selected, args.days)
+    _, timings['calculate_location_route_s'] = timed(calculate_location_route, clusters, args.budget)
+
+    # update_map: the first call builds the layer (and its figure when plotly is installed), later ones only toggle markers
+    maps = MapLayerCache(table)
+    checked = np.ones(len(table), dtype=bool)
+    draw = maps.figure if _has_plotly() else lambda dest, kind, mask: maps.layer(dest, kind)
+    _, timings['update_map_cold_s'] = timed(draw, destination, 'activity', checked)
+    checked[::2] = False
+    _, timings['update_map_toggle_s'] = timed(draw, destination, 'activity', checked)
+
+    return {'size': size, 'destinations': args.destinations, 'trip_stops': len(selected),
+            'db_mb': os.path.getsize(db_path) / 2 ** 20, **timings}
+
+
+def _has_plotly() -> bool:
+    return importlib.util.find_spec('plotly') is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--destinations", type=int, default=len(CITIES), choices=range(1, len(CITIES) + 1), metavar="M")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Dedup lookups per size")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--max-stops", type=int, default=500, help="Cap on the places in the clustered and routed trip")
+    parser.add_argument("--budget", type=float, default=0.2, help="Route solver time budget per day in seconds")
+    parser.add_argument("--keep", help="Write the generated databases to this directory instead of a temporary one")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.keep or tmp
+        os.makedirs(workdir, exist_ok=True)
+        results = []
+        for size in args.sizes:
+            results.append(run_size(size, args, workdir))
+            print(json.dumps(results[-1]))
+            get_store(os.path.join(workdir, f'places_{size}.db')).close()
+
+    if args.json:
+        report = {'commit': git_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                  'full_dedup': search_data_for_item is not None, 'map_figure': _has_plotly(), 'results': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
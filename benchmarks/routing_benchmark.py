@@ -0,0 +1,75 @@
+"""Benchmark the route solver behind calculate_location_route.
+
+Reports the tour length against the brute-force optimum on small random days, and runtime
+and improvement over nearest neighbour on 50-200 stop days.
+
+    python benchmarks/routing_benchmark.py --budget 0.5
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libraries.geo import haversine_matrix
+from libraries.routing import nearest_neighbour_tour, solve_route, tour_length
+
+
+def random_day(size: int, rng: np.random.Generator) -> np.ndarray:
+    """Stops scattered around central Tokyo, [lat, lng] degrees."""
+    return np.column_stack((35.68 + rng.normal(0, 0.05, size), 139.76 + rng.normal(0, 0.06, size)))
+
+
+def brute_force(dist: np.ndarray) -> float:
+    best = np.inf
+    for perm in itertools.permutations(range(1, len(dist))):
+        best = min(best, tour_length(dist, (0,) + perm))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=0.5, help="Solver time budget per day in seconds")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--small", type=int, nargs="+", default=[6, 8, 9])
+    parser.add_argument("--large", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+
+    for size in args.small:
+        gaps = []
+        for _ in range(args.trials):
+            dist = haversine_matrix(random_day(size, rng))
+            optimum = brute_force(dist)
+            gaps.append(tour_length(dist, solve_route(dist, args.budget, closed=True)) / optimum - 1)
+        results.append({'stops': size, 'kind': 'vs_optimum', 'mean_gap_pct': 100 * float(np.mean(gaps)),
+                        'max_gap_pct': 100 * float(np.max(gaps)), 'optimal_share': float(np.mean(np.array(gaps) < 1e-9))})
+
+    for size in args.large:
+        times, gains = [], []
+        for _ in range(max(1, args.trials // 4)):
+            dist = haversine_matrix(random_day(size, rng))
+            start = time.perf_counter()
+            tour = solve_route(dist, args.budget, closed=True)
+            times.append(time.perf_counter() - start)
+            gains.append(1 - tour_length(dist, tour) / tour_length(dist, nearest_neighbour_tour(dist)))
+        results.append({'stops': size, 'kind': 'runtime', 'mean_s': float(np.mean(times)), 'max_s': float(np.max(times)),
+                        'improvement_over_nn_pct': 100 * float(np.mean(gains))})
+
+    for row in results:
+        print(json.dumps(row))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,97 @@
-import datetime
-import pytz
+# gradio and plotly take seconds to import, so they are imported where the interface is built
+# rather than when test.py imports this module; the reloader's imports live under __main__
 from datetime import datetime as dt, timedelta
-from datetime import timezone as tz
 import sys
 import json
+import math
 import os
 import time
-import subprocess
-import gradio as gr
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-import time
-from libraries.data import Item
-import plotly.graph_objects as go
-from rich.console import Console
-import asyncio
-from tools import cluster_locations, calculate_location_route
+import threading
+import numpy as np
+from libraries.data import PlaceTable
+from libraries.geo import place_coordinates
+from libraries.itinerary import ItinerarySession
+
+# Items shown per page of a destination's item list
+ITEM_PAGE_SIZE = 50
+
+
+class MapLayerCache:
+    """Marker arrays and map figures precomputed per (destination, type).
+
+    The coordinates and titles of a layer are extracted from the place tuples once. Each layer's
+    figure (layout, center and zoom, no markers) is built on first use and kept as a template;
+    every call returns its own copy with the selected markers, since Gradio serializes the
+    returned figure outside the lock and concurrent sessions must not share one.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._layers = {}
+        self._figures = {}
+        self._lock = threading.Lock()
+
+    def layer(self, destination, selected_type):
+        key = (destination, selected_type)
+        layer = self._layers.get(key)
+        if layer is None:
+            if isinstance(self.data, PlaceTable):
+                # Filter and read coordinates straight from the table's columns
+                indexes = np.flatnonzero(self.data.mask(destination=destination, place_type=selected_type))
+                coords = self.data.coordinates(indexes)
+                text = np.array([self.data.titles[i] for i in indexes], dtype=object)
+            else:
+                indexes = np.array([i for i, item in enumerate(self.data) if item[2] == destination and item[3].type == selected_type], dtype=int)
+                coords = place_coordinates([self.data[i] for i in indexes])
+                text = np.array([self.data[i][3].proper_title for i in indexes], dtype=object)
+            located = ~np.isnan(coords).any(axis=1)
+            layer = self._layers[key] = (indexes[located], coords[located, 0], coords[located, 1], text[located])
+        return layer
+
+    def figure(self, destination, selected_type, checked):
+        """Figure for a layer showing only the markers that are selected in checked (a mask indexed like data)."""
+        import plotly.graph_objects as go
+
+        indexes, lat, lon, text = self.layer(destination, selected_type)
+        visible = np.asarray(checked, dtype=bool)[indexes]
+
+        with self._lock:
+            template = self._figures.get((destination, selected_type))
+            if template is None:
+                template = self._figures[(destination, selected_type)] = self._build_figure(lat, lon)
+        # The template is never modified once built, so it can be copied without the lock
+        fig = go.Figure(template)
+        fig.data[0].update(lat=lat[visible], lon=lon[visible], text=text[visible])
+        return fig
 
+    @staticmethod
+    def _build_figure(lat, lon):
+        import plotly.graph_objects as go
+
+        fig = go.Figure(go.Scattermapbox(
+            mode='markers',
+            marker=go.scattermapbox.Marker(size=10),
+            hoverinfo='text'
+        ))
+
+        fig.update_layout(
+            mapbox_style="outdoors",
+            mapbox=dict(
+                accesstoken=os.environ.get('MAPBOX_ACCESS_TOKEN'),
+                center={'lat': float(lat.mean()) if len(lat) else 35.6762, 'lon': float(lon.mean()) if len(lon) else 139.6503},
+                zoom=10
+            ),
+            showlegend=False,
+            height=600,
+            margin={"r":0,"t":0,"l":0,"b":0}
+        )
+
+        return fig
+
+
+def create_interface(data, prompt_types, travel_times=None):
+    import gradio as gr
 
-def create_interface(data, prompt_types):
     # Get unique destinations
     destinations = list(set(item[2] for item in data))
     
@@ -61,77 +134,96 @@ def create_interface(data, prompt_types):
 
         return ctrl_date
 
-    def update_map(selected_type, destination, *checkboxes):
-        visible_items = [item for item, checked in zip(data, checkboxes) if checked and item[3].type == selected_type and item[2] == destination]
-        lat = [item[4]['geocode']['geometry']['location']['lat'] for item in visible_items]
-        lon = [item[4]['geocode']['geometry']['location']['lng'] for item in visible_items]
-        text = [item[3].proper_title for item in visible_items]
-
-        fig = go.Figure(go.Scattermapbox(
-            lat=lat,
-            lon=lon,
-            mode='markers',
-            marker=go.scattermapbox.Marker(size=10),
-            text=text,
-            hoverinfo='text'
-        ))
-
-        fig.update_layout(
-            mapbox_style="outdoors",
-            mapbox=dict(
-                accesstoken=os.environ.get('MAPBOX_ACCESS_TOKEN'),
-                center={'lat': sum(lat)/len(lat) if lat else 35.6762, 'lon': sum(lon)/len(lon) if lon else 139.6503},
-                zoom=10
-            ),
-            showlegend=False,
-            height=600,
-            margin={"r":0,"t":0,"l":0,"b":0}
-        )
-
-        return fig
-
-    def filter_checkboxes(selected_type, destination):
-        return [gr.update(visible=item[3].type == selected_type and item[2] == destination) for item in data]
+    map_layers = MapLayerCache(data)
+
+    # Indexes into data of every (destination, type), in data order, for paging the item lists
+    layer_items = {}
+    for i, item in enumerate(data):
+        layer_items.setdefault((item[2], item[3].type), []).append(i)
+
+    # Selections are kept on the server rather than in the page, as one mask over data per destination tab
+    # and browser session (a gr.State); None until the session first changes it, which means all selected
+    def selection(selected):
+        return np.ones(len(data), dtype=bool) if selected is None else selected
+
+    def page_items(destination, selected_type, page):
+        items = layer_items.get((destination, selected_type), [])
+        pages = max(1, math.ceil(len(items) / ITEM_PAGE_SIZE))
+        page = min(max(0, int(page or 0)), pages - 1)
+        return items[page * ITEM_PAGE_SIZE:(page + 1) * ITEM_PAGE_SIZE], page, pages
+
+    def item_page(destination, selected_type, page, selected=None):
+        """Choices and ticked values of one page of the item list, plus the page number and label."""
+        shown, page, pages = page_items(destination, selected_type, page)
+        mask = selection(selected)
+        choices = [(data[i][3].item_title, i) for i in shown]
+        value = [i for i in shown if mask[i]]
+        return gr.update(choices=choices, value=value), page, f"Page {page + 1} of {pages}"
+
+    def update_map(selected_type, destination, selected):
+        return map_layers.figure(destination, selected_type, selection(selected))
+
+    def show_map(selected_type, destination, rendered, selected):
+        # Once drawn, a tab's map is kept current by its own events, so re-opening the tab sends nothing
+        if rendered:
+            return gr.update(), True
+        return update_map(selected_type, destination, selected), True
+
+    def change_type(selected_type, destination, selected):
+        return item_page(destination, selected_type, 0, selected) + (update_map(selected_type, destination, selected),)
+
+    def toggle_items(destination, selected_type, page, checked, selected):
+        # Only the items on the current page can have changed; the session's mask is replaced rather than
+        # modified, so an event still reading the previous one is not affected
+        shown, _, _ = page_items(destination, selected_type, page)
+        mask = selection(selected).copy()
+        mask[shown] = False
+        mask[np.array(checked or [], dtype=int)] = True
+        return update_map(selected_type, destination, mask), mask
 
     
-    def process_itinerary(selections):
+    # An ItinerarySession per destination tab and browser session (a gr.State) caches the day clusters and routes,
+    # so small edits only recompute what changed. Legs are costed with the cached travel times when a TravelTimeCache is given
+    cost_matrix = travel_times.matrix if travel_times is not None else None
+
+    def process_itinerary(itinerary_session, selections):
         
-        # Create selected_data list
-        selected_data = []
+        # Create selected_data mapping (index in data -> place)
+        selected_data = {}
         for prompt_type, indexes in selections.items():
             if prompt_type != "days":
-                selected_data.extend([data[i] for i in indexes])
+                selected_data.update({i: data[i] for i in indexes})
         
         num_clusters = selections["days"]
 
-        # Call cluster_locations
-        clustered_data = cluster_locations(selected_data, num_clusters)
-
-        # Call calculate_location_route
-        processed_data = calculate_location_route(clustered_data)
+        # Cluster the places into days and route each day, reusing whatever is still valid
+        processed_data = itinerary_session.update(selected_data, num_clusters)
         
         print(processed_data)
 
         return processed_data
     
 
-    def generate_itinerary():
+    def generate_itinerary(destination, selected, itinerary_session):
+        if itinerary_session is None:
+            itinerary_session = ItinerarySession(cost_matrix=cost_matrix)
+
         # Show loading overlay
-        yield gr.update(visible=True), gr.update(visible=True)
+        yield gr.update(visible=True), gr.update(visible=True), itinerary_session
         
         # Make selected data json
         selections = {prompt_type: [] for prompt_type in prompt_types}
-        for i, (checked, item) in enumerate(zip(checkboxes, data)):
-            if checked and item[2] == destination:
-                selections[item[3].type].append(i)
+        for i in np.flatnonzero(selection(selected)).tolist():
+            if data[i][2] == destination:
+                selections.setdefault(data[i][3].type, []).append(i)
         selections["days"] = trip_dates[destination]["days"]
         
         print(selections["days"])
 
-        process_itinerary(selections)
+        process_itinerary(itinerary_session, selections)
 
         # Hide loading overlay and show itinerary tab
-        yield gr.update(visible=False), gr.update(selected="Itinerary")
+        yield gr.update(visible=False), gr.update(selected="Itinerary"), itinerary_session
 
         # TODO: Update the itinerary display with processed_data
         # This part will depend on how you want to display the itinerary
@@ -139,9 +231,9 @@ def create_interface(data, prompt_types):
     with gr.Blocks(theme=gr.themes.Soft(), css=".block{overflow-y: hidden !important;} .time{min-width: 50px !important;}") as demo:
         gr.Markdown("# Giga-Planner 5000")
         
-        with gr.Tabs() as tabs:
-            for destination in destinations:
-                with gr.Tab(destination):
+        with gr.Tabs():
+            for tab_index, destination in enumerate(destinations):
+                with gr.Tab(destination) as dest_tab:
                     dest_val = gr.Textbox(value=destination, visible=False)
                     
                     # New inner tabs
@@ -164,7 +256,13 @@ def create_interface(data, prompt_types):
                                             end_date = gr.DateTime(label="End Date", min_width=50, include_time=False, value=trip_dates[destination]["end"], timezone="US/Eastern")
                                     with gr.Group():
                                         gr.Markdown(" <b>Item List</b>")
-                                        checkboxes = [gr.Checkbox(label=item[3].item_title, value=True, visible=item[3].type == prompt_types[0] and item[2] == destination) for item in data]
+                                        first_page, page, page_text = item_page(destination, prompt_types[0], 0)
+                                        item_list = gr.CheckboxGroup(choices=first_page["choices"], value=first_page["value"], show_label=False, interactive=True)
+                                        page_state = gr.State(page)
+                                        with gr.Row():
+                                            prev_btn = gr.Button("<", size="sm", min_width=50)
+                                            page_label = gr.Markdown(page_text)
+                                            next_btn = gr.Button(">", size="sm", min_width=50)
                                 
                                 with gr.Column(scale=2):
                                     map_component = gr.Plot()
@@ -175,33 +273,40 @@ def create_interface(data, prompt_types):
 
                             # Hidden JSON component to store selections
                             selections = gr.JSON(visible=True)
+                            map_rendered = gr.State(False)
+                            # This session's selection mask and itinerary session for the destination
+                            selected_state = gr.State(None)
+                            itinerary_state = gr.State(None)
                             
-                            # Handle tab changes
-                            tabs.change(update_map, inputs=[type_selector, dest_val] + checkboxes, outputs=map_component)
+                            # Draw this tab's map the first time it is opened
+                            dest_tab.select(show_map, inputs=[type_selector, dest_val, map_rendered, selected_state], outputs=[map_component, map_rendered])
 
-                            # Update map when type is changed or checkboxes are toggled
-                            type_selector.change(update_map, inputs=[type_selector, dest_val] + checkboxes, outputs=map_component)
-                            type_selector.change(filter_checkboxes, inputs=[type_selector, dest_val], outputs=checkboxes)
+                            # Show the first page of the new type and its map layer when the type is changed
+                            type_selector.change(change_type, inputs=[type_selector, dest_val, selected_state], outputs=[item_list, page_state, page_label, map_component])
                             
                             start_date.change(update_trip_dates, inputs=[gr.Textbox(value="start", visible=False),start_date, type_selector, dest_val], outputs=[start_date])
                             end_date.change(update_trip_dates, inputs=[gr.Textbox(value="end", visible=False),end_date, type_selector, dest_val], outputs=[end_date])
                             
-                            for checkbox in checkboxes:
-                                checkbox.change(update_map, inputs=[type_selector, dest_val] + checkboxes, outputs=map_component)
+                            # Record ticks on the current page (user input only, not page changes) and update the map
+                            item_list.input(toggle_items, inputs=[dest_val, type_selector, page_state, item_list, selected_state], outputs=[map_component, selected_state])
+                            prev_btn.click(lambda d, t, p, s: item_page(d, t, p - 1, s), inputs=[dest_val, type_selector, page_state, selected_state], outputs=[item_list, page_state, page_label])
+                            next_btn.click(lambda d, t, p, s: item_page(d, t, p + 1, s), inputs=[dest_val, type_selector, page_state, selected_state], outputs=[item_list, page_state, page_label])
 
                             # Handle save and cancel actions
                             save_btn.click(
                                 fn=generate_itinerary,
-                                inputs=[],
+                                inputs=[dest_val, selected_state, itinerary_state],
                                 outputs=[
                                     gr.Markdown(value="Loading...", visible=False),  
-                                    inner_tabs  # To update tab visibility and selection
+                                    inner_tabs,  # To update tab visibility and selection
+                                    itinerary_state
                                 ]
                             )
                             cancel_btn.click(lambda: None, outputs=selections)
                             
-                            # Load initial map
-                            demo.load(update_map, inputs=[type_selector, gr.Textbox(value=destination, visible=False)] + checkboxes, outputs=map_component)
+                            # Only the tab that is open on page load draws its map straight away
+                            if tab_index == 0:
+                                demo.load(show_map, inputs=[type_selector, dest_val, map_rendered, selected_state], outputs=[map_component, map_rendered])
 
                         with gr.Tab("Itinerary", visible=False):
                             # Placeholder for the itinerary display
@@ -210,9 +315,13 @@ def create_interface(data, prompt_types):
     return demo
 
 
-def load_interface(data, prompt_types):
+def load_interface(data, prompt_types, on_built=None, travel_times=None):
     
-    demo = create_interface(data, prompt_types)
+    demo = create_interface(data, prompt_types, travel_times)
+
+    # Lets the caller report startup timings before launch() blocks
+    if on_built:
+        on_built()
     
     # Create and launch interface
     result = demo.launch()
@@ -223,6 +332,12 @@ def load_interface(data, prompt_types):
 # Example usage:
 if __name__ == "__main__":
     
+    import subprocess
+    from rich.console import Console
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    from libraries.data import Item
+
     c = Console()
 
     class InterfaceReloader(FileSystemEventHandler):
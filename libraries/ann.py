@@ -0,0 +1,264 @@
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from libraries.data import get_store, ivf_index_path
+from libraries.embeddings import EmbeddingIndex, normalize_rows, top_k
+
+# Number of embeddings above which build_dedup_index and load_dedup_index switch from exact search to IVF
+ANN_THRESHOLD = 100_000
+
+
+def spherical_kmeans(vectors: np.ndarray, num_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster unit-length vectors by cosine similarity and return unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # Reseed empty clusters from random points so every list stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFEmbeddingIndex(EmbeddingIndex):
+    """Approximate drop-in replacement for EmbeddingIndex based on an inverted file (IVF).
+
+    Embeddings are assigned to the nearest of nlist spherical k-means centroids. A query only
+    scores the vectors in its nprobe closest lists, restricted to its (country, destination),
+    so nprobe is the recall/latency knob: nprobe == nlist is exact search. Until min_train
+    vectors have been added the index keeps everything in one list, which is exact as well.
+    The centroids are retrained, and the lists rebuilt, each time the index grows by
+    retrain_factor since the last training. save() and load() keep the index in a file next
+    to the database (see ivf_index_path) rather than in the embedding_index table.
+    """
+
+    def __init__(self, dim: Optional[int] = None, nlist: Optional[int] = None, nprobe: int = 8,
+                 min_train: int = 10_000, retrain_factor: float = 4.0):
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+
+        self._size = 0
+        self._vectors = np.empty((0, dim or 0), dtype=np.float32)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._parts = np.empty(0, dtype=np.int32)
+        self._partition_codes: Dict[Tuple[str, str], int] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+        self._lists: List[List[int]] = [[]]
+        self._list_arrays: List[Optional[np.ndarray]] = [None]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self._vectors), 1024)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        keys = np.empty(capacity, dtype=np.int64)
+        keys[:self._size] = self._keys[:self._size]
+        parts = np.empty(capacity, dtype=np.int32)
+        parts[:self._size] = self._parts[:self._size]
+        self._vectors, self._keys, self._parts = vectors, keys, parts
+
+    def _assign(self, start: int, stop: int, chunk: int = 65536):
+        """Append rows start..stop to the inverted list of their nearest centroid."""
+        for offset in range(start, stop, chunk):
+            end = min(offset + chunk, stop)
+            if self._centroids is None:
+                assignment = np.zeros(end - offset, dtype=np.int64)
+            else:
+                assignment = np.argmax(self._vectors[offset:end] @ self._centroids.T, axis=1)
+            for row, list_id in zip(range(offset, end), assignment.tolist()):
+                self._lists[list_id].append(row)
+                self._list_arrays[list_id] = None
+
+    def train(self):
+        """(Re)train the coarse quantizer on the current vectors and rebuild every inverted list."""
+        vectors = self._vectors[:self._size]
+        nlist = self.nlist or int(np.clip(4 * np.sqrt(self._size), 1, 4096))
+        nlist = min(nlist, self._size)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(self._size, min(self._size, 64 * nlist), replace=False)]
+
+        self._centroids = spherical_kmeans(sample, nlist)
+        self._trained_size = self._size
+        self._lists = [[] for _ in range(nlist)]
+        self._list_arrays = [None] * nlist
+        self._assign(0, self._size)
+
+    def add_batch(self, country: str, destination: str, keys: Iterable[int], embeddings: np.ndarray):
+        vectors = normalize_rows(embeddings)
+        keys = np.asarray(list(keys), dtype=np.int64)
+        if len(keys) != len(vectors):
+            raise ValueError(f"Got {len(keys)} keys for {len(vectors)} embeddings")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._vectors = np.empty((0, self.dim), dtype=np.float32)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+
+        code = self._partition_codes.setdefault((country, destination), len(self._partition_codes))
+        start, stop = self._size, self._size + len(keys)
+        if stop > len(self._vectors):
+            self._grow(stop)
+        self._vectors[start:stop] = vectors
+        self._keys[start:stop] = keys
+        self._parts[start:stop] = code
+        self._size = stop
+
+        if self._centroids is None and self._size >= self.min_train:
+            self.train()
+        elif self._centroids is not None and self._size >= self.retrain_factor * self._trained_size:
+            self.train()
+        else:
+            self._assign(start, stop)
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays[list_id]
+        if array is None:
+            array = self._list_arrays[list_id] = np.asarray(self._lists[list_id], dtype=np.int64)
+        return array
+
+    def search_batch(self, country: str, destination: str, embeddings: np.ndarray, k: int = 1,
+                     nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(embeddings)
+        code = self._partition_codes.get((country, destination))
+        result_keys = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if code is None:
+            return result_keys[:, :0], result_scores[:, :0]
+
+        nprobe = min(nprobe or self.nprobe, len(self._lists))
+        if self._centroids is None:
+            probes = np.zeros((len(queries), 1), dtype=np.int64)
+        else:
+            probes = top_k(queries @ self._centroids.T, nprobe)
+
+        width = 0
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self._list_array(list_id) for list_id in probes[i].tolist()])
+            candidates = candidates[self._parts[candidates] == code]
+            if len(candidates) == 0:
+                continue
+            scores = self._vectors[candidates] @ query
+            best = top_k(scores[np.newaxis, :], k)[0]
+            result_keys[i, :len(best)] = self._keys[candidates[best]]
+            result_scores[i, :len(best)] = scores[best]
+            width = max(width, len(best))
+        return result_keys[:, :width], result_scores[:, :width]
+
+    def search(self, country: str, destination: str, embedding: np.ndarray, k: int = 1, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        keys, scores = self.search_batch(country, destination, embedding, k, nprobe)
+        return [(key, score) for key, score in zip(keys[0].tolist(), scores[0].tolist()) if key != -1]
+
+    def save(self, db_path: str):
+        """Persist the index, keyed by places.id, in the IVF file of db_path."""
+        self.save_file(ivf_index_path(db_path))
+        with get_store(db_path).transaction() as conn:
+            self._saved_backfill(conn)
+
+    @classmethod
+    def load(cls, db_path: str) -> 'IVFEmbeddingIndex':
+        """Load the IVF file of db_path and add the places inserted since it was saved (all of them if there is no file)."""
+        return cls.load_file(ivf_index_path(db_path), db_path)
+
+    def save_file(self, path: str):
+        """Write the index (vectors, lists and centroids) to an .npz file next to the database."""
+        if self.keyed_by_position:
+            raise ValueError("An index built by from_places() is keyed by data positions, not places.id, and cannot be saved")
+        partitions = [None] * len(self._partition_codes)
+        for partition, code in self._partition_codes.items():
+            partitions[code] = list(partition)
+        assignment = np.zeros(self._size, dtype=np.int32)
+        for list_id, rows in enumerate(self._lists):
+            assignment[rows] = list_id
+
+        # Written aside and renamed, so an interrupted save leaves the previous file intact
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                vectors=self._vectors[:self._size],
+                keys=self._keys[:self._size],
+                parts=self._parts[:self._size],
+                assignment=assignment,
+                centroids=self._centroids if self._centroids is not None else np.empty((0, self.dim or 0), dtype=np.float32),
+                meta=np.array(json.dumps({
+                    'partitions': partitions,
+                    'last_place_id': self.last_place_id,
+                    'trained_size': self._trained_size,
+                    'nlist': self.nlist,
+                    'nprobe': self.nprobe,
+                    'min_train': self.min_train,
+                    'retrain_factor': self.retrain_factor,
+                }))
+            )
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load_file(cls, path: str, db_path: Optional[str] = None) -> 'IVFEmbeddingIndex':
+        """Load an index written by save_file, then add places rows newer than its last_place_id.
+
+        A missing file yields an empty index that is filled from db_path. Keys are places.id.
+        """
+        if not os.path.exists(path):
+            index = cls()
+        else:
+            with np.load(path) as saved:
+                meta = json.loads(str(saved['meta']))
+                index = cls(saved['vectors'].shape[1], meta['nlist'], meta['nprobe'], meta['min_train'], meta['retrain_factor'])
+                index.last_place_id = meta['last_place_id']
+                index._partition_codes = {tuple(partition): code for code, partition in enumerate(meta['partitions'])}
+                index._vectors = saved['vectors']
+                index._keys = saved['keys']
+                index._parts = saved['parts']
+                index._size = len(index._keys)
+                if len(saved['centroids']):
+                    index._centroids = saved['centroids']
+                    index._trained_size = meta['trained_size']
+                    num_lists = len(index._centroids)
+                else:
+                    num_lists = 1
+                order = np.argsort(saved['assignment'], kind='stable')
+                bounds = np.searchsorted(saved['assignment'][order], np.arange(num_lists + 1))
+                index._lists = [order[bounds[i]:bounds[i + 1]].tolist() for i in range(num_lists)]
+                index._list_arrays = [None] * num_lists
+
+        if db_path is not None:
+            with get_store(db_path).connection() as conn:
+                index.add_new_places(conn)
+        return index
+
+
+def build_dedup_index(data: List[Tuple], ann_threshold: int = ANN_THRESHOLD, nprobe: int = 8) -> EmbeddingIndex:
+    """Return an exact EmbeddingIndex over data, or an IVF index once it holds more than ann_threshold embeddings.
+
+    The index is keyed by position in data and is rebuilt from scratch; load_dedup_index is the persisted, places.id-keyed variant.
+    """
+    num_embeddings = sum(1 for row in data if row[0] is not None)
+    if num_embeddings <= ann_threshold:
+        return EmbeddingIndex.from_places(data)
+    return IVFEmbeddingIndex.from_places(data, nprobe=nprobe)
+
+
+def load_dedup_index(db_path: str, ann_threshold: int = ANN_THRESHOLD, nprobe: int = 8) -> EmbeddingIndex:
+    """Load the persisted dedup index of db_path, keyed by places.id: exact up to ann_threshold embeddings, IVF above.
+
+    Only the places added since the index was last saved are indexed here, so call save() on
+    the result once new places have been stored.
+    """
+    with get_store(db_path).connection() as conn:
+        (num_embeddings,) = conn.execute('SELECT COUNT(*) FROM places WHERE embedding IS NOT NULL').fetchone()
+    if num_embeddings <= ann_threshold:
+        return EmbeddingIndex.load(db_path)
+    index = IVFEmbeddingIndex.load(db_path)
+    index.nprobe = nprobe
+    return index
@@ -0,0 +1,150 @@
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from libraries.geo import place_location
+
+# Date formats accepted in a manifest: ISO, and the MM/DD/YYYY the interactive questions ask for
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+
+
+class DestinationPlan(BaseModel):
+    """One stop of a trip in a batch manifest."""
+    name: str = Field(description="Destination name, as used for research (e.g. Tokyo)")
+    start_date: Optional[str] = Field(description="First day at the destination (YYYY-MM-DD or MM/DD/YYYY)", default=None)
+    end_date: Optional[str] = Field(description="Last day at the destination (YYYY-MM-DD or MM/DD/YYYY)", default=None)
+    preferences: Dict[str, str] = Field(description="Destination-specific preferences per prompt type", default_factory=dict)
+
+
+class TripPlan(BaseModel):
+    """A traveller's trip to one country in a batch manifest."""
+    traveller: str = Field(description="Name of the traveller, used to name the output file")
+    country: str
+    preferences: Dict[str, str] = Field(description="General preferences per prompt type", default_factory=dict)
+    destinations: List[DestinationPlan]
+
+
+class BatchManifest(BaseModel):
+    """Trips to research and plan without any interactive prompts."""
+    trips: List[TripPlan]
+    prompt_types: List[str] = Field(description="Prompt types to research for every destination", default_factory=lambda: ['activity'])
+    output_dir: Optional[str] = Field(description="Directory for the itinerary files", default=None)
+
+
+def load_manifest(path: str) -> BatchManifest:
+    """Read a batch manifest from a JSON file, or a YAML file (.yaml/.yml, needs PyYAML)."""
+    with open(path, encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"Reading {path} needs PyYAML (pip install pyyaml), or use a JSON manifest")
+            raw = yaml.safe_load(f)
+        else:
+            raw = json.load(f)
+    manifest = BatchManifest.parse_obj(raw)
+    # Fail on a bad date, or two trips that would overwrite each other's file, now rather than after the research has run
+    for trip in manifest.trips:
+        for plan in trip.destinations:
+            trip_days(plan)
+    slugs: Dict[str, int] = {}
+    for index, trip in enumerate(manifest.trips):
+        slug = trip_slug(trip)
+        if slug in slugs:
+            raise ValueError(f"Trips {slugs[slug] + 1} and {index + 1} would both be written to {slug}.json; "
+                             f"give them different travellers or start dates")
+        slugs[slug] = index
+    return manifest
+
+
+def parse_date(text: str) -> datetime:
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized date {text!r}; use YYYY-MM-DD or MM/DD/YYYY")
+
+
+def trip_days(plan: DestinationPlan) -> int:
+    """Days at a destination, counted like the interface does (end - start); at least 1."""
+    if not plan.start_date or not plan.end_date:
+        return 1
+    return max(1, (parse_date(plan.end_date) - parse_date(plan.start_date)).days)
+
+
+def manifest_preferences(manifest: BatchManifest) -> Tuple[Dict[Tuple[str, str], Dict], Dict[Tuple[str, str, str], Dict], List[str]]:
+    """Each traveller's preferences, shaped like the stored ones, and a message for every conflict.
+
+    Returns general preferences per (traveller, country), destination preferences per
+    (traveller, country, destination) and the conflicts. Research is scoped to the traveller,
+    so travellers never share preferences; when one traveller lists a country or destination
+    more than once with different preferences, the first entry is used and the conflict reported.
+    """
+    general: Dict[Tuple[str, str], Dict] = {}
+    by_destination: Dict[Tuple[str, str, str], Dict] = {}
+    conflicts: List[str] = []
+    for trip in manifest.trips:
+        key = (trip.traveller, trip.country)
+        if key not in general:
+            general[key] = dict(trip.preferences)
+        elif general[key] != trip.preferences:
+            conflicts.append(f"{trip.traveller} lists {trip.country} more than once with different preferences; using the first")
+        for plan in trip.destinations:
+            key = (trip.traveller, trip.country, plan.name)
+            if key not in by_destination:
+                by_destination[key] = {'start_date': plan.start_date, 'end_date': plan.end_date, **plan.preferences}
+            elif {k: v for k, v in by_destination[key].items() if k not in ('start_date', 'end_date')} != plan.preferences:
+                conflicts.append(f"{trip.traveller} lists {plan.name}, {trip.country} more than once with different preferences; using the first")
+    return general, by_destination, conflicts
+
+
+def itinerary_json(routes: List[List[Tuple]]) -> List[List[Dict]]:
+    """The ordered places of each day as plain dicts."""
+    days = []
+    for route in routes:
+        stops = []
+        for place in route:
+            item = place[3]
+            location = place_location(place)
+            stops.append({
+                'title': item.proper_title,
+                'item_title': item.item_title,
+                'type': item.type,
+                'street_address': item.street_address,
+                'lat': location[0] if location else None,
+                'lng': location[1] if location else None,
+            })
+        days.append(stops)
+    return days
+
+
+def trip_slug(trip: TripPlan) -> str:
+    """File name of a trip without the extension: traveller and country, then the trip's first start date if it has one."""
+    parts = [trip.traveller, trip.country]
+    start_date = next((plan.start_date for plan in trip.destinations if plan.start_date), None)
+    if start_date:
+        parts.append(parse_date(start_date).strftime('%Y-%m-%d'))
+    return re.sub(r'[^\w-]+', '-', '-'.join(parts).casefold()).strip('-')
+
+
+def write_trip(output_dir: str, trip: TripPlan, itineraries: List[List[List[Dict]]]) -> str:
+    """Write a trip's itineraries, one per destination in trip order, to <output_dir>/<trip_slug>.json and return the path."""
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{trip_slug(trip)}.json")
+    result = {
+        'traveller': trip.traveller,
+        'country': trip.country,
+        'destinations': [
+            {'name': plan.name, 'start_date': plan.start_date, 'end_date': plan.end_date, 'days': trip_days(plan),
+             'itinerary': itinerary}
+            for plan, itinerary in zip(trip.destinations, itineraries)
+        ],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    return path
@@ -1,12 +1,21 @@
 import json
+import math
+import os
+import queue
 import re
 import sqlite3
 import sys
-from typing import Dict, List, Optional, Tuple
+import threading
+import zlib
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import numpy as np
 from langchain.output_parsers import PydanticOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import ValidationError, BaseModel, Field
+from libraries.geo import EARTH_RADIUS_KM, haversine_matrix
+from libraries.metrics import metrics
 
 np.set_printoptions(threshold = np.inf)
 
@@ -38,6 +47,53 @@ class ListsContainer(BaseModel):
     """A container for a list of lists of items."""
     lists: List[ItemList] = Field(description="The main list of requested lists")
     
+class LazyItem:
+    """Stand-in for an Item read from the places table.
+
+    proper_title, type and street_address come straight from their columns; pydantic_data is
+    only parsed the first time any other field is read or a field is assigned.
+    """
+
+    __slots__ = ('_proper_title', '_type', '_street_address', '_pydantic_data', '_item')
+
+    def __init__(self, proper_title: str, type: str, pydantic_data: str, street_address: Optional[str] = None):
+        object.__setattr__(self, '_proper_title', proper_title)
+        object.__setattr__(self, '_type', type)
+        object.__setattr__(self, '_street_address', street_address)
+        object.__setattr__(self, '_pydantic_data', pydantic_data)
+        object.__setattr__(self, '_item', None)
+
+    @property
+    def item(self) -> Item:
+        if self._item is None:
+            object.__setattr__(self, '_item', Item.parse_raw(self._pydantic_data))
+        return self._item
+
+    @property
+    def proper_title(self) -> str:
+        return self._proper_title if self._item is None else self._item.proper_title
+
+    @property
+    def type(self) -> str:
+        return self._type if self._item is None else self._item.type
+
+    @property
+    def street_address(self) -> Optional[str]:
+        return self._street_address if self._item is None else self._item.street_address
+
+    def json(self) -> str:
+        return self._pydantic_data if self._item is None else self._item.json()
+
+    def __getattr__(self, name):
+        return getattr(self.item, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.item, name, value)
+
+    def __repr__(self):
+        return repr(self.item)
+
+
 ################## UTILITY METHODS ##################
 
 def json_to_model(model, json_data):
@@ -46,34 +102,7 @@ def json_to_model(model, json_data):
     
 
 ################# DATABASE LAYER #################
-def save_data_to_db(db_path: str, data: List[Tuple]):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    for embedding, country, destination, pydantic_obj, api_responses in data:
-        embedding_bytes = embedding.tobytes() if embedding is not None else None
-        cursor.execute('''
-        INSERT INTO places (embedding, country, destination, proper_title, pydantic_data)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (embedding_bytes, country, destination, pydantic_obj.proper_title, pydantic_obj.json()))
-        
-        place_id = cursor.lastrowid
-        
-        if api_responses:
-            for response_type, response_data in api_responses.items():
-                cursor.execute('''
-                INSERT INTO google_api_responses (place_id, response_type, response_data)
-                VALUES (?, ?, ?)
-                ''', (place_id, response_type, json.dumps(response_data)))
-    
-    conn.commit()
-    conn.close()
-    
-    
-def load_data_from_db(db_path: str) -> List[Tuple]:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
+def _create_place_tables(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS places (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -81,10 +110,14 @@ def load_data_from_db(db_path: str) -> List[Tuple]:
         country TEXT,
         destination TEXT,
         proper_title TEXT,
-        pydantic_data TEXT
+        street_address TEXT,
+        pydantic_data TEXT,
+        type TEXT,
+        lat REAL,
+        lng REAL
     )
     ''')
-    
+
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS google_api_responses (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -94,46 +127,105 @@ def load_data_from_db(db_path: str) -> List[Tuple]:
         FOREIGN KEY(place_id) REFERENCES places(id)
     )
     ''')
-    
-    cursor.execute('SELECT id, embedding, country, destination, proper_title, pydantic_data FROM places')
-    rows = cursor.fetchall()
-    
-    data = []
-    for row in rows:
-        place_id, embedding_bytes, country, destination, proper_title, pydantic_data = row
-        embedding = np.frombuffer(embedding_bytes, dtype=np.float32) if embedding_bytes is not None else None
-        pydantic_obj = Item.parse_raw(pydantic_data)
-        
-        cursor.execute('SELECT response_type, response_data FROM google_api_responses WHERE place_id = ?', (place_id,))
-        api_rows = cursor.fetchall()
-        
-        api_responses = {}
-        for api_row in api_rows:
-            response_type, response_data = api_row
-            api_responses[response_type] = json.loads(response_data)
-        
-        data.append((embedding, country, destination, pydantic_obj, api_responses))
-    
-    conn.close()
-    return data
 
 
-def save_general_preferences(db_path: str, country: str, preferences: Dict):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
+def _index_exists(cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def _migrate_place_tables(cursor):
+    """Bring the place tables up to date: collapse duplicate rows and add the indexes the upserts and loader rely on."""
+    _create_place_tables(cursor)
+
+    if not _index_exists(cursor, 'idx_places_natural_key'):
+        # Older versions re-inserted the whole dataset on every save, so the newest copy of a place is the most complete
+        cursor.execute('''
+        DELETE FROM places WHERE id NOT IN (
+            SELECT MAX(id) FROM places GROUP BY country, destination, proper_title
+        )
+        ''')
+        cursor.execute('CREATE UNIQUE INDEX idx_places_natural_key ON places (country, destination, proper_title)')
+
+    if not _index_exists(cursor, 'idx_api_responses_place_type'):
+        cursor.execute('DELETE FROM google_api_responses WHERE place_id NOT IN (SELECT id FROM places)')
+        cursor.execute('''
+        DELETE FROM google_api_responses WHERE id NOT IN (
+            SELECT MAX(id) FROM google_api_responses GROUP BY place_id, response_type
+        )
+        ''')
+        # Also serves the place_id lookups and the ordered scan in load_data_from_db
+        cursor.execute('CREATE UNIQUE INDEX idx_api_responses_place_type ON google_api_responses (place_id, response_type)')
+
+    if not _index_exists(cursor, 'idx_places_country_destination_type'):
+        # Databases created before reset_database added these columns only have them inside pydantic_data
+        cursor.execute('PRAGMA table_info(places)')
+        columns = {row[1] for row in cursor.fetchall()}
+        for column in ('street_address', 'type'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE places ADD COLUMN {column} TEXT')
+        cursor.execute('''
+        UPDATE places SET
+            street_address = json_extract(pydantic_data, '$.street_address'),
+            type = json_extract(pydantic_data, '$.type')
+        WHERE type IS NULL
+        ''')
+        cursor.execute('CREATE INDEX idx_places_country_destination_type ON places (country, destination, type)')
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'places_rtree'")
+    if cursor.fetchone() is None:
+        # Coordinates used to live only in the geocode response JSON; copy them into typed columns and the R*Tree
+        cursor.execute('PRAGMA table_info(places)')
+        columns = {row[1] for row in cursor.fetchall()}
+        for column in ('lat', 'lng'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE places ADD COLUMN {column} REAL')
+        cursor.execute('''
+        UPDATE places SET
+            lat = (SELECT json_extract(response_data, '$.geometry.location.lat') FROM google_api_responses
+                   WHERE place_id = places.id AND response_type = 'geocode'),
+            lng = (SELECT json_extract(response_data, '$.geometry.location.lng') FROM google_api_responses
+                   WHERE place_id = places.id AND response_type = 'geocode')
+        WHERE lat IS NULL
+        ''')
+        cursor.execute('CREATE VIRTUAL TABLE places_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)')
+        cursor.execute('INSERT INTO places_rtree SELECT id, lat, lat, lng, lng FROM places WHERE lat IS NOT NULL AND lng IS NOT NULL')
+
+    # Keep the R*Tree in step with the lat/lng columns, whichever code writes them
     cursor.execute('''
-    INSERT OR REPLACE INTO general_preferences (country, preferences)
-    VALUES (?, ?)
-    ''', (country, json.dumps(preferences)))
-    
-    conn.commit()
-    conn.close()
+    CREATE TRIGGER IF NOT EXISTS places_rtree_insert AFTER INSERT ON places
+    WHEN new.lat IS NOT NULL AND new.lng IS NOT NULL BEGIN
+        INSERT OR REPLACE INTO places_rtree VALUES (new.id, new.lat, new.lat, new.lng, new.lng);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS places_rtree_update AFTER UPDATE OF lat, lng ON places BEGIN
+        DELETE FROM places_rtree WHERE id = old.id;
+        INSERT INTO places_rtree SELECT new.id, new.lat, new.lat, new.lng, new.lng WHERE new.lat IS NOT NULL AND new.lng IS NOT NULL;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS places_rtree_delete AFTER DELETE ON places BEGIN
+        DELETE FROM places_rtree WHERE id = old.id;
+    END
+    ''')
 
-def load_general_preferences(db_path: str, country: str) -> Dict:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
+    # Places that got their embedding after they were stored, which the persisted embedding index has
+    # not seen yet; EmbeddingIndex.add_new_places indexes them and save() clears them
+    cursor.execute('CREATE TABLE IF NOT EXISTS embedding_backfill (place_id INTEGER PRIMARY KEY)')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS places_embedding_backfill AFTER UPDATE OF embedding ON places
+    WHEN old.embedding IS NULL AND new.embedding IS NOT NULL BEGIN
+        INSERT OR IGNORE INTO embedding_backfill VALUES (new.id);
+    END
+    ''')
+
+    # Title trigrams used to be kept in a table as well; dedup uses the in-memory TitleIndex (see libraries/titles.py)
+    cursor.execute('DROP TRIGGER IF EXISTS place_trigrams_delete')
+    cursor.execute('DROP TABLE IF EXISTS place_trigrams')
+
+
+def _create_preference_tables(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS general_preferences (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -141,32 +233,7 @@ def load_general_preferences(db_path: str, country: str) -> Dict:
         preferences TEXT
     )
     ''')
-    
-    cursor.execute('SELECT preferences FROM general_preferences WHERE country = ?', (country,))
-    row = cursor.fetchone()
-    
-    conn.close()
-    
-    if row:
-        return json.loads(row[0])
-    return {}
-
-def save_destination_preferences(db_path: str, country: str, destination: str, preferences: Dict):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT OR REPLACE INTO destination_preferences (country, destination, preferences)
-    VALUES (?, ?, ?)
-    ''', (country, destination, json.dumps(preferences)))
-    
-    conn.commit()
-    conn.close()
 
-def load_destination_preferences(db_path: str, country: str, destination: str) -> Dict:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS destination_preferences (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -176,112 +243,889 @@ def load_destination_preferences(db_path: str, country: str, destination: str) -
         UNIQUE(country, destination)
     )
     ''')
-    
-    cursor.execute('SELECT preferences FROM destination_preferences WHERE country = ? AND destination = ?', (country, destination))
-    row = cursor.fetchone()
-    
-    conn.close()
-    
-    if row:
-        return json.loads(row[0])
-    return {}
-
-def reset_database(db_path: str):
-    """Drop all tables from the SQLite database and recreate them."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
 
-    # Drop all existing tables
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()
-    for table in tables:
-        cursor.execute(f"DROP TABLE IF EXISTS {table[0]}")
 
-    # Recreate tables
+def _create_embedding_tables(cursor):
+    # One row per (country, destination) holding the whole normalized embedding matrix (see libraries/embeddings.py)
     cursor.execute('''
-    CREATE TABLE places (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        embedding BLOB,
+    CREATE TABLE IF NOT EXISTS embedding_index (
         country TEXT,
         destination TEXT,
-        proper_title TEXT,
-        street_address TEXT,
-        pydantic_data TEXT,
-        type TEXT
+        dim INTEGER,
+        size INTEGER,
+        last_place_id INTEGER,
+        keys BLOB,
+        matrix BLOB,
+        PRIMARY KEY(country, destination)
     )
     ''')
 
+    # Vectors from the embedding API keyed by a hash of (model, text) (see EmbeddingCache)
     cursor.execute('''
-    CREATE TABLE google_api_responses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        place_id INTEGER,
-        response_type TEXT,
-        response_data TEXT,
-        FOREIGN KEY(place_id) REFERENCES places(id)
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        embedding BLOB
     )
     ''')
 
+
+def ivf_index_path(db_path: str) -> str:
+    """File next to the database that holds its IVF embedding index (see libraries/ann.py)."""
+    return os.path.splitext(db_path)[0] + '.ivf.npz'
+
+
+def _remove_ivf_index(db_path: str):
+    try:
+        os.remove(ivf_index_path(db_path))
+    except FileNotFoundError:
+        pass
+
+
+def _create_cache_tables(cursor):
+    # Google Maps responses keyed by a hash of the normalized (query, destination, response_type) (see libraries/maps.py)
     cursor.execute('''
-    CREATE TABLE general_preferences (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        country TEXT UNIQUE,
-        preferences TEXT
+    CREATE TABLE IF NOT EXISTS maps_cache (
+        key TEXT PRIMARY KEY,
+        lookup_key TEXT,
+        query TEXT,
+        destination TEXT,
+        response_type TEXT,
+        response_data TEXT,
+        created_at REAL,
+        last_access REAL
     )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_maps_cache_lookup_key ON maps_cache (lookup_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_maps_cache_last_access ON maps_cache (last_access)')
 
+    # Gemini responses keyed by a hash of (model, prompt, schema); country/destination scope invalidation (see libraries/llm_cache.py)
     cursor.execute('''
-    CREATE TABLE destination_preferences (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT,
+        prompt_hash TEXT,
+        schema_hash TEXT,
         country TEXT,
         destination TEXT,
-        preferences TEXT,
-        UNIQUE(country, destination)
+        response TEXT,
+        created_at REAL,
+        last_access REAL
     )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_scope ON llm_cache (country, destination)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)')
 
-    conn.commit()
-    conn.close()
-
-def clear_place_data(db_path: str):
-    """Clear all place-related records from the database."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
 
-    cursor.execute("DROP TABLE IF EXISTS places")
-    cursor.execute("DROP TABLE IF EXISTS google_api_responses")
-    conn.commit()
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS places (
+def _create_job_tables(cursor):
+    # One row per research request (country, destination, prompt_type) and scope (the traveller of a batch manifest,
+    # '' for interactive runs) with its state and retry schedule (see libraries/jobs.py)
+    columns = '''(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        embedding BLOB,
         country TEXT,
         destination TEXT,
-        proper_title TEXT,
-        pydantic_data TEXT
+        prompt_type TEXT,
+        scope TEXT DEFAULT '',
+        prompt_hash TEXT,
+        state TEXT,
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL DEFAULT 0,
+        last_error TEXT,
+        updated_at REAL,
+        UNIQUE(country, destination, prompt_type, scope)
+    )'''
+    cursor.execute('PRAGMA table_info(research_jobs)')
+    existing = [row[1] for row in cursor.fetchall()]
+    if existing and 'scope' not in existing:
+        # Widen the unique key to include the scope by rebuilding the table; ids are kept, so research_job_items stays valid
+        cursor.execute(f'CREATE TABLE research_jobs_scoped {columns}')
+        cursor.execute('''
+        INSERT INTO research_jobs_scoped (id, country, destination, prompt_type, prompt_hash, state, attempts, next_attempt_at, last_error, updated_at)
+        SELECT id, country, destination, prompt_type, prompt_hash, state, attempts, next_attempt_at, last_error, updated_at FROM research_jobs
+        ''')
+        cursor.execute('DROP TABLE research_jobs')
+        cursor.execute('ALTER TABLE research_jobs_scoped RENAME TO research_jobs')
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS research_jobs {columns}')
+
+    # Items of a job that have already been merged into places, so a resumed job skips them
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS research_job_items (
+        job_id INTEGER,
+        item_key TEXT,
+        PRIMARY KEY(job_id, item_key),
+        FOREIGN KEY(job_id) REFERENCES research_jobs(id)
     )
     ''')
-    
+
+    # Places each job's items were merged into, new or already known, so a traveller's itinerary uses their own research
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS google_api_responses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
+    CREATE TABLE IF NOT EXISTS research_job_places (
+        job_id INTEGER,
         place_id INTEGER,
-        response_type TEXT,
-        response_data TEXT,
-        FOREIGN KEY(place_id) REFERENCES places(id)
-    )
+        PRIMARY KEY(job_id, place_id),
+        FOREIGN KEY(job_id) REFERENCES research_jobs(id)
+    ) WITHOUT ROWID
     ''')
 
-    conn.commit()
-    conn.close()
 
-def clear_preferences(db_path: str):
-    """Clear all preference-related records from the database."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def _create_travel_tables(cursor):
+    # Travel distance/time between two places for a mode, from an API or estimated (see libraries/travel.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS travel_times (
+        origin_id INTEGER,
+        destination_id INTEGER,
+        mode TEXT,
+        distance_m REAL,
+        duration_s REAL,
+        source TEXT,
+        created_at REAL,
+        PRIMARY KEY(origin_id, destination_id, mode)
+    ) WITHOUT ROWID
+    ''')
+
+
+def _create_schema(cursor):
+    """Create or migrate every table used by the application."""
+    _migrate_place_tables(cursor)
+    _create_preference_tables(cursor)
+    _create_embedding_tables(cursor)
+    _create_cache_tables(cursor)
+    _create_job_tables(cursor)
+    _create_travel_tables(cursor)
+
+
+class PlaceStore:
+    """Long-lived, thread-safe handle on the SQLite database.
+
+    Connections are opened lazily (up to pool_size) and handed to one thread at a time, so a
+    single store can be shared by the research pipeline and the Gradio worker threads. The
+    schema is created or migrated once, when the store is opened. Each pooled connection keeps
+    its own prepared-statement cache, and writes are serialized through transaction().
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 4, synchronous: str = 'NORMAL', mmap_size: int = 256 * 1024 * 1024,
+                 cache_size: int = -64000, busy_timeout: float = 30.0, cached_statements: int = 256):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+
+        self._pool: queue.LifoQueue = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+
+        with self.transaction() as conn:
+            _create_schema(conn.cursor())
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Check a connection out of the pool, opening a new one or waiting if the pool is exhausted.
+
+        Inside transaction() the thread's transaction connection is returned instead.
+        """
+        conn = getattr(self._local, 'transaction', None)
+        if conn is not None:
+            yield conn
+            return
+
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_open = self._opened < self.pool_size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._pool_lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the enclosed statements as one write transaction, rolling back on error.
 
-    cursor.execute("DELETE FROM general_preferences")
-    cursor.execute("DELETE FROM destination_preferences")
+        Nested calls on the same thread join the outer transaction.
+        """
+        conn = getattr(self._local, 'transaction', None)
+        if conn is not None:
+            yield conn
+            return
 
-    conn.commit()
-    conn.close()
+        with self._write_lock, self.connection() as conn:
+            self._local.transaction = conn
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                conn.execute('COMMIT')
+            finally:
+                self._local.transaction = None
+
+    def close(self):
+        with self._pool_lock:
+            while True:
+                try:
+                    self._pool.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._opened -= 1
+
+
+_stores: Dict[str, PlaceStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path: str, **options) -> PlaceStore:
+    """Return the shared PlaceStore for db_path, opening it with the given options on first use."""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = PlaceStore(db_path, **options)
+        return store
+
+
+def _place_key(row: Tuple) -> Tuple[str, str, str]:
+    return row[1], row[2], row[3].proper_title
+
+
+class PlaceList(list):
+    """A list of place tuples that remembers which rows are already stored in the database.
+
+    Rows are immutable tuples, so replacing a row (or appending a new one) marks it as dirty.
+    Changes made to the Item in place are detected as well; in-place edits to the api_responses
+    dict are not, so replace the tuple when those change.
+    """
+
+    def __init__(self, rows=()):
+        super().__init__(rows)
+        self._persisted: Dict[Tuple[str, str, str], Tuple[Tuple, str]] = {}
+
+    def mark_clean(self, row: Tuple, pydantic_json: str):
+        self._persisted[_place_key(row)] = (row, pydantic_json)
+
+    def dirty_rows(self) -> List[Tuple[Tuple, str]]:
+        """Return (row, pydantic_json) for every row that is new or changed since it was last saved."""
+        dirty = []
+        for row in self:
+            pydantic_json = row[3].json()
+            persisted = self._persisted.get(_place_key(row))
+            if persisted is None or persisted[0] is not row or persisted[1] != pydantic_json:
+                dirty.append((row, pydantic_json))
+        return dirty
+
+
+class _Codes:
+    """Interned strings: each distinct value gets a small integer code."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def codes_of(self, value: Union[str, Iterable[str], None]) -> Optional[np.ndarray]:
+        if value is None:
+            return None
+        values = [value] if isinstance(value, str) else value
+        return np.array([self._codes[v] for v in values if v in self._codes], dtype=np.int32)
+
+
+class LazyResponses(Mapping):
+    """Read-only view of a place's Google API responses, decompressed on first access."""
+
+    __slots__ = ('_packed', '_responses')
+
+    def __init__(self, packed: Optional[bytes]):
+        self._packed = packed
+        self._responses = None
+
+    def _load(self) -> Dict:
+        if self._responses is None:
+            self._responses = json.loads(zlib.decompress(self._packed)) if self._packed else {}
+        return self._responses
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load()) if self._packed else 0
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+def _geocode_location(api_responses) -> Optional[Tuple[float, float]]:
+    """(lat, lng) from a place's geocode response, or None if it has none."""
+    try:
+        location = api_responses['geocode']['geometry']['location']
+        return float(location['lat']), float(location['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _pack_responses(api_responses) -> Optional[bytes]:
+    if isinstance(api_responses, LazyResponses):
+        return api_responses._packed
+    return zlib.compress(json.dumps(api_responses).encode('utf-8')) if api_responses else None
+
+
+class PlaceTable:
+    """Columnar store for places, a compact replacement for a list of place tuples.
+
+    Country, destination and type are interned to int32 codes, the geocoded lat/lng sit in
+    float arrays (NaN when unknown), embeddings in one float32 matrix, titles and street
+    addresses in lists.
+    Each Item is kept as its JSON and the API responses as compressed JSON; both are only
+    materialized when a row is read. Indexing, iteration, append, index() and row assignment
+    behave like the list of (embedding, country, destination, Item, api_responses) tuples, so
+    existing code keeps working. Rows read this way are snapshots: to change a place, assign
+    a new tuple to its position. Each row also remembers its places.id once it has been
+    loaded or saved (see place_id() and position_of()).
+    """
+
+    def __init__(self, rows: Iterable[Tuple] = ()):
+        self.countries, self.destinations, self.types = _Codes(), _Codes(), _Codes()
+        self._size = 0
+        self._country = np.empty(0, dtype=np.int32)
+        self._destination = np.empty(0, dtype=np.int32)
+        self._type = np.empty(0, dtype=np.int32)
+        self._id = np.empty(0, dtype=np.int64)
+        self._lat = np.empty(0)
+        self._lng = np.empty(0)
+        self._embeddings: Optional[np.ndarray] = None
+        self._has_embedding = np.empty(0, dtype=bool)
+        self.titles: List[str] = []
+        self.addresses: List[Optional[str]] = []
+        self._items: List[str] = []
+        self._responses: List[Optional[bytes]] = []
+        self._positions: Dict[Tuple[str, str, str], int] = {}
+        self._by_id: Dict[int, int] = {}
+        self._dirty = set()
+        for row in rows:
+            self.append(row)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, size: int):
+        capacity = len(self._country)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 64)
+        for name in ('_country', '_destination', '_type', '_id', '_lat', '_lng', '_has_embedding'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+        if self._embeddings is not None:
+            embeddings = np.zeros((capacity, self._embeddings.shape[1]), dtype=np.float32)
+            embeddings[:self._size] = self._embeddings[:self._size]
+            self._embeddings = embeddings
+
+    def _write(self, i: int, row: Tuple, item_json: Optional[str] = None, packed: Optional[bytes] = None,
+               location: Optional[Tuple[float, float]] = None):
+        embedding, country, destination, item, api_responses = row
+        if item_json is None:
+            item_json = item.json()
+        if packed is None:
+            packed = _pack_responses(api_responses)
+        if location is None and api_responses:
+            location = _geocode_location(api_responses)
+
+        self._country[i] = self.countries.code(country)
+        self._destination[i] = self.destinations.code(destination)
+        self._type[i] = self.types.code(item.type)
+        self._lat[i], self._lng[i] = location if location is not None else (np.nan, np.nan)
+        if embedding is not None:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((len(self._country), len(embedding)), dtype=np.float32)
+            elif len(embedding) != self._embeddings.shape[1]:
+                raise ValueError(f"Embedding dimension {len(embedding)} does not match table dimension {self._embeddings.shape[1]}")
+            self._embeddings[i] = embedding
+        self._has_embedding[i] = embedding is not None
+        self._items[i] = item_json
+        self._responses[i] = packed
+        self.titles[i] = item.proper_title
+        self.addresses[i] = item.street_address
+        self._positions[(country, destination, item.proper_title)] = i
+
+    def append(self, row: Tuple, item_json: Optional[str] = None, packed: Optional[bytes] = None,
+               location: Optional[Tuple[float, float]] = None, place_id: Optional[int] = None):
+        """Add a place tuple; the keyword arguments let loaders pass the stored forms of its fields directly."""
+        i = self._size
+        self._grow(i + 1)
+        self._size += 1
+        self.titles.append(None)
+        self.addresses.append(None)
+        self._items.append(None)
+        self._responses.append(None)
+        self._write(i, row, item_json, packed, location)
+        if place_id is not None:
+            self._id[i] = place_id
+            self._by_id[place_id] = i
+        self._dirty.add(i)
+
+    def _index(self, i: int) -> int:
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError("place index out of range")
+        return i
+
+    def row(self, i: int) -> Tuple:
+        i = self._index(i)
+        embedding = self._embeddings[i] if self._has_embedding[i] else None
+        item = LazyItem(self.titles[i], self.types.values[self._type[i]], self._items[i], self.addresses[i])
+        return (embedding, self.countries.values[self._country[i]], self.destinations.values[self._destination[i]],
+                item, LazyResponses(self._responses[i]))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(self._size))]
+        return self.row(i)
+
+    def __setitem__(self, i: int, row: Tuple):
+        i = self._index(i)
+        old_key = (self.countries.values[self._country[i]], self.destinations.values[self._destination[i]], self.titles[i])
+        if self._positions.get(old_key) == i:
+            del self._positions[old_key]
+        self._write(i, row)
+        if _place_key(row) != old_key and self._id[i]:
+            # A different place is stored under a new id, which save_data_to_db fills in
+            del self._by_id[int(self._id[i])]
+            self._id[i] = 0
+        self._dirty.add(i)
+
+    def __iter__(self) -> Iterator[Tuple]:
+        for i in range(self._size):
+            yield self.row(i)
+
+    def index(self, row: Tuple) -> int:
+        """Position of the place with the same (country, destination, proper_title) as row."""
+        try:
+            return self._positions[_place_key(row)]
+        except KeyError:
+            raise ValueError(f"{_place_key(row)} is not in the table") from None
+
+    def title_rows(self) -> Iterator[Tuple[str, str, str, Optional[str]]]:
+        """(country, destination, proper_title, street_address) of every row, in order, read from the columns."""
+        countries, destinations = self.countries.values, self.destinations.values
+        for i in range(self._size):
+            yield countries[self._country[i]], destinations[self._destination[i]], self.titles[i], self.addresses[i]
+
+    def place_id(self, i: int) -> Optional[int]:
+        """places.id of the row at position i, or None if it has not been saved yet."""
+        place_id = int(self._id[self._index(i)])
+        return place_id or None
+
+    def position_of(self, place_id: int) -> Optional[int]:
+        """Position of the row stored as places.id place_id, or None if it is not in the table."""
+        return self._by_id.get(place_id)
+
+    def set_place_ids(self, ids: Dict[Tuple[str, str, str], int]):
+        """Record the places.id of rows, keyed by (country, destination, proper_title)."""
+        for key, place_id in ids.items():
+            i = self._positions.get(key)
+            if i is not None:
+                self._id[i] = place_id
+                self._by_id[place_id] = i
+
+    def mask(self, country: Union[str, Iterable[str], None] = None, destination: Union[str, Iterable[str], None] = None,
+             place_type: Union[str, Iterable[str], None] = None) -> np.ndarray:
+        """Boolean mask of the rows matching the filters (each a value or a collection of values), evaluated on the codes."""
+        mask = np.ones(self._size, dtype=bool)
+        for codes, column in ((self.countries.codes_of(country), self._country), (self.destinations.codes_of(destination), self._destination),
+                              (self.types.codes_of(place_type), self._type)):
+            if codes is not None:
+                mask &= np.isin(column[:self._size], codes)
+        return mask
+
+    def coordinates(self, indexes: Optional[Iterable[int]] = None) -> np.ndarray:
+        """(n, 2) array of [lat, lng] for the given rows (all rows by default); NaN where not geocoded."""
+        coords = np.column_stack((self._lat[:self._size], self._lng[:self._size]))
+        return coords if indexes is None else coords[np.asarray(list(indexes), dtype=int)]
+
+    @property
+    def embeddings(self) -> Optional[np.ndarray]:
+        """The embedding matrix (rows without an embedding are zero; see has_embedding)."""
+        return None if self._embeddings is None else self._embeddings[:self._size]
+
+    @property
+    def has_embedding(self) -> np.ndarray:
+        return self._has_embedding[:self._size]
+
+    def item(self, i: int) -> Item:
+        return Item.parse_raw(self._items[self._index(i)])
+
+    def api_responses(self, i: int) -> Dict:
+        return dict(LazyResponses(self._responses[self._index(i)]))
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the table, strings included."""
+        arrays = sum(getattr(self, name).nbytes for name in ('_country', '_destination', '_type', '_id', '_lat', '_lng', '_has_embedding'))
+        if self._embeddings is not None:
+            arrays += self._embeddings.nbytes
+        strings = sum(sys.getsizeof(s) for strings in (self.titles, self.addresses, self._items) for s in strings)
+        responses = sum(sys.getsizeof(r) for r in self._responses if r is not None)
+        return arrays + strings + responses
+
+    def mark_clean(self, row: Tuple, pydantic_json: str):
+        position = self._positions.get(_place_key(row))
+        if position is not None:
+            self._dirty.discard(position)
+
+    def dirty_rows(self) -> List[Tuple[Tuple, str]]:
+        """Return (row, pydantic_json) for every row appended or replaced since it was last saved."""
+        return [(self.row(i), self._items[i]) for i in sorted(self._dirty)]
+
+
+@metrics.timed('db.save_data_to_db')
+def save_data_to_db(db_path: str, data: List[Tuple]):
+    """Upsert new or changed places (and their Google API responses) in a single transaction.
+
+    When data is a PlaceList or PlaceTable only its dirty rows are written; a plain list is upserted in full.
+    A PlaceTable also learns the places.id of the rows it saved.
+    """
+    tracked = isinstance(data, (PlaceList, PlaceTable))
+    if tracked:
+        rows = data.dirty_rows()
+    else:
+        rows = [(row, row[3].json()) for row in data]
+
+    metrics.count('db.rows_saved', len(rows))
+    if not rows:
+        return
+
+    place_params = []
+    response_params = []
+    for (embedding, country, destination, pydantic_obj, api_responses), pydantic_json in rows:
+        embedding_bytes = embedding.tobytes() if embedding is not None else None
+        lat, lng = _geocode_location(api_responses) or (None, None)
+        place_params.append((embedding_bytes, country, destination, pydantic_obj.proper_title, pydantic_obj.street_address, pydantic_json, pydantic_obj.type, lat, lng))
+
+        if api_responses:
+            for response_type, response_data in api_responses.items():
+                response_params.append((country, destination, pydantic_obj.proper_title, response_type, json.dumps(response_data)))
+
+    with get_store(db_path).transaction() as conn:
+        _upsert_places(conn, place_params, response_params)
+        if isinstance(data, PlaceTable):
+            data.set_place_ids(_place_ids(conn, [_place_key(row) for row, _ in rows]))
+
+    if tracked:
+        for row, pydantic_json in rows:
+            data.mark_clean(row, pydantic_json)
+
+
+def _upsert_places(conn: sqlite3.Connection, place_params: List[Tuple], response_params: List[Tuple]):
+    conn.executemany('''
+    INSERT INTO places (embedding, country, destination, proper_title, street_address, pydantic_data, type, lat, lng)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(country, destination, proper_title) DO UPDATE SET
+        embedding = COALESCE(excluded.embedding, places.embedding),
+        street_address = excluded.street_address,
+        pydantic_data = excluded.pydantic_data,
+        type = excluded.type,
+        lat = COALESCE(excluded.lat, places.lat),
+        lng = COALESCE(excluded.lng, places.lng)
+    ''', place_params)
+
+    conn.executemany('''
+    INSERT INTO google_api_responses (place_id, response_type, response_data)
+    VALUES ((SELECT id FROM places WHERE country = ? AND destination = ? AND proper_title = ?), ?, ?)
+    ON CONFLICT(place_id, response_type) DO UPDATE SET
+        response_data = excluded.response_data
+    ''', response_params)
+    
+    
+def _place_ids(conn: sqlite3.Connection, keys: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], int]:
+    """places.id of each (country, destination, proper_title) key, looked up a few hundred keys per query."""
+    ids = {}
+    # Three parameters per key, well below SQLite's bound-parameter limit
+    for start in range(0, len(keys), 300):
+        chunk = keys[start:start + 300]
+        for place_id, country, destination, proper_title in conn.execute(f'''
+            SELECT id, country, destination, proper_title FROM places
+            WHERE (country, destination, proper_title) IN (VALUES {", ".join(["(?, ?, ?)"] * len(chunk))})
+            ''', [value for key in chunk for value in key]):
+            ids[(country, destination, proper_title)] = place_id
+    return ids
+
+
+@metrics.timed('db.load_data_from_db')
+def load_data_from_db(db_path: str) -> List[Tuple]:
+    """Load every place with its Google API responses using one pass over each table."""
+    frombuffer = np.frombuffer
+    parse_item = Item.parse_raw
+    loads = json.loads
+
+    # Group responses by place up front (the scan is ordered by the place_id index) instead of one query per place
+    api_by_place: Dict[int, Dict] = {}
+    data = PlaceList()
+    append = data.append
+    mark_clean = data.mark_clean
+
+    with get_store(db_path).connection() as conn:
+        for place_id, response_type, response_data in conn.execute('SELECT place_id, response_type, response_data FROM google_api_responses ORDER BY place_id'):
+            api_responses = api_by_place.get(place_id)
+            if api_responses is None:
+                api_responses = api_by_place[place_id] = {}
+            api_responses[response_type] = loads(response_data)
+
+        for place_id, embedding_bytes, country, destination, pydantic_data in conn.execute('SELECT id, embedding, country, destination, pydantic_data FROM places ORDER BY id'):
+            embedding = frombuffer(embedding_bytes, dtype=np.float32) if embedding_bytes is not None else None
+            place = (embedding, country, destination, parse_item(pydantic_data), api_by_place.get(place_id, {}))
+            append(place)
+            mark_clean(place, pydantic_data)
+
+    return data
+
+
+def _as_filter(column: str, value: Union[str, Iterable[str], None]) -> Tuple[str, List[str]]:
+    if value is None:
+        return '', []
+    values = [value] if isinstance(value, str) else list(value)
+    return f'{column} IN ({", ".join("?" * len(values))})', values
+
+
+BBox = Tuple[float, float, float, float]
+
+
+def _place_filters(country, destination, place_type, bbox: Optional[BBox] = None, ids: Optional[Iterable[int]] = None) -> Tuple[str, List]:
+    """WHERE clause and parameters for the place filters; bbox is (min_lat, min_lng, max_lat, max_lng)."""
+    clauses, params = [], []
+    for column, value in (('country', country), ('destination', destination), ('type', place_type), ('id', ids)):
+        clause, values = _as_filter(column, value)
+        if clause:
+            clauses.append(clause)
+            params.extend(values)
+    if bbox is not None:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        # The R*Tree narrows the candidates (its float32 boxes are rounded outwards); the columns give the exact test
+        clauses.append('id IN (SELECT id FROM places_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lng >= ? AND min_lng <= ?)'
+                       ' AND lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?')
+        params.extend((min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng))
+    return (f'WHERE {" AND ".join(clauses)}' if clauses else ''), params
+
+
+def iter_places(db_path: str, country: Union[str, Iterable[str], None] = None, destination: Union[str, Iterable[str], None] = None,
+                place_type: Union[str, Iterable[str], None] = None, batch_size: int = 500, bbox: Optional[BBox] = None,
+                ids: Optional[Iterable[int]] = None) -> Iterator[Tuple]:
+    """Yield place tuples matching the given filters, with the Item parsed lazily.
+
+    Each filter takes a single value or a collection of values and is evaluated in SQL, so
+    rows for other countries, destinations or types are never read. bbox limits the places to
+    a (min_lat, min_lng, max_lat, max_lng) box using the R*Tree and ids to the given places.id
+    values. Rows are fetched in batches of batch_size together with their Google API responses.
+    """
+    where, params = _place_filters(country, destination, place_type, bbox, ids)
+
+    with get_store(db_path).connection() as conn:
+        cursor = conn.execute(f'SELECT id, embedding, country, destination, proper_title, type, pydantic_data, street_address FROM places {where} ORDER BY id', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            api_by_place: Dict[int, Dict] = {row[0]: {} for row in rows}
+            response_cursor = conn.execute(
+                f'SELECT place_id, response_type, response_data FROM google_api_responses WHERE place_id IN ({", ".join("?" * len(rows))})',
+                list(api_by_place)
+            )
+            for place_id, response_type, response_data in response_cursor:
+                api_by_place[place_id][response_type] = json.loads(response_data)
+
+            for place_id, embedding_bytes, row_country, row_destination, proper_title, row_type, pydantic_data, street_address in rows:
+                embedding = np.frombuffer(embedding_bytes, dtype=np.float32) if embedding_bytes is not None else None
+                item = LazyItem(proper_title, row_type, pydantic_data, street_address)
+                yield embedding, row_country, row_destination, item, api_by_place[place_id]
+
+
+def load_places(db_path: str, country: Union[str, Iterable[str], None] = None, destination: Union[str, Iterable[str], None] = None,
+                place_type: Union[str, Iterable[str], None] = None, bbox: Optional[BBox] = None) -> PlaceList:
+    """Like load_data_from_db, but only for the places matching the filters (see iter_places)."""
+    data = PlaceList()
+    for place in iter_places(db_path, country, destination, place_type, bbox=bbox):
+        data.append(place)
+        data.mark_clean(place, place[3].json())
+    return data
+
+
+@metrics.timed('db.load_place_table')
+def load_place_table(db_path: str, country: Union[str, Iterable[str], None] = None, destination: Union[str, Iterable[str], None] = None,
+                     place_type: Union[str, Iterable[str], None] = None, bbox: Optional[BBox] = None) -> PlaceTable:
+    """Like load_places, but into a PlaceTable; Items and API responses are stored without being parsed."""
+    where, params = _place_filters(country, destination, place_type, bbox)
+
+    table = PlaceTable()
+    with get_store(db_path).connection() as conn:
+        # Each place's responses are joined into one JSON object as text; the location comes from the lat/lng columns
+        responses: Dict[int, List[str]] = {}
+        for place_id, response_type, response_data in conn.execute(f'''
+            SELECT place_id, response_type, response_data FROM google_api_responses
+            WHERE place_id IN (SELECT id FROM places {where})
+            ''', params):
+            responses.setdefault(place_id, []).append(f'{json.dumps(response_type)}: {response_data}')
+
+        for place_id, embedding_bytes, row_country, row_destination, proper_title, row_type, pydantic_data, street_address, lat, lng in conn.execute(
+                f'SELECT id, embedding, country, destination, proper_title, type, pydantic_data, street_address, lat, lng FROM places {where} ORDER BY id', params):
+            embedding = np.frombuffer(embedding_bytes, dtype=np.float32) if embedding_bytes is not None else None
+            parts = responses.pop(place_id, None)
+            packed = zlib.compress(('{' + ', '.join(parts) + '}').encode('utf-8')) if parts else None
+            place = (embedding, row_country, row_destination, LazyItem(proper_title, row_type, pydantic_data, street_address), None)
+            location = (lat, lng) if lat is not None and lng is not None else (np.nan, np.nan)
+            table.append(place, item_json=pydantic_data, packed=packed, location=location, place_id=place_id)
+            table.mark_clean(place, pydantic_data)
+    return table
+
+
+def bbox_around(lat: float, lng: float, radius_km: float) -> BBox:
+    """(min_lat, min_lng, max_lat, max_lng) box that contains the circle of radius_km around (lat, lng)."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlng = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 1e-6)))
+    return max(-90.0, lat - dlat), max(-180.0, lng - dlng), min(90.0, lat + dlat), min(180.0, lng + dlng)
+
+
+def places_near(db_path: str, lat: float, lng: float, radius_km: float, country: Union[str, Iterable[str], None] = None,
+                destination: Union[str, Iterable[str], None] = None, place_type: Union[str, Iterable[str], None] = None) -> List[Tuple[float, Tuple]]:
+    """(distance_km, place) for the places within radius_km of (lat, lng), nearest first.
+
+    Candidates come from the R*Tree box around the circle; only they are checked with the
+    haversine distance, using the lat/lng columns rather than the stored responses.
+    """
+    with get_store(db_path).connection() as conn:
+        where, params = _place_filters(country, destination, place_type, bbox_around(lat, lng, radius_km))
+        candidates = conn.execute(f'SELECT id, lat, lng FROM places {where}', params).fetchall()
+    if not candidates:
+        return []
+
+    distances = haversine_matrix(np.array([[lat, lng]]), np.array([row[1:] for row in candidates], dtype=float))[0]
+    within = {candidates[i][0]: float(distances[i]) for i in np.flatnonzero(distances <= radius_km)}
+    if not within:
+        return []
+
+    # iter_places yields in id order, so the places line up with the sorted ids
+    ids = sorted(within)
+    places = [(within[place_id], place) for place_id, place in zip(ids, iter_places(db_path, ids=ids))]
+    places.sort(key=lambda pair: pair[0])
+    return places
+
+
+def save_general_preferences(db_path: str, country: str, preferences: Dict):
+    with get_store(db_path).transaction() as conn:
+        conn.execute('''
+        INSERT OR REPLACE INTO general_preferences (country, preferences)
+        VALUES (?, ?)
+        ''', (country, json.dumps(preferences)))
+        # General preferences feed every prompt for the country
+        conn.execute('DELETE FROM llm_cache WHERE country = ?', (country,))
+        # Research done with the old preferences has to run again (batch manifests carry their own preferences)
+        for table in ('research_job_items', 'research_job_places'):
+            conn.execute(f"DELETE FROM {table} WHERE job_id IN (SELECT id FROM research_jobs WHERE country = ? AND scope = '')", (country,))
+        conn.execute("DELETE FROM research_jobs WHERE country = ? AND scope = ''", (country,))
+
+def load_general_preferences(db_path: str, country: str) -> Dict:
+    with get_store(db_path).connection() as conn:
+        row = conn.execute('SELECT preferences FROM general_preferences WHERE country = ?', (country,)).fetchone()
+
+    if row:
+        return json.loads(row[0])
+    return {}
+
+def save_destination_preferences(db_path: str, country: str, destination: str, preferences: Dict):
+    with get_store(db_path).transaction() as conn:
+        conn.execute('''
+        INSERT OR REPLACE INTO destination_preferences (country, destination, preferences)
+        VALUES (?, ?, ?)
+        ''', (country, destination, json.dumps(preferences)))
+        # Cached Gemini responses for this destination were generated from the old preferences
+        conn.execute('DELETE FROM llm_cache WHERE country = ? AND destination = ?', (country, destination))
+        for table in ('research_job_items', 'research_job_places'):
+            conn.execute(f"DELETE FROM {table} WHERE job_id IN (SELECT id FROM research_jobs WHERE country = ? AND destination = ? AND scope = '')",
+                         (country, destination))
+        conn.execute("DELETE FROM research_jobs WHERE country = ? AND destination = ? AND scope = ''", (country, destination))
+
+def load_destination_preferences(db_path: str, country: str, destination: str) -> Dict:
+    with get_store(db_path).connection() as conn:
+        row = conn.execute('SELECT preferences FROM destination_preferences WHERE country = ? AND destination = ?', (country, destination)).fetchone()
+
+    if row:
+        return json.loads(row[0])
+    return {}
+
+def reset_database(db_path: str):
+    """Drop all tables from the SQLite database and recreate them."""
+    with get_store(db_path).transaction() as conn:
+        cursor = conn.cursor()
+
+        # Drop all existing tables; virtual tables first, since dropping one also drops its shadow tables
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY sql NOT LIKE 'CREATE VIRTUAL%'")
+        tables = cursor.fetchall()
+        for table in tables:
+            cursor.execute(f"DROP TABLE IF EXISTS {table[0]}")
+
+        # Recreate tables
+        _create_schema(cursor)
+    _remove_ivf_index(db_path)
+
+def clear_place_data(db_path: str):
+    """Clear all place-related records from the database."""
+    with get_store(db_path).transaction() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("DROP TABLE IF EXISTS places_rtree")
+        # Keyed on place ids, which are reused once places is recreated
+        cursor.execute("DELETE FROM travel_times")
+        cursor.execute("DROP TABLE IF EXISTS places")
+        cursor.execute("DROP TABLE IF EXISTS google_api_responses")
+        cursor.execute("DELETE FROM embedding_index")
+        cursor.execute("DROP TABLE IF EXISTS embedding_backfill")
+        # Finished research jobs would otherwise never refill the cleared places
+        cursor.execute("DELETE FROM research_job_items")
+        cursor.execute("DELETE FROM research_job_places")
+        cursor.execute("DELETE FROM research_jobs")
+
+        _migrate_place_tables(cursor)
+    _remove_ivf_index(db_path)
+
+def clear_preferences(db_path: str):
+    """Clear all preference-related records from the database."""
+    with get_store(db_path).transaction() as conn:
+        conn.execute("DELETE FROM general_preferences")
+        conn.execute("DELETE FROM destination_preferences")
@@ -0,0 +1,322 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from libraries.data import get_store
+from libraries.metrics import metrics
+
+# Minimum cosine similarity for two places to be treated as the same entry
+MATCH_THRESHOLD = 0.93
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of vectors with every row scaled to unit length (zero rows stay zero)."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indexes of the k highest scores in each row of a 2-D score matrix, best first."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class _Partition:
+    """Contiguous, pre-normalized embedding matrix for one (country, destination)."""
+
+    __slots__ = ('matrix', 'keys', 'size')
+
+    def __init__(self, matrix: np.ndarray, keys: np.ndarray):
+        self.matrix = matrix
+        self.keys = keys
+        self.size = len(keys)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.matrix[:self.size]
+
+    def add(self, keys: np.ndarray, vectors: np.ndarray):
+        needed = self.size + len(keys)
+        if needed > len(self.matrix) or not self.matrix.flags.writeable:
+            # Grow geometrically so appends are amortized O(1); this also copies read-only arrays loaded from the database
+            capacity = max(needed, 2 * len(self.matrix), 64)
+            matrix = np.empty((capacity, self.matrix.shape[1]), dtype=np.float32)
+            matrix[:self.size] = self.matrix[:self.size]
+            all_keys = np.empty(capacity, dtype=np.int64)
+            all_keys[:self.size] = self.keys[:self.size]
+            self.matrix, self.keys = matrix, all_keys
+        self.matrix[self.size:needed] = vectors
+        self.keys[self.size:needed] = keys
+        self.size = needed
+
+
+class EmbeddingIndex:
+    """In-memory cosine-similarity index over place embeddings, partitioned by (country, destination).
+
+    Each partition keeps its embeddings in one contiguous float32 matrix of unit-length rows, so a
+    query is a single matrix-vector (or matrix-matrix, for batches) product. Keys are integers
+    chosen by the caller: from_places() uses positions in the data list, while load() uses
+    places.id. Only an index keyed by places.id can be saved, since load() tops it up with the
+    places rows added after it, and with the older rows whose embedding was only filled in
+    later (recorded in embedding_backfill until the next save).
+    """
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = dim
+        self.last_place_id = 0
+        self.keyed_by_position = False
+        self._partitions: Dict[Tuple[str, str], _Partition] = {}
+        # Backfilled places indexed since the last save
+        self._backfilled: Set[int] = set()
+
+    def __len__(self) -> int:
+        return sum(partition.size for partition in self._partitions.values())
+
+    @classmethod
+    def from_places(cls, data: List[Tuple], **options) -> 'EmbeddingIndex':
+        """Index the place tuples that have an embedding, keyed by their position in data.
+
+        Extra keyword arguments are passed to the constructor.
+        """
+        grouped: Dict[Tuple[str, str], Tuple[List[int], List[np.ndarray]]] = {}
+        for i, (embedding, country, destination, _, _) in enumerate(data):
+            if embedding is not None:
+                keys, vectors = grouped.setdefault((country, destination), ([], []))
+                keys.append(i)
+                vectors.append(embedding)
+
+        index = cls(**options)
+        index.keyed_by_position = True
+        for (country, destination), (keys, vectors) in grouped.items():
+            index.add_batch(country, destination, keys, np.stack(vectors))
+        return index
+
+    def add(self, country: str, destination: str, key: int, embedding: np.ndarray):
+        self.add_batch(country, destination, [key], embedding)
+
+    def add_batch(self, country: str, destination: str, keys: Iterable[int], embeddings: np.ndarray):
+        vectors = normalize_rows(embeddings)
+        keys = np.asarray(list(keys), dtype=np.int64)
+        if len(keys) != len(vectors):
+            raise ValueError(f"Got {len(keys)} keys for {len(vectors)} embeddings")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+
+        partition = self._partitions.get((country, destination))
+        if partition is None:
+            partition = self._partitions[(country, destination)] = _Partition(np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.int64))
+        partition.add(keys, vectors)
+
+    def search(self, country: str, destination: str, embedding: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        """Return up to k (key, cosine similarity) pairs for the closest places, best first."""
+        keys, scores = self.search_batch(country, destination, embedding, k)
+        return list(zip(keys[0].tolist(), scores[0].tolist()))
+
+    def search_batch(self, country: str, destination: str, embeddings: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k search for several query embeddings at once.
+
+        Returns (keys, scores) arrays of shape (queries, min(k, partition size)).
+        """
+        queries = normalize_rows(embeddings)
+        partition = self._partitions.get((country, destination))
+        if partition is None or partition.size == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        scores = queries @ partition.vectors.T
+        best = top_k(scores, k)
+        return partition.keys[best], np.take_along_axis(scores, best, axis=1)
+
+    def best_match(self, country: str, destination: str, embedding: np.ndarray, threshold: float = MATCH_THRESHOLD) -> Optional[int]:
+        """Key of the most similar place if its similarity reaches threshold, otherwise None."""
+        matches = self.search(country, destination, embedding, k=1)
+        if matches and matches[0][1] >= threshold:
+            return matches[0][0]
+        return None
+
+    def save(self, db_path: str):
+        """Persist every partition as a single matrix blob, keyed by places.id."""
+        if self.keyed_by_position:
+            raise ValueError("An index built by from_places() is keyed by data positions, not places.id, and cannot be saved")
+        params = [
+            (country, destination, self.dim, partition.size, self.last_place_id, partition.keys[:partition.size].tobytes(), partition.vectors.tobytes())
+            for (country, destination), partition in self._partitions.items()
+        ]
+        with get_store(db_path).transaction() as conn:
+            conn.execute('DELETE FROM embedding_index')
+            conn.executemany('''
+            INSERT INTO embedding_index (country, destination, dim, size, last_place_id, keys, matrix)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', params)
+            self._saved_backfill(conn)
+
+    def _saved_backfill(self, conn):
+        """Forget the backfilled places that are now part of the saved index."""
+        conn.executemany('DELETE FROM embedding_backfill WHERE place_id = ?', [(place_id,) for place_id in self._backfilled])
+        self._backfilled.clear()
+
+    @classmethod
+    def load(cls, db_path: str) -> 'EmbeddingIndex':
+        """Load the persisted index, then add any places inserted since it was saved.
+
+        Persisted partitions are wrapped with np.frombuffer, so loading costs one read per
+        partition rather than a copy per place.
+        """
+        index = cls()
+        with get_store(db_path).connection() as conn:
+            for country, destination, dim, size, last_place_id, keys, matrix in conn.execute(
+                'SELECT country, destination, dim, size, last_place_id, keys, matrix FROM embedding_index'
+            ):
+                index.dim = dim
+                index.last_place_id = max(index.last_place_id, last_place_id)
+                index._partitions[(country, destination)] = _Partition(
+                    np.frombuffer(matrix, dtype=np.float32).reshape(size, dim),
+                    np.frombuffer(keys, dtype=np.int64)
+                )
+
+            index.add_new_places(conn)
+        return index
+
+    def add_new_places(self, conn):
+        """Index places rows with an embedding and an id above last_place_id, and the backfilled rows below it."""
+        grouped: Dict[Tuple[str, str], Tuple[List[int], List[bytes]]] = {}
+        for place_id, country, destination, embedding_bytes in conn.execute('''
+            SELECT id, country, destination, embedding FROM places JOIN embedding_backfill ON embedding_backfill.place_id = places.id
+            WHERE id <= ? AND embedding IS NOT NULL
+            ''', (self.last_place_id,)
+        ):
+            if place_id in self._backfilled:
+                continue
+            self._backfilled.add(place_id)
+            keys, blobs = grouped.setdefault((country, destination), ([], []))
+            keys.append(place_id)
+            blobs.append(embedding_bytes)
+
+        # A row stored without an embedding and above last_place_id is indexed here once it gets one; its
+        # embedding_backfill entry is then cleared by save() like the others
+        for place_id, country, destination, embedding_bytes, backfilled in conn.execute('''
+            SELECT id, country, destination, embedding, embedding_backfill.place_id IS NOT NULL
+            FROM places LEFT JOIN embedding_backfill ON embedding_backfill.place_id = places.id
+            WHERE id > ? AND embedding IS NOT NULL ORDER BY id
+            ''', (self.last_place_id,)
+        ):
+            if backfilled:
+                self._backfilled.add(place_id)
+            keys, blobs = grouped.setdefault((country, destination), ([], []))
+            keys.append(place_id)
+            blobs.append(embedding_bytes)
+            self.last_place_id = place_id
+
+        for (country, destination), (keys, blobs) in grouped.items():
+            vectors = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(keys), -1)
+            self.add_batch(country, destination, keys, vectors)
+
+
+def embedding_text(country: str, destination: str, proper_title: str) -> str:
+    """Text embedded for a place, normalized so trivial spacing/case differences share a cache entry."""
+    return re.sub(r'\s+', ' ', f"{country} {destination} {proper_title}").strip().casefold()
+
+
+class EmbeddingCache:
+    """Persistent embedding vectors in the embedding_cache table, keyed by a hash of (model, text)."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    @staticmethod
+    def key(text: str, model_name: str) -> str:
+        return hashlib.sha256(f"{model_name}\x1f{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: List[str], model_name: str) -> Dict[str, np.ndarray]:
+        keys = {self.key(text, model_name): text for text in texts}
+        found = {}
+        with get_store(self.db_path).connection() as conn:
+            key_list = list(keys)
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                for key, embedding in conn.execute(f'SELECT key, embedding FROM embedding_cache WHERE key IN ({", ".join("?" * len(chunk))})', chunk):
+                    found[keys[key]] = np.frombuffer(embedding, dtype=np.float32)
+        return found
+
+    def put_many(self, texts: List[str], embeddings: List[np.ndarray], model_name: str):
+        with get_store(self.db_path).transaction() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO embedding_cache (key, model, embedding) VALUES (?, ?, ?)',
+                [(self.key(text, model_name), model_name, np.asarray(embedding, dtype=np.float32).tobytes()) for text, embedding in zip(texts, embeddings)]
+            )
+
+
+def embed_texts(texts: List[str], model_name: str, embed_batch: Callable[[List[str]], List], cache: Optional[EmbeddingCache] = None,
+                batch_size: int = 100) -> List[np.ndarray]:
+    """Embed texts with as few embed_batch calls as possible.
+
+    Cached texts cost nothing; the remaining distinct texts are sent to embed_batch in chunks of
+    batch_size, and the new vectors are written back to the cache.
+    """
+    found = cache.get_many(texts, model_name) if cache is not None else {}
+    missing = list(dict.fromkeys(text for text in texts if text not in found))
+    metrics.cache('embedding_cache', hits=len(found), misses=len(missing))
+
+    for start in range(0, len(missing), batch_size):
+        chunk = missing[start:start + batch_size]
+        vectors = [np.asarray(vector, dtype=np.float32) for vector in embed_batch(chunk)]
+        if len(vectors) != len(chunk):
+            raise ValueError(f"Embedding model returned {len(vectors)} vectors for {len(chunk)} texts")
+        found.update(zip(chunk, vectors))
+        if cache is not None:
+            cache.put_many(chunk, vectors, model_name)
+
+    return [found[text] for text in texts]
+
+
+def batch_embedder(embed_one: Callable[[str], Optional[Sequence[float]]], max_workers: int = 8) -> Callable[[List[str]], List]:
+    """An embed_batch for embed_texts built on a one-text embedding function, with up to max_workers calls in flight.
+
+    A text that gets no vector raises ValueError, so a failed batch is never cached.
+    """
+    def embed_batch(texts: List[str]) -> List:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(texts))), thread_name_prefix="embedding") as executor:
+            vectors = list(executor.map(embed_one, texts))
+        for text, vector in zip(texts, vectors):
+            if vector is None or len(vector) == 0:
+                raise ValueError(f"No embedding returned for {text!r}")
+        return vectors
+    return embed_batch
+
+
+class FakeEmbedder:
+    """Deterministic local stand-in for the embedding API.
+
+    Texts are embedded as hashed bags of character trigrams, so similar titles get similar
+    vectors and the same text always gets the same vector.
+    """
+
+    model_name = 'fake-trigram-embedder'
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.calls = 0
+
+    def __call__(self, texts: List[str]) -> List[np.ndarray]:
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f"  {text.casefold()} "
+            for i in range(len(padded) - 2):
+                digest = hashlib.blake2b(padded[i:i + 3].encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest, 'little')
+                vectors[row, bucket % self.dim] += 1.0 if bucket & (1 << 63) else -1.0
+        return list(normalize_rows(vectors))
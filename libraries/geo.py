@@ -0,0 +1,175 @@
+import math
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def place_location(place: Tuple) -> Optional[Tuple[float, float]]:
+    """(lat, lng) from a place tuple's geocode response, or None if it was never geocoded."""
+    try:
+        location = place[4]['geocode']['geometry']['location']
+        return float(location['lat']), float(location['lng'])
+    except (KeyError, TypeError, IndexError):
+        return None
+
+
+def place_coordinates(places: List[Tuple]) -> np.ndarray:
+    """(n, 2) array of [lat, lng] degrees for places; rows without a geocode are NaN."""
+    coords = np.full((len(places), 2), np.nan)
+    for i, place in enumerate(places):
+        location = place_location(place)
+        if location is not None:
+            coords[i] = location
+    return coords
+
+
+def haversine_matrix(coords_a: np.ndarray, coords_b: Optional[np.ndarray] = None) -> np.ndarray:
+    """Great-circle distances in km between every row of coords_a and every row of coords_b ([lat, lng] degrees)."""
+    if coords_b is None:
+        coords_b = coords_a
+    lat_a, lng_a = np.radians(coords_a[:, 0])[:, np.newaxis], np.radians(coords_a[:, 1])[:, np.newaxis]
+    lat_b, lng_b = np.radians(coords_b[:, 0])[np.newaxis, :], np.radians(coords_b[:, 1])[np.newaxis, :]
+    a = np.sin((lat_b - lat_a) / 2) ** 2 + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def project_km(coords: np.ndarray, ref_lat: Optional[float] = None) -> np.ndarray:
+    """Equirectangular projection to km around ref_lat (default: the points' mean latitude); accurate at city scale."""
+    if ref_lat is None:
+        ref_lat = float(np.nanmean(coords[:, 0]))
+    return np.column_stack((
+        np.radians(coords[:, 1]) * math.cos(math.radians(ref_lat)) * EARTH_RADIUS_KM,
+        np.radians(coords[:, 0]) * EARTH_RADIUS_KM,
+    ))
+
+
+def kmeans_plus_plus(dist: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Pick k seed indexes from a pairwise distance matrix with k-means++ (D^2) sampling."""
+    seeds = [int(rng.integers(len(dist)))]
+    closest = dist[seeds[0]] ** 2
+    for _ in range(1, k):
+        total = closest.sum()
+        seed = int(rng.choice(len(dist), p=closest / total)) if total > 0 else int(rng.integers(len(dist)))
+        seeds.append(seed)
+        closest = np.minimum(closest, dist[seed] ** 2)
+    return np.array(seeds)
+
+
+def balanced_assignment(cost: np.ndarray, capacity: int) -> np.ndarray:
+    """Assign each row to a column with at most capacity rows per column.
+
+    Every round, each unassigned row bids for its cheapest open column and each column accepts
+    its cheapest bids up to its remaining capacity; at least one column fills per round, so
+    this takes at most k rounds of vectorized work.
+    """
+    n, k = cost.shape
+    labels = np.full(n, -1)
+    remaining = np.full(k, capacity)
+    unassigned = np.arange(n)
+    while len(unassigned):
+        bids = cost[unassigned]
+        bids[:, remaining <= 0] = np.inf
+        choice = np.argmin(bids, axis=1)
+        price = bids[np.arange(len(unassigned)), choice]
+
+        order = np.lexsort((price, choice))
+        sorted_choice = choice[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_choice, sorted_choice)
+        accepted = order[rank < remaining[sorted_choice]]
+
+        labels[unassigned[accepted]] = choice[accepted]
+        remaining -= np.bincount(choice[accepted], minlength=k)
+        unassigned = np.delete(unassigned, accepted)
+    return labels
+
+
+def _assign(cost: np.ndarray, balanced: bool) -> np.ndarray:
+    if balanced:
+        return balanced_assignment(cost, math.ceil(len(cost) / cost.shape[1]))
+    return np.argmin(cost, axis=1)
+
+
+def kmeans(coords: np.ndarray, k: int, balanced: bool = True, iterations: int = 50, seed: int = 0,
+           init_centers: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """k-means on [lat, lng] points (projected to km), seeded with k-means++ or init_centers.
+
+    Returns (labels, centers) with centers as [lat, lng]. With balanced=True no cluster gets
+    more than ceil(n / k) points.
+    """
+    rng = np.random.default_rng(seed)
+    ref_lat = float(np.mean(coords[:, 0]))
+    points = project_km(coords, ref_lat)
+    if init_centers is None:
+        centers = points[kmeans_plus_plus(haversine_matrix(coords), k, rng)]
+    else:
+        centers = project_km(np.asarray(init_centers, dtype=float), ref_lat)
+
+    labels = None
+    for _ in range(iterations):
+        cost = ((points[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+        new_labels = _assign(cost, balanced)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(k):
+            members = labels == cluster
+            if members.any():
+                centers[cluster] = points[members].mean(axis=0)
+
+    center_coords = np.array([coords[labels == cluster].mean(axis=0) if (labels == cluster).any() else [np.nan, np.nan] for cluster in range(k)])
+    return labels, center_coords
+
+
+def kmedoids(dist: np.ndarray, k: int, balanced: bool = True, iterations: int = 50, seed: int = 0,
+             init_medoids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """k-medoids (alternating) on a precomputed distance matrix. Returns (labels, medoid indexes)."""
+    rng = np.random.default_rng(seed)
+    medoids = kmeans_plus_plus(dist, k, rng) if init_medoids is None else np.array(init_medoids)
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = _assign(dist[:, medoids], balanced)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(k):
+            members = np.flatnonzero(labels == cluster)
+            if len(members):
+                # The member with the smallest total distance to the rest of its cluster
+                medoids[cluster] = members[np.argmin(dist[np.ix_(members, members)].sum(axis=1))]
+    return labels, medoids
+
+
+def cluster_locations(selected_data: List[Tuple], num_clusters: int, method: str = 'kmeans', balanced: bool = True,
+                      seed: int = 0, cost_matrix: Optional[Callable[[List[Tuple]], np.ndarray]] = None) -> List[List[Tuple]]:
+    """Split the selected places into num_clusters geographic groups, one per trip day.
+
+    method is 'kmeans' (k-means++ seeding) or 'kmedoids' (on haversine distances, or on
+    cost_matrix(places) such as cached travel times). With
+    balanced=True the days get a similar number of stops. Places without a geocode cannot be
+    placed on the map, so they are handed out to the smallest groups afterwards.
+    """
+    k = max(1, int(num_clusters or 0))
+    clusters: List[List[Tuple]] = [[] for _ in range(k)]
+    coords = place_coordinates(selected_data)
+    located = np.flatnonzero(~np.isnan(coords).any(axis=1))
+
+    if len(located):
+        used = min(k, len(located))
+        if method == 'kmedoids':
+            dist = cost_matrix([selected_data[i] for i in located]) if cost_matrix else haversine_matrix(coords[located])
+            labels, _ = kmedoids(dist, used, balanced, seed=seed)
+        elif method == 'kmeans':
+            labels, _ = kmeans(coords[located], used, balanced, seed=seed)
+        else:
+            raise ValueError(f"Unknown clustering method: {method}")
+        for index, label in zip(located.tolist(), labels.tolist()):
+            clusters[label].append(selected_data[index])
+
+    located_set = set(located.tolist())
+    for index, place in enumerate(selected_data):
+        if index not in located_set:
+            min(clusters, key=len).append(place)
+    return clusters
@@ -0,0 +1,146 @@
+import math
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from libraries.geo import haversine_matrix, kmeans, place_location
+from libraries.routing import calculate_location_route
+
+
+def resize_centers(coords: np.ndarray, centers: np.ndarray, k: int, counts: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Adapt the previous day centers to k days: drop the emptiest days or add k-means++ seeds far from the rest."""
+    if k <= len(centers):
+        return centers[np.sort(np.argsort(-counts, kind='stable')[:k])]
+
+    rng = np.random.default_rng(seed)
+    centers = list(centers)
+    closest = haversine_matrix(coords, np.array(centers)).min(axis=1) ** 2
+    while len(centers) < k:
+        total = closest.sum()
+        seed_index = int(rng.choice(len(coords), p=closest / total)) if total > 0 else int(rng.integers(len(coords)))
+        centers.append(coords[seed_index])
+        closest = np.minimum(closest, haversine_matrix(coords, coords[seed_index:seed_index + 1])[:, 0] ** 2)
+    return np.array(centers)
+
+
+class ItinerarySession:
+    """Cached day clustering and routes for one destination's itinerary.
+
+    update() takes the currently selected places (keyed by their index in data) and the number
+    of days. Adding or removing a few places only re-routes the days they belong to: a new
+    place joins the nearest day that still has room. Changing the number of days re-runs
+    k-means warm-started from the previous day centers, and only days whose stops changed are
+    re-routed. cost_matrix is passed on to calculate_location_route for the leg costs.
+    """
+
+    def __init__(self, time_budget: float = 0.5, accommodation: Optional[Tuple] = None, seed: int = 0,
+                 cost_matrix: Optional[Callable[[List[Tuple]], np.ndarray]] = None):
+        self.time_budget = time_budget
+        self.accommodation = accommodation
+        self.seed = seed
+        self.cost_matrix = cost_matrix
+        self.days = 0
+        self._selected: Dict[int, Tuple] = {}
+        self._coords: Dict[int, Tuple[float, float]] = {}
+        self._day_of: Dict[int, int] = {}
+        self._members: List[List[int]] = []
+        self._centers: Optional[np.ndarray] = None
+        self._routes: List[Optional[List[Tuple]]] = []
+
+    @property
+    def routes(self) -> List[List[Tuple]]:
+        return [route or [] for route in self._routes]
+
+    def update(self, selected: Dict[int, Tuple], days: int) -> List[List[Tuple]]:
+        """Bring the clusters and routes up to date and return one ordered list of places per day."""
+        days = max(1, int(days or 0))
+        removed = [index for index in self._selected if index not in selected]
+        added = [index for index in selected if index not in self._selected]
+
+        for index in removed:
+            del self._selected[index]
+            self._coords.pop(index, None)
+        for index in added:
+            self._selected[index] = selected[index]
+            location = place_location(selected[index])
+            if location is not None:
+                self._coords[index] = location
+
+        # Too few centers for the located places (e.g. none were geocoded last time) means there
+        # is nothing to assign new places to, so those days are clustered from scratch as well
+        if days != self.days or self._centers is None or len(self._centers) < min(days, len(self._coords)):
+            dirty = self._recluster(days)
+        else:
+            dirty = self._apply_changes(removed, added)
+
+        self._reroute(dirty)
+        return self.routes
+
+    def _recluster(self, days: int) -> Set[int]:
+        previous = {day: set(members) for day, members in enumerate(self._members)}
+        located = list(self._coords)
+        self._members = [[] for _ in range(days)]
+
+        if located:
+            coords = np.array([self._coords[index] for index in located])
+            used = min(days, len(located))
+            init_centers = None
+            if self._centers is not None and len(self._centers):
+                counts = np.bincount([self._day_of.get(index, 0) for index in located], minlength=len(self._centers))[:len(self._centers)]
+                init_centers = resize_centers(coords, self._centers, used, counts, self.seed)
+            labels, centers = kmeans(coords, used, seed=self.seed, init_centers=init_centers)
+            self._centers = centers
+            for index, label in zip(located, labels.tolist()):
+                self._members[label].append(index)
+        else:
+            self._centers = np.empty((0, 2))
+
+        self._day_of = {}
+        for day, members in enumerate(self._members):
+            for index in members:
+                self._day_of[index] = day
+        for index in self._selected:
+            if index not in self._coords:
+                self._place_unlocated(index)
+
+        self.days = days
+        dirty = {day for day in range(days) if set(self._members[day]) != previous.get(day)}
+        # Days that kept exactly the same stops keep their cached route
+        self._routes = [None if day in dirty else self._routes[day] for day in range(days)]
+        return dirty
+
+    def _place_unlocated(self, index: int):
+        day = min(range(len(self._members)), key=lambda d: len(self._members[d]))
+        self._members[day].append(index)
+        self._day_of[index] = day
+
+    def _apply_changes(self, removed: List[int], added: List[int]) -> Set[int]:
+        dirty = set()
+        for index in removed:
+            day = self._day_of.pop(index)
+            self._members[day].remove(index)
+            dirty.add(day)
+
+        capacity = math.ceil(len(self._selected) / self.days)
+        for index in added:
+            if index not in self._coords or not len(self._centers):
+                self._place_unlocated(index)
+                dirty.add(self._day_of[index])
+                continue
+            point = np.array([self._coords[index]])
+            for day in np.argsort(haversine_matrix(point, self._centers)[0]).tolist():
+                if len(self._members[day]) < capacity:
+                    break
+            self._members[day].append(index)
+            self._day_of[index] = day
+            dirty.add(day)
+        return dirty
+
+    def _reroute(self, dirty: Set[int]):
+        days = sorted(day for day in dirty if day < self.days)
+        if not days:
+            return
+        anchors = [self.accommodation] * len(days)
+        clusters = [[self._selected[index] for index in self._members[day]] for day in days]
+        for day, route in zip(days, calculate_location_route(clusters, self.time_budget, anchors, cost_matrix=self.cost_matrix)):
+            self._routes[day] = route
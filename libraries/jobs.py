@@ -0,0 +1,182 @@
+import hashlib
+import random
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+
+from libraries.data import get_store
+from libraries.maps import normalize_query
+from libraries.metrics import metrics
+from libraries.research import ResearchTask
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_RETRY = 'retry'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Identifies a task's row in research_jobs; parameters come from _key()
+_JOB = 'country = ? AND destination = ? AND prompt_type = ? AND scope = ?'
+
+
+def item_key(title: str) -> str:
+    return normalize_query(title)
+
+
+class ResearchJobs:
+    """Persistent state of the research requests in the research_jobs table.
+
+    Every (country, destination, prompt_type, scope) is one job. A job is pending until a worker
+    starts it, and done once all of its items have been merged into places; the items merged
+    so far are recorded one by one, so an interrupted job resumes by skipping them. A failed
+    attempt is retried after an exponential backoff (base_delay * 2^attempts, capped at
+    max_delay, with jitter) until max_attempts is reached. Jobs left running by a crashed run
+    go back to pending in recover(). The prompt hash covers the fully rendered prompt, so a job
+    whose instructions or preferences changed since it ran is started over; the preference
+    savers in libraries/data.py also drop the interactive (scope '') jobs they affect. The
+    places each job's items were merged into are linked to it, see places().
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 5, base_delay: float = 5.0, max_delay: float = 300.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def _prompt_hash(task: ResearchTask) -> str:
+        return hashlib.sha256(task.prompt.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _key(task: ResearchTask) -> Tuple[str, str, str, str]:
+        return task.country, task.destination, task.prompt_type, task.scope
+
+    @staticmethod
+    def _clear_progress(conn, where: str, params: tuple):
+        for table in ('research_job_items', 'research_job_places'):
+            conn.execute(f'DELETE FROM {table} WHERE job_id IN (SELECT id FROM research_jobs WHERE {where})', params)
+
+    def enqueue(self, tasks: Iterable[ResearchTask]):
+        now = time.time()
+        with get_store(self.db_path).transaction() as conn:
+            for task in tasks:
+                prompt_hash = self._prompt_hash(task)
+                row = conn.execute(f'SELECT id, prompt_hash FROM research_jobs WHERE {_JOB}', self._key(task)).fetchone()
+                if row is None:
+                    conn.execute('''
+                    INSERT INTO research_jobs (country, destination, prompt_type, scope, prompt_hash, state, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', self._key(task) + (prompt_hash, JOB_PENDING, now))
+                elif row[1] != prompt_hash:
+                    self._clear_progress(conn, 'id = ?', (row[0],))
+                    conn.execute('''
+                    UPDATE research_jobs SET prompt_hash = ?, state = ?, attempts = 0, next_attempt_at = 0, last_error = NULL, updated_at = ?
+                    WHERE id = ?
+                    ''', (prompt_hash, JOB_PENDING, now, row[0]))
+
+    def reset(self, tasks: Iterable[ResearchTask]):
+        """Start the jobs of tasks over: back to pending, with no attempts and no items done."""
+        now = time.time()
+        with get_store(self.db_path).transaction() as conn:
+            for task in tasks:
+                self._clear_progress(conn, _JOB, self._key(task))
+                conn.execute(f'''
+                UPDATE research_jobs SET state = ?, attempts = 0, next_attempt_at = 0, last_error = NULL, updated_at = ?
+                WHERE {_JOB}
+                ''', (JOB_PENDING, now) + self._key(task))
+
+    def recover(self) -> int:
+        """Return jobs left running by an interrupted run to pending; returns how many there were."""
+        with get_store(self.db_path).transaction() as conn:
+            return conn.execute('UPDATE research_jobs SET state = ? WHERE state = ?', (JOB_PENDING, JOB_RUNNING)).rowcount
+
+    def _state(self, task: ResearchTask):
+        with get_store(self.db_path).connection() as conn:
+            return conn.execute(f'SELECT id, state, next_attempt_at FROM research_jobs WHERE {_JOB}', self._key(task)).fetchone()
+
+    def runnable(self, tasks: Iterable[ResearchTask]) -> List[ResearchTask]:
+        """The tasks whose job is pending, or waiting for a retry that is now due."""
+        now = time.time()
+        ready = []
+        for task in tasks:
+            row = self._state(task)
+            if row is not None and (row[1] == JOB_PENDING or (row[1] == JOB_RETRY and row[2] <= now)):
+                ready.append(task)
+        return ready
+
+    def next_retry_in(self, tasks: Iterable[ResearchTask]) -> Optional[float]:
+        """Seconds until the earliest scheduled retry among tasks, or None if none is waiting."""
+        waits = [row[2] - time.time() for row in map(self._state, tasks) if row is not None and row[1] == JOB_RETRY]
+        return max(0.0, min(waits)) if waits else None
+
+    def with_state(self, tasks: Iterable[ResearchTask], state: str) -> List[ResearchTask]:
+        return [task for task in tasks if (row := self._state(task)) is not None and row[1] == state]
+
+    def _set(self, task: ResearchTask, sql: str, params: tuple = ()):
+        with get_store(self.db_path).transaction() as conn:
+            conn.execute(f'UPDATE research_jobs SET {sql}, updated_at = ? WHERE {_JOB}', params + (time.time(),) + self._key(task))
+
+    def start(self, task: ResearchTask):
+        self._set(task, 'state = ?', (JOB_RUNNING,))
+
+    def finish(self, task: ResearchTask):
+        """Mark a job done, unless its attempt failed in the meantime."""
+        with get_store(self.db_path).transaction() as conn:
+            conn.execute(f'''
+            UPDATE research_jobs SET state = ?, last_error = NULL, updated_at = ?
+            WHERE {_JOB} AND state = ?
+            ''', (JOB_DONE, time.time()) + self._key(task) + (JOB_RUNNING,))
+
+    def fail(self, task: ResearchTask, error: BaseException) -> bool:
+        """Record a failed attempt and schedule the retry; returns False once the job has used up its attempts."""
+        with get_store(self.db_path).transaction() as conn:
+            row = conn.execute(f'SELECT attempts FROM research_jobs WHERE {_JOB}', self._key(task)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            retry = attempts < self.max_attempts
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            conn.execute(f'''
+            UPDATE research_jobs SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+            WHERE {_JOB}
+            ''', (JOB_RETRY if retry else JOB_FAILED, attempts, time.time() + delay, f"{type(error).__name__}: {error}", time.time()) + self._key(task))
+        metrics.count('research.retries' if retry else 'research.failures')
+        return retry
+
+    def done_items(self, task: ResearchTask) -> Set[str]:
+        with get_store(self.db_path).connection() as conn:
+            rows = conn.execute(f'''
+            SELECT item_key FROM research_job_items JOIN research_jobs ON research_jobs.id = research_job_items.job_id
+            WHERE {_JOB}
+            ''', self._key(task)).fetchall()
+        return {row[0] for row in rows}
+
+    def items_done(self, task: ResearchTask, titles: Iterable[str]):
+        """Checkpoint items that have been saved to places."""
+        row = self._state(task)
+        if row is None:
+            return
+        with get_store(self.db_path).transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO research_job_items (job_id, item_key) VALUES (?, ?)',
+                             [(row[0], item_key(title)) for title in titles])
+
+    def link_places(self, task: ResearchTask, place_ids: Iterable[int]):
+        """Record the places.id of the places a job's items were merged into."""
+        row = self._state(task)
+        if row is None:
+            return
+        with get_store(self.db_path).transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO research_job_places (job_id, place_id) VALUES (?, ?)',
+                             [(row[0], place_id) for place_id in place_ids])
+
+    def places(self, country: str, destination: str, prompt_types: Iterable[str], scope: str = '') -> Set[int]:
+        """places.id of every place linked to the scope's jobs for a destination and the given prompt types."""
+        prompt_types = list(prompt_types)
+        with get_store(self.db_path).connection() as conn:
+            rows = conn.execute(f'''
+            SELECT DISTINCT place_id FROM research_job_places JOIN research_jobs ON research_jobs.id = research_job_places.job_id
+            WHERE country = ? AND destination = ? AND scope = ? AND prompt_type IN ({", ".join("?" * len(prompt_types))})
+            ''', [country, destination, scope] + prompt_types).fetchall()
+        return {row[0] for row in rows}
+
+    def last_error(self, task: ResearchTask) -> Optional[str]:
+        with get_store(self.db_path).connection() as conn:
+            row = conn.execute(f'SELECT last_error FROM research_jobs WHERE {_JOB}', self._key(task)).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+from libraries.data import get_store
+from libraries.metrics import metrics
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def is_complete_response(text: str) -> bool:
+    """Whether text parses as one complete JSON object.
+
+    The items inside are not validated: stream_items repairs invalid items with follow-up
+    requests, which are cached too, so replaying a response with a bad item is deterministic.
+    """
+    try:
+        return isinstance(json.loads(text), dict)
+    except ValueError:
+        return False
+
+
+def schema_fingerprint(schema) -> str:
+    """Hash of a response schema: the JSON schema of a pydantic model, or the schema object's repr."""
+    if hasattr(schema, 'model_json_schema'):
+        return _hash(json.dumps(schema.model_json_schema(), sort_keys=True))
+    return _hash(repr(schema))
+
+
+class LLMResponseCache:
+    """Persistent cache of Gemini responses in the llm_cache table.
+
+    Responses are keyed on (model, hash of the rendered prompt, hash of the schema), so any
+    change to the instructions or preferences in a prompt is a miss. Entries are also tagged
+    with the country/destination they were generated for; the preference savers in
+    libraries/data.py delete the entries of the scope they change. Entries older than ttl
+    seconds are ignored and the cache is trimmed to max_entries, least recently used first.
+    With bypass=True lookups always miss but fresh responses are still stored.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 2_000, bypass: bool = False):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bypass = bypass
+
+    @staticmethod
+    def key(model: str, prompt: str, schema) -> str:
+        return _hash('\x1f'.join((model, _hash(prompt), schema_fingerprint(schema))))
+
+    def get(self, model: str, prompt: str, schema) -> Optional[str]:
+        if self.bypass:
+            return None
+        key = self.key(model, prompt, schema)
+        now = time.time()
+        with get_store(self.db_path).connection() as conn:
+            row = conn.execute('SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?', (key, now - self.ttl)).fetchone()
+        metrics.cache('llm_cache', hits=row is not None, misses=row is None)
+        if row is None:
+            return None
+
+        with get_store(self.db_path).transaction() as conn:
+            conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, model: str, prompt: str, schema, response: str, country: Optional[str] = None, destination: Optional[str] = None):
+        now = time.time()
+        with get_store(self.db_path).transaction() as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO llm_cache (key, model, prompt_hash, schema_hash, country, destination, response, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (self.key(model, prompt, schema), model, _hash(prompt), schema_fingerprint(schema), country, destination, response, now, now))
+            conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,))
+            excess = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute('DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)', (excess,))
+
+    def invalidate(self, country: str, destination: Optional[str] = None):
+        """Drop the entries generated for a country, or for one of its destinations."""
+        with get_store(self.db_path).transaction() as conn:
+            if destination is None:
+                conn.execute('DELETE FROM llm_cache WHERE country = ?', (country,))
+            else:
+                conn.execute('DELETE FROM llm_cache WHERE country = ? AND destination = ?', (country, destination))
+
+    def stream(self, model: str, prompt: str, schema, request: Callable[[], Iterable[str]],
+               country: Optional[str] = None, destination: Optional[str] = None) -> Iterator[str]:
+        """Text chunks of the response to prompt: the cached text in one chunk, or request()'s chunks.
+
+        A fresh response is stored only if it parses as a complete document (see is_complete_response),
+        so a stream that was cut short or produced invalid JSON is requested again next time.
+        """
+        cached = self.get(model, prompt, schema)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        for chunk in request():
+            chunks.append(chunk)
+            yield chunk
+        response = ''.join(chunks)
+        if is_complete_response(response):
+            self.put(model, prompt, schema, response, country, destination)
+        else:
+            metrics.count('llm_cache.incomplete')
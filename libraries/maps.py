@@ -0,0 +1,123 @@
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from libraries.data import get_store
+from libraries.metrics import metrics
+
+# Stored in place of a response when Google Maps could not find the place, so failed lookups are cached too
+NOT_FOUND = '__not_found__'
+
+
+def normalize_query(text: str) -> str:
+    return re.sub(r'\s+', ' ', text or '').strip().casefold()
+
+
+def _cache_key(*parts: str) -> str:
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class MapsResponseCache:
+    """Persistent cache of Google Maps responses in the maps_cache table.
+
+    Each response is stored under a content hash of the normalized (query, destination,
+    response_type). Entries older than ttl seconds are ignored, and evict() trims the cache
+    back to max_entries lookups, least recently used first.
+    """
+
+    def __init__(self, db_path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 50_000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, query: str, destination: str) -> Optional[Dict]:
+        """Return the cached responses ({} if the place was not found), or None on a cache miss."""
+        lookup_key = _cache_key(normalize_query(query), normalize_query(destination))
+        now = time.time()
+        with get_store(self.db_path).connection() as conn:
+            rows = conn.execute(
+                'SELECT response_type, response_data FROM maps_cache WHERE lookup_key = ? AND created_at >= ?',
+                (lookup_key, now - self.ttl)
+            ).fetchall()
+        if not rows:
+            return None
+
+        with get_store(self.db_path).transaction() as conn:
+            conn.execute('UPDATE maps_cache SET last_access = ? WHERE lookup_key = ?', (now, lookup_key))
+        return {response_type: json.loads(response_data) for response_type, response_data in rows if response_type != NOT_FOUND}
+
+    def put(self, query: str, destination: str, responses: Optional[Dict]):
+        """Store the responses for a lookup; pass None to record that the place was not found."""
+        normalized = normalize_query(query), normalize_query(destination)
+        lookup_key = _cache_key(*normalized)
+        now = time.time()
+        items = responses.items() if responses else [(NOT_FOUND, None)]
+        params = [
+            (_cache_key(*normalized, response_type), lookup_key, *normalized, response_type, json.dumps(response_data), now, now)
+            for response_type, response_data in items
+        ]
+        with get_store(self.db_path).transaction() as conn:
+            conn.execute('DELETE FROM maps_cache WHERE lookup_key = ?', (lookup_key,))
+            conn.executemany('''
+            INSERT INTO maps_cache (key, lookup_key, query, destination, response_type, response_data, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', params)
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        now = time.time()
+        with get_store(self.db_path).transaction() as conn:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now: float):
+        conn.execute('DELETE FROM maps_cache WHERE created_at < ?', (now - self.ttl,))
+        # Evict whole lookups so a hit never returns only some of a place's responses
+        excess = conn.execute('SELECT COUNT(DISTINCT lookup_key) FROM maps_cache').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('''
+            DELETE FROM maps_cache WHERE lookup_key IN (
+                SELECT lookup_key FROM maps_cache GROUP BY lookup_key ORDER BY MAX(last_access) LIMIT ?
+            )
+            ''', (excess,))
+
+
+def fetch_place_details_batch(gmaps, queries: List[str], destination: str, fetch: Callable,
+                              cache: Optional[MapsResponseCache] = None, max_workers: int = 8) -> List[Optional[Dict]]:
+    """Look up several places at once and return their responses in query order.
+
+    fetch(gmaps, query, destination) is called at most once per distinct normalized query,
+    with up to max_workers lookups in flight, and only for queries missing from the cache.
+    A query that fetch cannot find (it raises ValueError) returns None.
+    """
+    results: Dict[str, Optional[Dict]] = {}
+    misses: Dict[str, str] = {}
+    for query in queries:
+        normalized = normalize_query(query)
+        if normalized in results or normalized in misses:
+            continue
+        cached = cache.get(query, destination) if cache is not None else None
+        if cached is None:
+            misses[normalized] = query
+        else:
+            results[normalized] = cached or None
+    metrics.cache('maps_cache', hits=len(results), misses=len(misses))
+
+    def lookup(query: str) -> Optional[Dict]:
+        try:
+            return fetch(gmaps, query, destination)
+        except ValueError:
+            return None
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="maps") as executor:
+            for normalized, responses in zip(misses, executor.map(lookup, misses.values())):
+                results[normalized] = responses
+                if cache is not None:
+                    cache.put(misses[normalized], destination, responses)
+        if cache is not None:
+            cache.evict()
+
+    return [results[normalize_query(query)] for query in queries]
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Iterable, Iterator, List
+
+
+class _NullSpan:
+    """Shared do-nothing span handed out while metrics are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics._record(self.name, self.start, time.perf_counter(), exc_type is not None)
+        return False
+
+
+class Metrics:
+    """Process-wide spans, counters and cache hit rates for the research pipeline.
+
+    Everything is off until enable() is called: span() then returns a shared no-op context
+    manager and count()/cache() return immediately, so instrumented code costs one attribute
+    check. Spans are aggregated per name (calls, total, max, errors); with trace=True every
+    span is also kept as a Chrome trace event for write(). Safe to use from worker threads.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, trace: bool = False):
+        self.enabled = True
+        self.trace = trace
+
+    def disable(self):
+        self.enabled = False
+        self.trace = False
+
+    def reset(self):
+        with self._lock:
+            self._origin = time.perf_counter()
+            self._spans: Dict[str, List[float]] = {}
+            self._counters: Dict[str, int] = {}
+            self._caches: Dict[str, List[int]] = {}
+            self._events: List[Dict] = []
+
+    def span(self, name: str):
+        """Context manager timing the enclosed block under name."""
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def timed(self, name: str) -> Callable:
+        """Decorator timing every call of a function under name."""
+        def decorator(function: Callable) -> Callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterable:
+        """iterable, with the time until it is exhausted (e.g. a streamed response) recorded under name."""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(name, iterable)
+
+    def _timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        with _Span(self, name):
+            yield from iterable
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def cache(self, name: str, hits: int = 0, misses: int = 0):
+        """Record lookups of the cache called name."""
+        if not self.enabled:
+            return
+        with self._lock:
+            totals = self._caches.setdefault(name, [0, 0])
+            totals[0] += hits
+            totals[1] += misses
+
+    def _record(self, name: str, start: float, end: float, failed: bool):
+        elapsed = end - start
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            stats[3] += failed
+            if self.trace:
+                self._events.append({'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': os.getpid(),
+                                     'tid': threading.get_ident(), 'ts': (start - self._origin) * 1e6, 'dur': elapsed * 1e6,
+                                     **({'args': {'error': True}} if failed else {})})
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                'spans': {name: {'calls': calls, 'total_s': total, 'mean_ms': total / calls * 1000 if calls else 0.0,
+                                 'max_ms': longest * 1000, 'errors': errors}
+                          for name, (calls, total, longest, errors) in sorted(self._spans.items())},
+                'counters': dict(sorted(self._counters.items())),
+                'caches': {name: {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else None}
+                           for name, (hits, misses) in sorted(self._caches.items())},
+            }
+
+    def report(self, console):
+        """Print the summary as rich tables."""
+        from rich.table import Table
+
+        summary = self.summary()
+        spans = Table(title="Pipeline spans")
+        for column in ("Span", "Calls", "Total s", "Mean ms", "Max ms", "Errors"):
+            spans.add_column(column, justify="left" if column == "Span" else "right")
+        for name, stats in summary['spans'].items():
+            spans.add_row(name, str(stats['calls']), f"{stats['total_s']:.3f}", f"{stats['mean_ms']:.1f}",
+                          f"{stats['max_ms']:.1f}", str(stats['errors']) if stats['errors'] else "")
+        console.print(spans)
+
+        if summary['caches'] or summary['counters']:
+            counts = Table(title="Caches and counters")
+            counts.add_column("Name")
+            counts.add_column("Value", justify="right")
+            for name, stats in summary['caches'].items():
+                rate = f"{stats['hit_rate']:.0%}" if stats['hit_rate'] is not None else "-"
+                counts.add_row(f"{name} hit rate", f"{rate} ({stats['hits']}/{stats['hits'] + stats['misses']})")
+            for name, value in summary['counters'].items():
+                counts.add_row(name, str(value))
+            console.print(counts)
+
+    def write(self, path: str):
+        """Write the trace events and summary as Chrome trace-event JSON (chrome://tracing, Perfetto)."""
+        summary = self.summary()
+        with self._lock:
+            events = list(self._events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': summary}, f)
+
+
+# Shared by every module; enabled from test.py's command line
+metrics = Metrics()
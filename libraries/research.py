@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple
+
+# Requests per minute allowed by the Gemini API for each model (free tier)
+MODEL_RATE_LIMITS = {
+    "gemini-1.5-flash": 15,
+    "gemini-1.5-pro": 2,
+}
+
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter.
+
+    Tokens refill continuously at rate per second up to capacity; acquire() blocks until
+    enough tokens are available, so bursts of up to capacity requests go out immediately.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests: float) -> 'TokenBucket':
+        return cls(requests / 60.0)
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResearchTask(NamedTuple):
+    """One Gemini request: a prompt type for a destination, researched for scope (a batch traveller, or '' interactively)."""
+    country: str
+    destination: str
+    prompt_type: str
+    prompt: str
+    scope: str = ''
+
+
+def stream_research(tasks: Iterable[ResearchTask], fetch_items: Callable[[ResearchTask], Iterable],
+                    max_workers: int = 4, batch_size: int = 8) -> Iterator[Tuple[ResearchTask, List]]:
+    """Run fetch_items(task) for every task on a thread pool and yield (task, items) batches as items arrive.
+
+    fetch_items(task) yields items one at a time (e.g. from a streamed response). Every
+    batch_size items, and at the end of each task, the items gathered so far are handed to the
+    caller, so the first places can be processed while the rest are still being generated.
+    Up to max_workers tasks run at once, but batches are yielded in task order: the first
+    task's batches stream as they arrive while the later tasks' are buffered, so merging them
+    into the dataset is deterministic. An empty batch follows the last one of each task. An
+    exception raised by fetch_items is re-raised when its task is reached, and the tasks that
+    have not started are cancelled. Rate limiting is left to fetch_items (see TokenBucket).
+    """
+    tasks = list(tasks)
+    done = object()
+    queues = [queue.Queue() for _ in tasks]
+
+    def worker(task, results):
+        batch = []
+        try:
+            for item in fetch_items(task):
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    results.put((task, batch))
+                    batch = []
+            if batch:
+                results.put((task, batch))
+            results.put((task, []))
+        except BaseException as e:
+            results.put((task, e))
+        finally:
+            results.put((task, done))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="research")
+    try:
+        for task, results in zip(tasks, queues):
+            executor.submit(worker, task, results)
+        for task, results in zip(tasks, queues):
+            while True:
+                _, result = results.get()
+                if result is done:
+                    break
+                if isinstance(result, BaseException):
+                    raise result
+                yield task, result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
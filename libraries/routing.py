@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from libraries.geo import haversine_matrix, place_coordinates
+
+# Below this many stops in total the process pool costs more than it saves
+PARALLEL_MIN_STOPS = 200
+
+# Days with up to this many stops are solved exactly, which takes a few milliseconds
+EXACT_MAX_STOPS = 8
+
+# Route solving pools shared by every caller, one per requested size
+_pools: Dict[Optional[int], ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def _route_pool(processes: Optional[int]) -> ProcessPoolExecutor:
+    """The shared pool with processes workers, started on first use.
+
+    Callers run on interface and batch worker threads while pooled SQLite connections and
+    locks are live, so workers are spawned rather than forked from this multithreaded process.
+    """
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            pool = _pools[processes] = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        return pool
+
+
+def _discard_pool(processes: Optional[int], pool: ProcessPoolExecutor):
+    with _pools_lock:
+        if _pools.get(processes) is pool:
+            del _pools[processes]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def tour_length(dist: np.ndarray, tour: Sequence[int], closed: bool = True) -> float:
+    tour = np.asarray(tour)
+    length = dist[tour[:-1], tour[1:]].sum()
+    if closed and len(tour) > 1:
+        length += dist[tour[-1], tour[0]]
+    return float(length)
+
+
+def nearest_neighbour_tour(dist: np.ndarray, start: int = 0) -> np.ndarray:
+    """Greedy tour that always moves to the closest unvisited stop."""
+    n = len(dist)
+    tour = [start]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    for _ in range(n - 1):
+        candidates = np.where(visited, np.inf, dist[tour[-1]])
+        nxt = int(np.argmin(candidates))
+        tour.append(nxt)
+        visited[nxt] = True
+    return np.array(tour)
+
+
+def held_karp_tour(dist: np.ndarray) -> np.ndarray:
+    """Shortest closed tour starting at stop 0, by dynamic programming over the subsets of the other stops."""
+    n = len(dist)
+    others = dist[1:, 1:]
+    subsets = 1 << (n - 1)
+    # cost[s, j]: shortest path from stop 0 through the stops in subset s, ending at stop j + 1 (which is in s)
+    cost = np.full((subsets, n - 1), np.inf)
+    parent = np.zeros((subsets, n - 1), dtype=np.int64)
+    for j in range(n - 1):
+        cost[1 << j, j] = dist[0, j + 1]
+    bits = 1 << np.arange(n - 1)
+    for subset in range(1, subsets):
+        inside = (subset & bits) != 0
+        # Best way to reach each stop j from the subset's paths: min over the last stop k
+        extend = cost[subset][:, np.newaxis] + others
+        extend[~inside] = np.inf
+        last = np.argmin(extend, axis=0)
+        for j in np.flatnonzero(~inside).tolist():
+            grown = subset | (1 << j)
+            if extend[last[j], j] < cost[grown, j]:
+                cost[grown, j] = extend[last[j], j]
+                parent[grown, j] = last[j]
+
+    subset = subsets - 1
+    j = int(np.argmin(cost[subset] + dist[1:, 0]))
+    order = []
+    while subset:
+        order.append(j + 1)
+        subset, j = subset & ~(1 << j), int(parent[subset, j])
+    return np.array([0] + order[::-1])
+
+
+def two_opt(dist: np.ndarray, tour: np.ndarray, deadline: float) -> Tuple[np.ndarray, bool]:
+    """One full pass of best-improvement 2-opt on a closed tour; tour[0] stays in place."""
+    n = len(tour)
+    improved = False
+    for i in range(n - 2):
+        if time.perf_counter() > deadline:
+            break
+        a, b = tour[i], tour[i + 1]
+        c = tour[i + 2:]
+        d = np.append(tour[i + 3:], tour[0])
+        # Gain of replacing edges (a, b) and (c, d) with (a, c) and (b, d), for every later edge at once
+        delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+        if i == 0:
+            delta[-1] = 0.0
+        j = int(np.argmin(delta))
+        if delta[j] < -1e-9:
+            tour[i + 1:i + 3 + j] = tour[i + 1:i + 3 + j][::-1]
+            improved = True
+    return tour, improved
+
+
+def or_opt(dist: np.ndarray, tour: np.ndarray, deadline: float, max_segment: int = 3) -> Tuple[np.ndarray, bool]:
+    """One pass of Or-opt: move segments of 1..max_segment stops (optionally reversed) to their best position."""
+    n = len(tour)
+    improved = False
+    for length in range(1, max_segment + 1):
+        s = 1
+        while s + length <= n:
+            if time.perf_counter() > deadline:
+                return tour, improved
+            first, last = tour[s], tour[s + length - 1]
+            prev, nxt = tour[s - 1], tour[(s + length) % n]
+            removal_gain = dist[prev, first] + dist[last, nxt] - dist[prev, nxt]
+
+            rest = np.concatenate((tour[:s], tour[s + length:]))
+            p, q = rest, np.roll(rest, -1)
+            forward = dist[p, first] + dist[last, q] - dist[p, q]
+            backward = dist[p, last] + dist[first, q] - dist[p, q]
+            # Re-inserting where it was removed is not a move
+            forward[s - 1] = backward[s - 1] = np.inf
+
+            k_forward, k_backward = int(np.argmin(forward)), int(np.argmin(backward))
+            reverse = backward[k_backward] < forward[k_forward]
+            k = k_backward if reverse else k_forward
+            cost = backward[k] if reverse else forward[k]
+            if cost < removal_gain - 1e-9:
+                segment = tour[s:s + length][::-1] if reverse else tour[s:s + length]
+                tour = np.concatenate((rest[:k + 1], segment, rest[k + 1:]))
+                improved = True
+            else:
+                s += 1
+    return tour, improved
+
+
+def solve_route(dist: np.ndarray, time_budget: float = 0.5, closed: bool = False) -> List[int]:
+    """Visiting order for the stops of one distance matrix.
+
+    With closed=True the route starts at stop 0 and returns to it (e.g. the day's
+    accommodation); otherwise it is the shortest open path with free endpoints. Up to
+    EXACT_MAX_STOPS stops the optimal route is found with Held-Karp. Larger days are seeded
+    with nearest neighbour and improved with 2-opt and Or-opt until no move helps or
+    time_budget seconds have passed.
+    """
+    n = len(dist)
+    if n <= 2:
+        return list(range(n))
+
+    deadline = time.perf_counter() + time_budget
+    if not closed:
+        # An open path is a closed tour through a dummy stop that is free to reach from anywhere
+        padded = np.zeros((n + 1, n + 1))
+        padded[1:, 1:] = dist
+        dist = padded
+
+    if n <= EXACT_MAX_STOPS:
+        tour = held_karp_tour(dist)
+        improved = False
+    else:
+        tour = nearest_neighbour_tour(dist, 0)
+        improved = True
+    while improved and time.perf_counter() < deadline:
+        tour, improved_2opt = two_opt(dist, tour, deadline)
+        tour, improved_or = or_opt(dist, tour, deadline)
+        improved = improved_2opt or improved_or
+
+    if not closed:
+        return [int(stop) - 1 for stop in tour[1:]]
+    return [int(stop) for stop in tour]
+
+
+def calculate_location_route(clustered_data: List[List[Tuple]], time_budget: float = 0.5,
+                             accommodation: Union[Tuple, List[Optional[Tuple]], None] = None,
+                             processes: Optional[int] = None,
+                             cost_matrix: Optional[Callable[[List[Tuple]], np.ndarray]] = None) -> List[List[Tuple]]:
+    """Order the stops of every day's cluster to minimize travel distance.
+
+    accommodation is a place tuple used as the start and end of every day, or a list with one
+    (or None) per day. cost_matrix(places) returns the leg costs between a day's stops (e.g.
+    TravelTimeCache.matrix); by default they are haversine distances. Days are solved in
+    parallel on a shared process pool once the trip has PARALLEL_MIN_STOPS stops or more; each
+    day gets time_budget seconds. Stops without a geocode cannot be routed and are kept at the
+    end of their day.
+    """
+    if accommodation is None or isinstance(accommodation, tuple):
+        anchors = [accommodation] * len(clustered_data)
+    else:
+        anchors = list(accommodation)
+
+    jobs = []
+    for cluster, anchor in zip(clustered_data, anchors):
+        stops = [place for place in cluster if place is not anchor]
+        coords = place_coordinates(stops)
+        located = [place for place, row in zip(stops, coords) if not np.isnan(row).any()]
+        unlocated = [place for place, row in zip(stops, coords) if np.isnan(row).any()]
+        if anchor is not None and not np.isnan(place_coordinates([anchor])).any():
+            located = [anchor] + located
+            closed = True
+        else:
+            closed = False
+        jobs.append((located, unlocated, closed))
+
+    if cost_matrix is None:
+        cost_matrix = lambda places: haversine_matrix(place_coordinates(places))
+    dists = [cost_matrix(located) for located, _, _ in jobs]
+    closed_flags = [closed for _, _, closed in jobs]
+    total_stops = sum(len(located) for located, _, _ in jobs)
+
+    orders = None
+    if len(jobs) > 1 and total_stops >= PARALLEL_MIN_STOPS and (processes or os.cpu_count() or 1) > 1:
+        pool = _route_pool(processes)
+        try:
+            orders = list(pool.map(solve_route, dists, [time_budget] * len(jobs), closed_flags))
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time and solve this trip here
+            _discard_pool(processes, pool)
+    if orders is None:
+        orders = [solve_route(dist, time_budget, closed) for dist, closed in zip(dists, closed_flags)]
+
+    return [[located[i] for i in order] + unlocated for (located, unlocated, _), order in zip(jobs, orders)]
@@ -0,0 +1,134 @@
+import json
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from libraries.data import Item
+from libraries.metrics import metrics
+
+# Rounds of re-requesting invalid items before they are dropped
+MAX_REPAIR_ROUNDS = 2
+
+
+class ItemStreamParser:
+    """Incremental parser for a streamed ItemList JSON document.
+
+    feed() takes the next chunk of generated text and returns the raw dicts of the items
+    whose closing brace arrived in it, so each item can be handled as soon as it is complete
+    instead of after the whole response. Only the top-level "items" array is split out; the
+    rest of the document (list_title) is read from the full text by finish().
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_key = None
+        self._items_depth = None
+        self._item_start = None
+
+    def feed(self, chunk: str) -> List[dict]:
+        self.text += chunk
+        items = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._item_start is None:
+                        # Strings directly inside the top-level object are keys or values; keys are what matter
+                        self._last_key = text[self._string_start + 1:pos]
+            elif char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in '{[':
+                if char == '[' and self._depth == 1 and self._last_key == 'items':
+                    self._items_depth = self._depth + 1
+                elif char == '{' and self._depth == self._items_depth and self._item_start is None:
+                    self._item_start = pos
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if char == '}' and self._item_start is not None and self._depth == self._items_depth:
+                    raw = text[self._item_start:pos + 1]
+                    self._item_start = None
+                    try:
+                        items.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        items.append({'_unparsed': raw})
+                elif char == ']' and self._depth == 1 and self._items_depth is not None:
+                    self._items_depth = None
+        self._pos = len(text)
+        return items
+
+    def finish(self) -> dict:
+        """The whole document once the stream has ended ({} if it was cut off or malformed)."""
+        try:
+            document = json.loads(self.text)
+        except json.JSONDecodeError:
+            return {}
+        return document if isinstance(document, dict) else {}
+
+
+def validate_item(raw: dict, model: type = Item) -> Tuple[Optional[BaseModel], Optional[str]]:
+    """(item, None) if raw is a valid model, otherwise (None, the validation error)."""
+    if '_unparsed' in raw:
+        return None, "item is not valid JSON"
+    try:
+        return model(**raw), None
+    except (ValidationError, TypeError) as e:
+        return None, str(e)
+
+
+def repair_prompt(prompt: str, invalid: List[Tuple[dict, str]]) -> str:
+    """Ask again for just the items that failed validation, quoting each one with its error."""
+    listing = "\n".join(f"- {json.dumps(raw, ensure_ascii=False)}\n  Error: {error}" for raw, error in invalid)
+    return f"""{prompt}
+
+        Some items in your previous answer were invalid. Return only corrected versions of these {len(invalid)} items, with every required field filled in:
+        {listing}
+        """
+
+
+def stream_items(request: Callable[[str], Iterable[str]], prompt: str, model: type = Item,
+                 max_repairs: int = MAX_REPAIR_ROUNDS) -> Iterator[BaseModel]:
+    """Yield validated items from a streamed ItemList response as soon as each one is complete.
+
+    request(prompt) returns the generated text as an iterable of chunks. Items that fail
+    validation are collected while the stream continues; afterwards only those items are
+    re-requested (up to max_repairs rounds) instead of the whole list. Raises ValueError if
+    the first response is empty.
+    """
+    invalid: List[Tuple[dict, str]] = []
+    parser = ItemStreamParser()
+    for chunk in request(prompt):
+        for raw in parser.feed(chunk):
+            item, error = validate_item(raw, model)
+            if item is None:
+                invalid.append((raw, error))
+            else:
+                yield item
+    if not parser.text.strip():
+        raise ValueError("Empty response from the model")
+
+    for _ in range(max_repairs):
+        metrics.count('gemini.invalid_items', len(invalid))
+        if not invalid:
+            return
+        metrics.count('gemini.repair_rounds')
+        parser, retry, invalid = ItemStreamParser(), invalid, []
+        for chunk in request(repair_prompt(prompt, retry)):
+            for raw in parser.feed(chunk):
+                item, error = validate_item(raw, model)
+                if item is None:
+                    invalid.append((raw, error))
+                else:
+                    yield item
@@ -0,0 +1,174 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Hepburn romanization of the kana syllables; katakana is folded to hiragana first
+_KANA = {
+    'あ': 'a', 'い': 'i', 'う': 'u', 'え': 'e', 'お': 'o',
+    'か': 'ka', 'き': 'ki', 'く': 'ku', 'け': 'ke', 'こ': 'ko',
+    'さ': 'sa', 'し': 'shi', 'す': 'su', 'せ': 'se', 'そ': 'so',
+    'た': 'ta', 'ち': 'chi', 'つ': 'tsu', 'て': 'te', 'と': 'to',
+    'な': 'na', 'に': 'ni', 'ぬ': 'nu', 'ね': 'ne', 'の': 'no',
+    'は': 'ha', 'ひ': 'hi', 'ふ': 'fu', 'へ': 'he', 'ほ': 'ho',
+    'ま': 'ma', 'み': 'mi', 'む': 'mu', 'め': 'me', 'も': 'mo',
+    'や': 'ya', 'ゆ': 'yu', 'よ': 'yo',
+    'ら': 'ra', 'り': 'ri', 'る': 'ru', 'れ': 're', 'ろ': 'ro',
+    'わ': 'wa', 'ゐ': 'i', 'ゑ': 'e', 'を': 'o', 'ん': 'n',
+    'が': 'ga', 'ぎ': 'gi', 'ぐ': 'gu', 'げ': 'ge', 'ご': 'go',
+    'ざ': 'za', 'じ': 'ji', 'ず': 'zu', 'ぜ': 'ze', 'ぞ': 'zo',
+    'だ': 'da', 'ぢ': 'ji', 'づ': 'zu', 'で': 'de', 'ど': 'do',
+    'ば': 'ba', 'び': 'bi', 'ぶ': 'bu', 'べ': 'be', 'ぼ': 'bo',
+    'ぱ': 'pa', 'ぴ': 'pi', 'ぷ': 'pu', 'ぺ': 'pe', 'ぽ': 'po',
+    'ぁ': 'a', 'ぃ': 'i', 'ぅ': 'u', 'ぇ': 'e', 'ぉ': 'o', 'ゔ': 'vu',
+}
+_SMALL_Y = {'ゃ': 'a', 'ゅ': 'u', 'ょ': 'o'}
+# Hiragana and katakana blocks, so text without kana skips the character loop
+_HAS_KANA = re.compile('[\u3041-\u30ff]')
+# Applied in order by normalize_title: separators, then the long-vowel and m/n spelling variants
+_FOLDS = [(re.compile(pattern), replacement) for pattern, replacement in (
+    (r"[\W_]+", ' '),
+    (r'(?<=[a-z])(ou|oo)', 'o'),
+    (r'(?<=[a-z])uu', 'u'),
+    (r'm(?=[bpm])', 'n'),
+)]
+
+# Trigrams shared with a query, as a fraction of the union, below which a place is not a candidate
+MIN_SIMILARITY = 0.25
+
+
+def romanize_kana(text: str) -> str:
+    """Hepburn romaji for the kana in text; other characters are left as they are."""
+    if not _HAS_KANA.search(text):
+        return text
+    # Katakana sit 0x60 code points above their hiragana
+    text = ''.join(chr(ord(c) - 0x60) if 'ァ' <= c <= 'ヶ' else c for c in text)
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        nxt = text[i + 1] if i + 1 < len(text) else ''
+        if c in ('っ', 'ッ') and i + 1 < len(text):
+            # Sokuon doubles the next consonant
+            following = _KANA.get(nxt, '')
+            out.append('t' if following.startswith('ch') else following[:1])
+        elif c == 'ー':
+            # The long-vowel mark adds nothing once long vowels are collapsed
+            pass
+        elif c in _KANA and nxt in _SMALL_Y:
+            base = _KANA[c]
+            stem = base[:-1] if base.endswith('i') else base
+            out.append((stem if stem in ('sh', 'ch', 'j') else stem + 'y') + _SMALL_Y[nxt])
+            i += 1
+        else:
+            out.append(_KANA.get(c, c))
+        i += 1
+    return ''.join(out)
+
+
+def normalize_title(text: Optional[str]) -> str:
+    """Case-, punctuation- and diacritic-insensitive form of a place name, with romanization variants folded.
+
+    Kana become Hepburn romaji. Long vowels written with macrons, circumflexes or doubled
+    letters all collapse to one vowel (Kyōto, Kyouto and Kyoto all give "kyoto"). "m" before
+    b/p/m becomes "n" (Shimbashi and Shinbashi match). Punctuation and spacing become single
+    spaces.
+    """
+    if not text:
+        return ''
+    if not text.isascii():
+        # Plain ASCII has nothing to romanize or strip, and most stored titles are
+        text = romanize_kana(unicodedata.normalize('NFKC', text))
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    text = text.casefold()
+    for pattern, replacement in _FOLDS:
+        text = pattern.sub(replacement, text)
+    return ' '.join(text.split())
+
+
+def trigrams(normalized: str) -> Set[str]:
+    """Character trigrams of a normalized name with spaces removed, so "kiyomizu dera" matches "kiyomizudera"."""
+    compact = normalized.replace(' ', '')
+    if not compact:
+        return set()
+    padded = f'  {compact} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def place_trigrams(title: Optional[str], street_address: Optional[str] = None) -> Set[str]:
+    """Trigrams of a place: its title, plus its street address marked with a leading '@' so the two never mix."""
+    grams = trigrams(normalize_title(title))
+    if street_address:
+        grams |= {'@' + gram for gram in trigrams(normalize_title(street_address))}
+    return grams
+
+
+def _similarity(shared: int, size_a: int, size_b: int) -> float:
+    return shared / (size_a + size_b - shared) if size_a + size_b > shared else 0.0
+
+
+class TitleIndex:
+    """In-memory trigram postings over place titles and addresses, per (country, destination).
+
+    candidates() only visits the postings of the query's trigrams, so finding the handful of
+    stored places worth a full similarity check does not grow with the number of places.
+    Keys are whatever the caller uses to find a place again (positions in data here). The
+    places given to from_places are only grouped by destination; a destination's trigrams
+    are computed the first time it is searched or added to, so startup does not pay for the
+    destinations a run never researches.
+    """
+
+    def __init__(self):
+        self._postings: Dict[Tuple[str, str], Dict[str, List[int]]] = {}
+        self._sizes: Dict[Tuple[str, str], Dict[int, int]] = {}
+        self._pending: Dict[Tuple[str, str], List[Tuple[int, str, Optional[str]]]] = {}
+
+    @classmethod
+    def from_places(cls, data: Iterable[Tuple]) -> 'TitleIndex':
+        """Index place tuples, keyed by their position in data.
+
+        A PlaceTable is read through its title and address columns (title_rows), so no Item is parsed.
+        """
+        title_rows = getattr(data, 'title_rows', None)
+        if title_rows is not None:
+            rows = title_rows()
+        else:
+            rows = ((country, destination, item.proper_title, item.street_address) for _, country, destination, item, _ in data)
+        index = cls()
+        for i, (country, destination, title, street_address) in enumerate(rows):
+            index._pending.setdefault((country, destination), []).append((i, title, street_address))
+        return index
+
+    def _partition(self, country: str, destination: str) -> Tuple[Dict[str, List[int]], Dict[int, int]]:
+        """Postings and trigram counts of a destination, indexing its pending places first."""
+        partition = (country, destination)
+        postings = self._postings.setdefault(partition, {})
+        sizes = self._sizes.setdefault(partition, {})
+        for key, title, street_address in self._pending.pop(partition, ()):
+            grams = place_trigrams(title, street_address)
+            for gram in grams:
+                postings.setdefault(gram, []).append(key)
+            sizes[key] = len(grams)
+        return postings, sizes
+
+    def add(self, country: str, destination: str, key: int, title: str, street_address: Optional[str] = None):
+        postings, sizes = self._partition(country, destination)
+        grams = place_trigrams(title, street_address)
+        for gram in grams:
+            postings.setdefault(gram, []).append(key)
+        sizes[key] = len(grams)
+
+    def candidates(self, country: str, destination: str, title: str, street_address: Optional[str] = None,
+                   limit: int = 10, min_similarity: float = MIN_SIMILARITY) -> List[Tuple[int, float]]:
+        """Up to limit (key, trigram similarity) pairs for the places most like the query, best first."""
+        postings, sizes = self._partition(country, destination)
+        if not postings:
+            return []
+        grams = place_trigrams(title, street_address)
+        shared = Counter()
+        for gram in grams:
+            shared.update(postings.get(gram, ()))
+        scored = [(key, _similarity(count, len(grams), sizes[key])) for key, count in shared.items()]
+        scored = [pair for pair in scored if pair[1] >= min_similarity]
+        scored.sort(key=lambda pair: -pair[1])
+        return scored[:limit]
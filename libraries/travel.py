@@ -0,0 +1,217 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from libraries.data import PlaceTable, _as_filter, _place_ids, get_store
+from libraries.geo import haversine_matrix, place_coordinates
+from libraries.metrics import metrics
+
+# Straight-line distance times this factor approximates the distance along streets
+DETOUR_FACTOR = 1.3
+
+# Average door-to-door speed per travel mode, km/h
+MODE_SPEEDS_KMH = {
+    'walking': 4.8,
+    'bicycling': 15.0,
+    'transit': 20.0,
+    'driving': 30.0,
+}
+
+# Google's Distance Matrix API allows at most 100 elements (origins x destinations) per request
+GOOGLE_MAX_ELEMENTS = 100
+
+# A provider takes ([lat, lng] origins, [lat, lng] destinations, mode) and returns (distance in m, duration in s) matrices
+Provider = Callable[[np.ndarray, np.ndarray, str], Tuple[np.ndarray, np.ndarray]]
+
+
+def haversine_estimate(origins: np.ndarray, destinations: np.ndarray, mode: str = 'walking') -> Tuple[np.ndarray, np.ndarray]:
+    """Travel distance (m) and time (s) estimated from the great-circle distance and an average speed for mode."""
+    distance_km = haversine_matrix(origins, destinations) * DETOUR_FACTOR
+    return distance_km * 1000.0, distance_km / MODE_SPEEDS_KMH.get(mode, MODE_SPEEDS_KMH['walking']) * 3600.0
+
+
+def google_distance_matrix(gmaps) -> Provider:
+    """Provider backed by the Google Distance Matrix API; pairs Google cannot route are NaN."""
+    def provider(origins: np.ndarray, destinations: np.ndarray, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+        distances = np.full((len(origins), len(destinations)), np.nan)
+        durations = np.full((len(origins), len(destinations)), np.nan)
+        step = max(1, int(GOOGLE_MAX_ELEMENTS ** 0.5))
+        for i in range(0, len(origins), step):
+            for j in range(0, len(destinations), step):
+                response = gmaps.distance_matrix([tuple(row) for row in origins[i:i + step]], [tuple(row) for row in destinations[j:j + step]], mode=mode)
+                for a, result_row in enumerate(response.get('rows', [])):
+                    for b, element in enumerate(result_row.get('elements', [])):
+                        if element.get('status') == 'OK':
+                            distances[i + a, j + b] = element['distance']['value']
+                            durations[i + a, j + b] = element['duration']['value']
+        return distances, durations
+    return provider
+
+
+class StubProvider:
+    """Deterministic synthetic provider for tests and offline runs: the haversine estimate with seeded noise.
+
+    calls counts the requested (origin, destination) pairs, so tests can check what was served from the cache.
+    """
+
+    def __init__(self, seed: int = 0, noise: float = 0.2):
+        self.seed = seed
+        self.noise = noise
+        self.calls = 0
+
+    def __call__(self, origins: np.ndarray, destinations: np.ndarray, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+        self.calls += len(origins) * len(destinations)
+        distances, durations = haversine_estimate(origins, destinations, mode)
+        factor = 1.0 + np.random.default_rng(self.seed).uniform(0.0, self.noise, distances.shape)
+        return distances * factor, durations * factor
+
+
+class TravelTimeCache:
+    """Pairwise travel distances and times between places, persisted in the travel_times table.
+
+    Entries are keyed on (origin places.id, destination places.id, mode). Pairs missing from
+    the table are filled by provider and stored; with no provider, or where it has no answer,
+    the haversine estimate is used and stored as an estimate, which a later precompute() with
+    a real provider replaces. Places that are not saved yet get the estimate without being
+    stored. When the places come from a PlaceTable, passing it as table lets their places.id
+    be read from the table instead of the database.
+    """
+
+    def __init__(self, db_path: str, mode: str = 'walking', provider: Optional[Provider] = None,
+                 table: Optional[PlaceTable] = None):
+        self.db_path = db_path
+        self.mode = mode
+        self.provider = provider
+        self.table = table
+
+    def place_ids(self, places: List[Tuple]) -> List[Optional[int]]:
+        """places.id of each place tuple, by (country, destination, proper_title); None if not saved.
+
+        Ids are taken from table where it has them; the rest are looked up in batches (see _place_ids).
+        """
+        keys = [(place[1], place[2], place[3].proper_title) for place in places]
+        ids: Dict[Tuple[str, str, str], Optional[int]] = {}
+        if self.table is not None:
+            for place, key in zip(places, keys):
+                try:
+                    ids[key] = self.table.place_id(self.table.index(place))
+                except ValueError:
+                    pass
+        missing = [key for key in set(keys) if ids.get(key) is None]
+        if missing:
+            with get_store(self.db_path).connection() as conn:
+                ids.update(_place_ids(conn, missing))
+        return [ids.get(key) for key in keys]
+
+    def _lookup(self, origin_ids: List[int], destination_ids: Optional[List[int]] = None,
+                replace_estimates: bool = False) -> Dict[Tuple[int, int], Tuple[float, float]]:
+        """Cached entries from origin_ids (to destination_ids, or anywhere); estimates are skipped if they are to be replaced."""
+        if not origin_ids:
+            return {}
+        sql = f'SELECT origin_id, destination_id, distance_m, duration_s FROM travel_times WHERE mode = ? AND origin_id IN ({", ".join("?" * len(origin_ids))})'
+        params = [self.mode] + list(origin_ids)
+        if destination_ids is not None:
+            sql += f' AND destination_id IN ({", ".join("?" * len(destination_ids))})'
+            params += list(destination_ids)
+        if replace_estimates:
+            sql += " AND source != 'estimate'"
+        with get_store(self.db_path).connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return {(origin, destination): (distance, duration) for origin, destination, distance, duration in rows}
+
+    def _fill(self, ids: List[int], coords: np.ndarray, known: Dict[Tuple[int, int], Tuple[float, float]],
+              origin_rows: Optional[Iterable[int]] = None) -> Dict[Tuple[int, int], Tuple[float, float]]:
+        """Compute and store the pairs from ids[origin_rows] (default: all) to ids that known lacks; returns the new entries."""
+        origin_rows = range(len(ids)) if origin_rows is None else origin_rows
+        missing_rows = [i for i in origin_rows if any(ids[i] != b and (ids[i], b) not in known for b in ids)]
+        if not missing_rows:
+            return {}
+        origins = coords[missing_rows]
+        distances, durations = haversine_estimate(origins, coords, self.mode)
+        source = np.full(distances.shape, 'estimate', dtype=object)
+        if self.provider is not None:
+            api_distances, api_durations = self.provider(origins, coords, self.mode)
+            answered = ~np.isnan(api_durations)
+            distances = np.where(answered, api_distances, distances)
+            durations = np.where(answered, api_durations, durations)
+            source[answered] = 'api'
+
+        now = time.time()
+        added = {}
+        params = []
+        for r, i in enumerate(missing_rows):
+            for j, b in enumerate(ids):
+                a = ids[i]
+                if a == b or (a, b) in known:
+                    continue
+                added[(a, b)] = (float(distances[r, j]), float(durations[r, j]))
+                params.append((a, b, self.mode, float(distances[r, j]), float(durations[r, j]), source[r, j], now))
+        with get_store(self.db_path).transaction() as conn:
+            conn.executemany('''
+            INSERT OR REPLACE INTO travel_times (origin_id, destination_id, mode, distance_m, duration_s, source, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', params)
+        return added
+
+    def matrix(self, places: List[Tuple], metric: str = 'duration', symmetric: bool = True,
+               place_ids: Optional[List[Optional[int]]] = None) -> np.ndarray:
+        """(n, n) matrix of travel durations (s) or distances (m, metric='distance') between places.
+
+        Cached pairs are only looked up; the rest are filled as described above. The route
+        solver's moves assume a symmetric matrix, so by default each pair gets the mean of its
+        two directions. Places without coordinates get NaN rows and columns. place_ids, when
+        the caller knows them, are the places.id of places (None for unsaved ones).
+        """
+        n = len(places)
+        coords = place_coordinates(places)
+        distances, durations = haversine_estimate(coords, coords, self.mode)
+        values = durations if metric == 'duration' else distances
+
+        ids = self.place_ids(places) if place_ids is None else place_ids
+        stored = [i for i in range(n) if ids[i] is not None and not np.isnan(coords[i]).any()]
+        stored_ids = [ids[i] for i in stored]
+        if stored_ids:
+            known = self._lookup(stored_ids, stored_ids)
+            added = self._fill(stored_ids, coords[stored], known)
+            metrics.cache('travel_times', hits=len(known), misses=len(added))
+            known.update(added)
+            column = 0 if metric == 'distance' else 1
+            position = {place_id: i for i, place_id in zip(stored, stored_ids)}
+            for (a, b), entry in known.items():
+                values[position[a], position[b]] = entry[column]
+
+        np.fill_diagonal(values, 0.0)
+        if symmetric:
+            values = (values + values.T) / 2
+        return values
+
+    def precompute(self, country: Union[str, Iterable[str], None] = None, destination: Union[str, Iterable[str], None] = None,
+                   batch_size: int = 200) -> int:
+        """Fill every missing pair between the geocoded places of each destination; returns the number of pairs added.
+
+        Estimates already in the table are recomputed when a provider is set. Places are
+        processed in origin batches of batch_size so memory stays bounded for large destinations.
+        """
+        clauses, params = ['lat IS NOT NULL', 'lng IS NOT NULL'], []
+        for column, value in (('country', country), ('destination', destination)):
+            clause, values = _as_filter(column, value)
+            if clause:
+                clauses.append(clause)
+                params.extend(values)
+        with get_store(self.db_path).connection() as conn:
+            rows = conn.execute(f'SELECT id, country, destination, lat, lng FROM places WHERE {" AND ".join(clauses)} ORDER BY id', params).fetchall()
+
+        groups: Dict[Tuple[str, str], List[Tuple[int, float, float]]] = {}
+        for place_id, row_country, row_destination, lat, lng in rows:
+            groups.setdefault((row_country, row_destination), []).append((place_id, lat, lng))
+
+        added = 0
+        for members in groups.values():
+            ids = [member[0] for member in members]
+            coords = np.array([member[1:] for member in members], dtype=float)
+            for start in range(0, len(ids), batch_size):
+                rows = range(start, min(start + batch_size, len(ids)))
+                known = self._lookup([ids[i] for i in rows], replace_estimates=self.provider is not None)
+                added += len(self._fill(ids, coords, known, rows))
+        return added
@@ -1,25 +1,69 @@
 import argparse
-import json
 import re
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Reference point for the startup timing report
+STARTUP_START = time.perf_counter()
+
 import google.generativeai as genai
 import os
 import googlemaps
+import numpy as np
 import pydantic
 from pydantic import ValidationError
 from rich.console import Console
-from interface import load_interface
 from libraries.data import * 
+from libraries.ann import load_dedup_index
+from libraries.batch import itinerary_json, load_manifest, manifest_preferences, trip_days, write_trip
+from libraries.embeddings import EmbeddingCache, EmbeddingIndex, batch_embedder, embed_texts, embedding_text
+from libraries.itinerary import ItinerarySession
+from libraries.jobs import JOB_FAILED, ResearchJobs, item_key
+from libraries.llm_cache import LLMResponseCache
+from libraries.maps import MapsResponseCache, fetch_place_details_batch
+from libraries.metrics import metrics
+from libraries.research import MODEL_RATE_LIMITS, ResearchTask, TokenBucket, stream_research
+from libraries.streaming import stream_items
+from libraries.titles import TitleIndex
+from libraries.travel import MODE_SPEEDS_KMH, TravelTimeCache, google_distance_matrix
 from tools import generate_embedding, get_place_details, search_data_for_item
 
 console = Console()
 
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, reported just before the interface launches."""
+
+    def __init__(self, start):
+        self.last = start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        from rich.table import Table
+
+        table = Table(title="Startup timings")
+        table.add_column("Phase")
+        table.add_column("Seconds", justify="right")
+        for phase, seconds in self.phases:
+            table.add_row(phase, f"{seconds:.3f}")
+        table.add_row("[bold]Total", f"[bold]{sum(seconds for _, seconds in self.phases):.3f}")
+        console.print(table)
+
+
 MODEL_NAME = "gemini-1.5-flash"
 EMBEDDING_MODEL_NAME = "text-multilingual-embedding-002"
+# Embedding batches in a row that may fail (falling back to title search) before research stops
+MAX_EMBEDDING_FAILURES = 3
 
 genai.configure(api_key=os.environ["GEMINI_API_KEY"])
 gmaps = googlemaps.Client(key=os.environ["GMAPS_API_KEY"])
+gemini_rate_limiter = TokenBucket.per_minute(MODEL_RATE_LIMITS.get(MODEL_NAME, 15))
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Travel information gathering and processing script")
@@ -31,11 +75,83 @@ def parse_arguments():
                         help="Clear all preference-related records from the database before executing the script")
     parser.add_argument("-r", "--reset-all", action="store_true",
                         help="Drop all tables from the SQLite database and then run the script as normal")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Maximum number of Gemini requests to run concurrently during research")
+    parser.add_argument("-b", "--bypass-llm-cache", action="store_true",
+                        help="Ask Gemini again instead of replaying cached responses (fresh responses are still cached)")
+    parser.add_argument("-m", "--travel-mode", choices=sorted(MODE_SPEEDS_KMH), default="walking",
+                        help="Travel mode used to cost the legs of itinerary routes")
+    parser.add_argument("-g", "--google-travel-times", action="store_true",
+                        help="Fetch travel times from the Google Distance Matrix API instead of estimating them from distance")
+    parser.add_argument("-M", "--metrics", action="store_true",
+                        help="Print a summary of pipeline timings, cache hit rates and retries once research is done")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Write every timed span to FILE as Chrome trace-event JSON (implies --metrics)")
+    parser.add_argument("--batch", metavar="MANIFEST",
+                        help="Plan every trip in a JSON/YAML manifest without prompting, write the itineraries to files and skip the interface")
+    parser.add_argument("-o", "--output-dir",
+                        help="Directory for the batch itinerary files (default: the manifest's output_dir, or ./itineraries)")
+    parser.add_argument("-t", "--timings", action="store_true",
+                        help="Print how long each startup phase took before launching the interface")
     return parser.parse_args()
 
+# Embeds a batch of texts through the tools helper, several requests at a time
+embed_batch = metrics.timed("embedding.batch")(batch_embedder(
+    lambda text: generate_embedding(text, EMBEDDING_MODEL_NAME, os.environ["GEMINI_API_KEY"])
+))
+
+# Maps lookups run on fetch_place_details_batch's worker threads; each one is timed
+timed_place_details = metrics.timed("maps.get_place_details")(get_place_details)
+
+def plan_trips(manifest, data, prompt_types, travel_times, research_jobs, output_dir, workers, started):
+    """Builds the itinerary of every destination in a batch manifest, writes one file per trip and reports the throughput."""
+    def places_for(trip, destination_plan):
+        """Positions in data of the places the traveller's own research found for the destination."""
+        matching = data.mask(country=trip.country, destination=destination_plan.name, place_type=prompt_types)
+        linked = research_jobs.places(trip.country, destination_plan.name, prompt_types, scope=trip.traveller)
+        positions = sorted(i for i in map(data.position_of, linked) if i is not None and matching[i])
+        if not positions:
+            console.print(f"[yellow]No research for {trip.traveller} in {destination_plan.name} - planning with every known place there.")
+            positions = np.flatnonzero(matching).tolist()
+        return positions
+
+    def plan(destination_plan, indexes):
+        session = ItinerarySession(cost_matrix=travel_times.matrix)
+        return itinerary_json(session.update({i: data[i] for i in indexes}, trip_days(destination_plan)))
+
+    # Each destination is clustered and routed on its own, so they are planned concurrently
+    jobs = [(trip, destination_plan) for trip in manifest.trips for destination_plan in trip.destinations]
+    selections = [places_for(trip, destination_plan) for trip, destination_plan in jobs]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="itinerary") as executor:
+        results = iter(list(executor.map(lambda job, indexes: plan(job[1], indexes), jobs, selections)))
+
+    # Results come back in job order; a trip may visit the same destination twice, so they are kept by position
+    itineraries = [[next(results) for _ in trip.destinations] for trip in manifest.trips]
+    for trip, trip_itineraries in zip(manifest.trips, itineraries):
+        path = write_trip(output_dir, trip, trip_itineraries)
+        console.print(f"[green]Wrote {trip.traveller}'s {trip.country} itinerary to {path}")
+
+    from rich.table import Table
+
+    minutes = (time.perf_counter() - started) / 60
+    table = Table(title="Batch throughput")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    table.add_row("Trips", str(len(manifest.trips)))
+    table.add_row("Destinations planned", str(len(jobs)))
+    table.add_row("Distinct destinations", str(len({(trip.country, destination_plan.name) for trip, destination_plan in jobs})))
+    table.add_row("Elapsed minutes", f"{minutes:.2f}")
+    table.add_row("[bold]Destinations/minute", f"[bold]{len(jobs) / minutes if minutes > 0 else float('inf'):.1f}")
+    console.print(table)
+
+
 def main():
     args = parse_arguments()
     db_path = 'places.db'
+    timer = StartupTimer(STARTUP_START)
+    timer.mark("Imports")
+    if args.metrics or args.trace:
+        metrics.enable(trace=bool(args.trace))
 
     if args.reset_all:
         reset_database(db_path)
@@ -44,11 +160,10 @@ def main():
     elif args.clear_prefs:
         clear_preferences(db_path)
 
-    # Load existing data
-    data = load_data_from_db(db_path)
-
-    def call_gemini(prompt, schema):
-        """Calls the Gemini API with the provided prompt and returns the response."""
+    def call_gemini(prompt, schema, stream=False):
+        """Calls the Gemini API with the provided prompt and returns the response (or an iterator of its text chunks if stream is set)."""
+        with metrics.span("gemini.rate_limit_wait"):
+            gemini_rate_limiter.acquire()
         model = genai.GenerativeModel(
             MODEL_NAME,
             generation_config={
@@ -56,7 +171,11 @@ def main():
                 "response_schema": schema
             }
         )
-        response = model.generate_content(f"{prompt}")
+        with metrics.span("gemini.request"):
+            response = model.generate_content(f"{prompt}", stream=stream)
+        if stream:
+            # The request returns once the first chunk arrives; the rest of the generation is timed as it is read
+            return metrics.timed_iter("gemini.stream", (chunk.text for chunk in response))
         return response
 
 
@@ -74,7 +193,8 @@ def main():
                 time.sleep(1)
 
 
-    def get_destination_specific_info(destination, country, question, gen_info, dest_info, question_type):
+    def build_prompt(destination, country, question, gen_info, dest_info, question_type):
+        """Renders the full research prompt: the question plus the general and destination-specific preferences."""
         
         # Compile user responses into a context variable to be used when prompting gemini
         user_context = f"""Please use the following general {question_type} preferences to guide your suggestions when answering the question: 
@@ -112,20 +232,21 @@ def main():
         
         Please provide your response below:
         """
+        return prompt
 
-        # Call API and return response
-        while True:
-            response = call_gemini(prompt, ItemList)
-            if response:
-                response_dict = json.loads(response.text)
-                try:
-                    resp_obj = json_to_model(ItemList, response_dict)
-                    return resp_obj
-                except ValidationError as e:
-                    console.print(f"[red]Validation error: {e}[/red] [yellow]\nTrying again![/yellow]")
-            else:
-                sys.exit(1)
 
+    def get_destination_specific_info(destination, country, prompt):
+        """Yields the suggested items one by one as Gemini generates them."""
+
+        # Stream the response; items that fail validation are re-requested on their own rather than retrying the whole list
+        # Identical prompts (same instructions and preferences) are replayed from the response cache
+        def request(text):
+            return llm_cache.stream(MODEL_NAME, text, ItemList, lambda: call_gemini(text, ItemList, stream=True), country, destination)
+        yield from stream_items(request, prompt)
+
+
+    # A batch manifest replaces the hard-coded trip below and the interactive questions
+    manifest = load_manifest(args.batch) if args.batch else None
 
     # List of countries to get travel info for
     countries = ["Japan"]
@@ -135,9 +256,27 @@ def main():
         "Japan": ["Tokyo", "Kyoto", "Kanazawa", "Osaka"],
     }
 
+    if manifest:
+        countries = list(dict.fromkeys(trip.country for trip in manifest.trips))
+        destinations = {
+            country: list(dict.fromkeys(plan.name for trip in manifest.trips if trip.country == country for plan in trip.destinations))
+            for country in countries
+        }
+
+    # Load existing data for the destinations in this session only, into the compact columnar table
+    data = load_place_table(db_path, country=countries, destination=[d for country in countries for d in destinations[country]])
+    # Keyed by places.id and kept on disk, so only places added since the last save are indexed here
+    embedding_index = load_dedup_index(db_path)
+    title_index = TitleIndex.from_places(data)
+    maps_cache = MapsResponseCache(db_path)
+    embedding_cache = EmbeddingCache(db_path)
+    llm_cache = LLMResponseCache(db_path, bypass=args.bypass_llm_cache)
+    travel_times = TravelTimeCache(db_path, args.travel_mode, google_distance_matrix(gmaps) if args.google_travel_times else None, table=data)
+    timer.mark("Load places and indexes")
+
     # destination_info is a dictionary that will store information for each destination
     #prompt_types = ['activity', 'accomodation', 'food', 'day trip']
-    prompt_types = ['activity']
+    prompt_types = manifest.prompt_types if manifest else ['activity']
     trip_info = {}
     gen_info = {}
 
@@ -149,79 +288,235 @@ def main():
         "day trip": "Please suggest a list of 5 day trips that I can take while traveling in {destination}, {country} as a tourist. Each suggestion should be for a specific, unique location that is mappable on Google Maps. Include the full name and street address for each suggestion.Do not make suggestions that involve greater than 2 hours of travel from {destination}.",
     }
 
-    # Update the general preferences section
-    gen_info = load_general_preferences(db_path, countries[0])  # Assuming one country for simplicity
-
-    if not gen_info:
-        # Start asking general questions
-        gen_info['activity'] = ask_user_question("What sort of activities are you looking to do on your trip?")
-        gen_info['accomodation'] = ask_user_question("What sort of accomodations do you prefer?")
-        gen_info['food'] = ask_user_question("What kind of food do you like?")
-        gen_info['day trip'] = ask_user_question("Are you interested in any specific day trips? Or types of day trips?")
+    unknown = [prompt_type for prompt_type in prompt_types if prompt_type not in instructions]
+    if unknown:
+        console.print(f"[red]Unknown prompt types in the manifest: {', '.join(unknown)} (expected {', '.join(instructions)})")
+        sys.exit(1)
 
-        # Save responses to database
-        save_general_preferences(db_path, countries[0], gen_info)
+    if manifest:
+        # Preferences come from the manifest, per traveller; they are not saved, so interactive preferences stay as they were
+        gen_infos, dest_infos, conflicts = manifest_preferences(manifest)
+        for conflict in conflicts:
+            console.print(f"[yellow]{conflict}")
+    else:
+        # Update the general preferences section
+        gen_info = load_general_preferences(db_path, countries[0])  # Assuming one country for simplicity
 
-    # Update the destination-specific preferences section
-    for country in countries:
-        for destination in destinations[country]:
-            dest_info = load_destination_preferences(db_path, country, destination)
+        if not gen_info:
+            # Start asking general questions
+            gen_info['activity'] = ask_user_question("What sort of activities are you looking to do on your trip?")
+            gen_info['accomodation'] = ask_user_question("What sort of accomodations do you prefer?")
+            gen_info['food'] = ask_user_question("What kind of food do you like?")
+            gen_info['day trip'] = ask_user_question("Are you interested in any specific day trips? Or types of day trips?")
 
-            if not dest_info:
-                # Get date range for destination
-                dest_info['start_date'] = ask_user_question(f"What is the start date for your trip to {destination}, {country} (MM/DD/YYYY)?")
-                dest_info['end_date'] = ask_user_question(f"What is the end date for your trip to {destination}, {country} (MM/DD/YYYY)?")
-                
-                # Get activities for the trip
-                dest_info['activity'] = ask_user_question(f"Are there any specific activities you are looking for in {destination}, {country}?")
-                
-                # Get food preferences for the trip
-                dest_info['food'] = ask_user_question(f"Are there any specific types of food you are looking for in {destination}, {country}?")
-                
-                # Save responses to database
-                save_destination_preferences(db_path, country, destination, dest_info)
+            # Save responses to database
+            save_general_preferences(db_path, countries[0], gen_info)
 
-    if not args.skip_research:
-        # Start asking destination-specific questions
+        # Update the destination-specific preferences section
         for country in countries:
             for destination in destinations[country]:
-                
                 dest_info = load_destination_preferences(db_path, country, destination)
+
+                if not dest_info:
+                    # Get date range for destination
+                    dest_info['start_date'] = ask_user_question(f"What is the start date for your trip to {destination}, {country} (MM/DD/YYYY)?")
+                    dest_info['end_date'] = ask_user_question(f"What is the end date for your trip to {destination}, {country} (MM/DD/YYYY)?")
+                
+                    # Get activities for the trip
+                    dest_info['activity'] = ask_user_question(f"Are there any specific activities you are looking for in {destination}, {country}?")
                 
-                # Prompt Gemini for recommendations/suggestions for the trip - factoring in user's general and destination-specific preferences
-                cntr = 0
-                for prompt_type in prompt_types:
-                    curr_prompt = instructions[prompt_type].format(destination=destination, country=country)
-                    with console.status(f"[green]Getting {prompt_type} info for {destination}, {country}...", spinner="earth"):
-                        list_obj = get_destination_specific_info(destination, country, curr_prompt, gen_info, dest_info, prompt_type)
-                        for item in list_obj.items:
-                            # Set the type attribute based on the current prompt_type
-                            item.type = prompt_type
-                            console.print(f"[yellow]Looking for {item.proper_title} in {country} {destination}...")
-                            #item_embedding = generate_embedding(f"{country} {destination} {item.proper_title}", EMBEDDING_MODEL_NAME, os.environ["GEMINI_API_KEY"])
-                            item_embedding = None
-                            if item.is_specific_location:
-                                console.print(f"[green]Generated text embedding.... Searching for existing entry...")
-                                retrieved_item = search_data_for_item(console, data, country, destination, item)
-                                if not retrieved_item:
-                                    console.print(f"[red]No match found above theshold 0.93 - Getting from Google Maps...")
-                                    try:
-                                        api_responses = get_place_details(gmaps, item.proper_title, destination)
-                                        console.print(f"[green]Got Google Maps data: ")
-                                    except ValueError:
-                                        console.print(f"[red]Failed. Could not find on Google Maps...")
-                                    data.append((item_embedding, country, destination, item, api_responses))
-                                else:
-                                    console.print(f"[green]Found similar entry: {retrieved_item[3].proper_title}! (vs {item.proper_title}...)")
-                            else:
-                                data.append((item_embedding, country, destination, item, {}))
-                            cntr += 1
-                    save_data_to_db(db_path, data)
+                    # Get food preferences for the trip
+                    dest_info['food'] = ask_user_question(f"Are there any specific types of food you are looking for in {destination}, {country}?")
                 
-                if MODEL_NAME == "gemini-1.5-pro":       
-                    with console.status(f"[orange]Waiting 30 seconds to avoid Gemini rate limit on Pro API...", spinner="dots"):
-                        time.sleep(15)
-    load_interface(data, prompt_types)  
+                    # Save responses to database
+                    save_destination_preferences(db_path, country, destination, dest_info)
+
+        # The general preferences apply to every country; interactive research is not scoped to a traveller
+        gen_infos = {('', country): gen_info for country in countries}
+        dest_infos = {
+            ('', country, destination): load_destination_preferences(db_path, country, destination)
+            for country in countries for destination in destinations[country]
+        }
+
+    timer.mark("Preferences")
+
+    # Progress is checkpointed in the research_jobs table: finished jobs are skipped and an interrupted job only redoes its unsaved items
+    jobs = ResearchJobs(db_path)
+
+    if not args.skip_research:
+        # Prompt Gemini for recommendations/suggestions for the trip - factoring in user's general and destination-specific preferences
+        # The rendered prompt includes the preferences, so a job whose preferences changed is started over (see ResearchJobs)
+        tasks = [
+            ResearchTask(country, destination, prompt_type, build_prompt(
+                destination, country, instructions[prompt_type].format(destination=destination, country=country),
+                gen_infos[(scope, country)], dest_info, prompt_type
+            ), scope)
+            for (scope, country, destination), dest_info in dest_infos.items() for prompt_type in prompt_types
+        ]
+
+        if jobs.recover():
+            console.print("[yellow]Resuming research interrupted in a previous run...")
+        jobs.enqueue(tasks)
+        if args.bypass_llm_cache:
+            # Fresh responses are wanted, so finished jobs have to run again as well
+            jobs.reset(tasks)
+
+        def research(task):
+            done = jobs.done_items(task)
+            jobs.start(task)
+            try:
+                for item in get_destination_specific_info(task.destination, task.country, task.prompt):
+                    if item_key(item.proper_title) not in done:
+                        yield item
+            except Exception as e:
+                # Empty responses, rate limits and network errors only fail this job; it is retried after a backoff
+                retry = jobs.fail(task, e)
+                console.print(f"[red]{task.prompt_type} research for {task.destination} failed ({e})" + (" - will retry." if retry else " - giving up."))
+
+        embedding_failures = 0
+
+        @metrics.timed("research.process_batch")
+        def process_research_batch(task, items):
+            """Dedups a batch of streamed items against data, geocodes the new places and saves them."""
+            nonlocal embedding_failures
+            if not items:
+                return
+            country, destination, prompt_type = task.country, task.destination, task.prompt_type
+            # Embed the whole batch at once (known places come from the embedding cache)
+            texts = [embedding_text(country, destination, item.proper_title) for item in items]
+            try:
+                embeddings = embed_texts(texts, EMBEDDING_MODEL_NAME, embed_batch, embedding_cache)
+                embedding_failures = 0
+                console.print(f"[green]Generated text embeddings for {len(texts)} items.")
+            except Exception as e:
+                # A passing outage only costs this batch its vectors; one that persists (bad key or model) stops the run
+                embedding_failures += 1
+                metrics.count("embedding.failures")
+                if embedding_failures >= MAX_EMBEDDING_FAILURES:
+                    raise RuntimeError(f"Embedding failed for {embedding_failures} batches in a row") from e
+                console.print(f"[red]Failed to generate embeddings ({e}) - falling back to title search...")
+                embeddings = [None] * len(texts)
+
+            # Dedup against stored places first; new places get a placeholder row that is filled in once the batched Maps lookups finish
+            pending = []
+            # Where each item ended up in data, new place or known one, so the places can be linked to this job
+            positions = []
+            # New places have no places.id until the batch is saved, so repeats within the batch are found by position here
+            batch_index = EmbeddingIndex()
+            for item, item_embedding in zip(items, embeddings):
+                # Set the type attribute based on the current prompt_type
+                item.type = prompt_type
+                console.print(f"[yellow]Looking for {item.proper_title} in {country} {destination}...")
+                if item.is_specific_location:
+                    console.print(f"[green]Searching for existing entry...")
+                    match = None
+                    if item_embedding is not None:
+                        place_id = embedding_index.best_match(country, destination, item_embedding)
+                        match = data.position_of(place_id) if place_id is not None else None
+                        if match is None:
+                            match = batch_index.best_match(country, destination, item_embedding)
+                    if match is not None:
+                        retrieved_item = data[match]
+                    else:
+                        # Places stored before embeddings were generated are not in the index yet; only titles that share
+                        # enough trigrams with this one are compared in full
+                        candidates = [data[key] for key, _ in title_index.candidates(country, destination, item.proper_title, item.street_address)]
+                        with metrics.span("dedup.search_data_for_item"):
+                            retrieved_item = search_data_for_item(console, candidates, country, destination, item) if candidates else None
+                        if retrieved_item and retrieved_item[0] is None and item_embedding is not None:
+                            # Once the batch is saved, add_new_places indexes the backfilled embedding as well
+                            position = data.index(retrieved_item)
+                            data[position] = (item_embedding,) + retrieved_item[1:]
+                            batch_index.add(country, destination, position, item_embedding)
+                    metrics.count("dedup.duplicates" if retrieved_item else "dedup.new_places")
+                    if not retrieved_item:
+                        console.print(f"[red]No match found above theshold 0.93 - Getting from Google Maps...")
+                        data.append((item_embedding, country, destination, item, {}))
+                        pending.append(len(data) - 1)
+                        title_index.add(country, destination, len(data) - 1, item.proper_title, item.street_address)
+                        if item_embedding is not None:
+                            batch_index.add(country, destination, len(data) - 1, item_embedding)
+                        positions.append(len(data) - 1)
+                    else:
+                        console.print(f"[green]Found similar entry: {retrieved_item[3].proper_title}! (vs {item.proper_title}...)")
+                        positions.append(match if match is not None else data.index(retrieved_item))
+                else:
+                    data.append((item_embedding, country, destination, item, {}))
+                    positions.append(len(data) - 1)
+
+            # Look up every new place in this list concurrently (repeats come from the Maps cache)
+            queries = [data[i][3].proper_title for i in pending]
+            for i, api_responses in zip(pending, fetch_place_details_batch(gmaps, queries, destination, timed_place_details, maps_cache)):
+                if api_responses is None:
+                    console.print(f"[red]Failed. Could not find {data[i][3].proper_title} on Google Maps...")
+                    continue
+                data[i] = data[i][:4] + (api_responses,)
+            console.print(f"[green]Got Google Maps data for {len(pending)} new places.")
+            console.print(f"[green]Processed {len(items)} {prompt_type} items for {destination}, {country}.")
+            save_data_to_db(db_path, data)
+            # The new and backfilled places now have their places.id and join the persistent index; the
+            # backfilled ones stay recorded in the database until it is saved, so an interrupted run keeps them
+            with get_store(db_path).connection() as conn:
+                embedding_index.add_new_places(conn)
+            jobs.link_places(task, [place_id for place_id in map(data.place_id, positions) if place_id is not None])
+
+        while True:
+            runnable = jobs.runnable(tasks)
+            if not runnable:
+                wait = jobs.next_retry_in(tasks)
+                if wait is None:
+                    break
+                console.print(f"[yellow]Waiting {wait:.0f}s before retrying failed research...")
+                time.sleep(wait)
+                continue
+
+            # Requests run concurrently and stream their items; batches are merged into data in task order, the current task's as soon as they arrive
+            with console.status(f"[green]Getting info for {len(runnable)} destination/prompt combinations...", spinner="earth"):
+                for task, items in stream_research(runnable, research, max_workers=args.workers):
+                    process_research_batch(task, items)
+                    if not items:
+                        jobs.finish(task)
+                    else:
+                        jobs.items_done(task, [item.proper_title for item in items])
+
+        for task in jobs.with_state(tasks, JOB_FAILED):
+            console.print(f"[red]Gave up on {task.prompt_type} research for {task.destination}: {jobs.last_error(task)}")
+        embedding_index.save(db_path)
+
+        timer.mark("Research")
+
+        # Fill the travel-time matrix for every pair of places in each destination, so routing only does lookups
+        with console.status("[green]Precomputing travel times...", spinner="earth"):
+            added = travel_times.precompute(country=countries, destination=[d for country in countries for d in destinations[country]])
+        console.print(f"[green]Cached {added} new travel times.")
+        timer.mark("Travel times")
+
+    def report():
+        if args.timings:
+            timer.report()
+        if args.metrics or args.trace:
+            metrics.report(console)
+        if args.trace:
+            metrics.write(args.trace)
+            console.print(f"[green]Wrote trace to {args.trace}")
+
+    if manifest:
+        # Headless: write the itineraries instead of launching the interface
+        plan_trips(manifest, data, prompt_types, travel_times, jobs, args.output_dir or manifest.output_dir or "itineraries", args.workers, STARTUP_START)
+        timer.mark("Itineraries")
+        report()
+        console.print("[green]All Done!")
+        return
+
+    # Imported here so gradio is only loaded once the data is ready
+    from interface import load_interface
+    timer.mark("Import interface")
+
+    def interface_built():
+        timer.mark("Build interface")
+        report()
+
+    load_interface(data, prompt_types, on_built=interface_built, travel_times=travel_times)
 
     console.print("[green]All Done!")
 
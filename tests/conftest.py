@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libraries.data import get_store
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh places.db; its pooled connections are closed after the test."""
+    path = str(tmp_path / 'places.db')
+    yield path
+    get_store(path).close()
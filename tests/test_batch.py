@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from libraries.batch import BatchManifest, load_manifest, trip_slug, write_trip
+
+
+def write_manifest(tmp_path, trips):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps({'trips': trips}), encoding='utf-8')
+    return str(path)
+
+
+def test_trips_that_share_a_file_are_rejected(tmp_path):
+    tokyo = [{'name': 'Tokyo'}]
+    with pytest.raises(ValueError, match='Trips 1 and 2'):
+        load_manifest(write_manifest(tmp_path, [{'traveller': 'Alice', 'country': 'Japan', 'destinations': tokyo},
+                                                {'traveller': 'alice', 'country': 'Japan', 'destinations': tokyo}]))
+
+    # Start dates tell a traveller's trips to one country apart
+    manifest = load_manifest(write_manifest(tmp_path, [
+        {'traveller': 'Alice', 'country': 'Japan', 'destinations': [{'name': 'Tokyo', 'start_date': '2026-04-01', 'end_date': '2026-04-05'}]},
+        {'traveller': 'Alice', 'country': 'Japan', 'destinations': [{'name': 'Tokyo', 'start_date': '11/02/2026', 'end_date': '11/04/2026'}]},
+    ]))
+    assert [trip_slug(trip) for trip in manifest.trips] == ['alice-japan-2026-04-01', 'alice-japan-2026-11-02']
+
+
+def test_a_destination_visited_twice_keeps_both_itineraries(tmp_path):
+    trip = BatchManifest(trips=[{'traveller': 'Bob', 'country': 'Japan', 'destinations': [
+        {'name': 'Tokyo', 'start_date': '2026-04-01', 'end_date': '2026-04-03'},
+        {'name': 'Kyoto', 'start_date': '2026-04-03', 'end_date': '2026-04-05'},
+        {'name': 'Tokyo', 'start_date': '2026-04-05', 'end_date': '2026-04-06'},
+    ]}]).trips[0]
+    itineraries = [[[{'title': 'Tokyo Tower'}]], [[{'title': 'Gion'}]], [[{'title': 'Senso-ji'}]]]
+
+    with open(write_trip(str(tmp_path), trip, itineraries), encoding='utf-8') as f:
+        written = json.load(f)
+    assert [(stop['name'], stop['itinerary']) for stop in written['destinations']] == [
+        ('Tokyo', itineraries[0]), ('Kyoto', itineraries[1]), ('Tokyo', itineraries[2])]
@@ -0,0 +1,105 @@
+import json
+import sqlite3
+import threading
+
+import numpy as np
+
+from libraries.data import (Item, get_store, load_data_from_db, load_destination_preferences, load_general_preferences,
+                            places_near, save_data_to_db)
+
+
+def item(title, description, street_address):
+    return Item(item_title=f"Visit {title}", proper_title=title, description=description, is_specific_location=True,
+                street_address=street_address, type='activity')
+
+
+def baseline_database(path):
+    """A database as the original code left it: every save re-inserted all places and their responses."""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+    CREATE TABLE places (id INTEGER PRIMARY KEY AUTOINCREMENT, embedding BLOB, country TEXT, destination TEXT, proper_title TEXT, pydantic_data TEXT);
+    CREATE TABLE google_api_responses (id INTEGER PRIMARY KEY AUTOINCREMENT, place_id INTEGER, response_type TEXT, response_data TEXT,
+                                       FOREIGN KEY(place_id) REFERENCES places(id));
+    CREATE TABLE general_preferences (id INTEGER PRIMARY KEY AUTOINCREMENT, country TEXT UNIQUE, preferences TEXT);
+    CREATE TABLE destination_preferences (id INTEGER PRIMARY KEY AUTOINCREMENT, country TEXT, destination TEXT, preferences TEXT,
+                                          UNIQUE(country, destination));
+    ''')
+    tower = {'geocode': {'geometry': {'location': {'lat': 35.6586, 'lng': 139.7454}}}}
+    saves = [
+        [(item('Tokyo Tower', 'Old description', '4-2-8 Shibakoen'), tower), (item('Senso-ji', 'A temple', '2-3-1 Asakusa'), {})],
+        [(item('Tokyo Tower', 'New description', '4-2-8 Shibakoen'), {**tower, 'place_details': {'rating': 4.5}}),
+         (item('Senso-ji', 'A temple', '2-3-1 Asakusa'), {})],
+    ]
+    embedding = np.arange(4, dtype=np.float32)
+    for places in saves:
+        for place_item, responses in places:
+            cursor = conn.execute('INSERT INTO places (embedding, country, destination, proper_title, pydantic_data) VALUES (?, ?, ?, ?, ?)',
+                                  (embedding.tobytes(), 'Japan', 'Tokyo', place_item.proper_title, place_item.json()))
+            for response_type, response_data in responses.items():
+                conn.execute('INSERT INTO google_api_responses (place_id, response_type, response_data) VALUES (?, ?, ?)',
+                             (cursor.lastrowid, response_type, json.dumps(response_data)))
+    conn.execute("INSERT INTO general_preferences (country, preferences) VALUES ('Japan', ?)", (json.dumps({'activity': 'museums'}),))
+    conn.execute("INSERT INTO destination_preferences (country, destination, preferences) VALUES ('Japan', 'Tokyo', ?)",
+                 (json.dumps({'start_date': '2026-04-01', 'food': 'ramen'}),))
+    conn.commit()
+    conn.close()
+    return saves[-1]
+
+
+def test_migration_keeps_the_newest_copy_of_each_place(db_path):
+    newest = baseline_database(db_path)
+
+    data = load_data_from_db(db_path)
+    assert [(place[3], place[4]) for place in data] == newest
+    assert np.array_equal(data[0][0], np.arange(4, dtype=np.float32))
+    with get_store(db_path).connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM google_api_responses').fetchone() == (2,)
+        assert conn.execute('SELECT proper_title, type, street_address, lat, lng FROM places ORDER BY id').fetchall() == [
+            ('Tokyo Tower', 'activity', '4-2-8 Shibakoen', 35.6586, 139.7454), ('Senso-ji', 'activity', '2-3-1 Asakusa', None, None)]
+    assert [place[3].proper_title for _, place in places_near(db_path, 35.66, 139.75, 2)] == ['Tokyo Tower']
+    assert load_general_preferences(db_path, 'Japan') == {'activity': 'museums'}
+    assert load_destination_preferences(db_path, 'Japan', 'Tokyo') == {'start_date': '2026-04-01', 'food': 'ramen'}
+
+    # Saving the places again updates them in place
+    save_data_to_db(db_path, data)
+    with get_store(db_path).connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM places').fetchone() == (2,)
+
+
+def test_concurrent_transactions_are_serialized(db_path):
+    store = get_store(db_path)
+    with store.transaction() as conn:
+        conn.execute("INSERT INTO general_preferences (country, preferences) VALUES ('counter', '0')")
+
+    def increment(times):
+        for _ in range(times):
+            # A read-modify-write that loses updates unless writers are serialized
+            with store.transaction() as conn:
+                (value,) = conn.execute("SELECT preferences FROM general_preferences WHERE country = 'counter'").fetchone()
+                with store.transaction() as nested:
+                    assert nested is conn
+                    nested.execute("UPDATE general_preferences SET preferences = ? WHERE country = 'counter'", (str(int(value) + 1),))
+
+    threads = [threading.Thread(target=increment, args=(25,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with store.connection() as conn:
+        assert conn.execute("SELECT preferences FROM general_preferences WHERE country = 'counter'").fetchone() == ('200',)
+    assert store._opened <= store.pool_size
+
+
+def test_failed_transaction_is_rolled_back(db_path):
+    store = get_store(db_path)
+    try:
+        with store.transaction() as conn:
+            conn.execute("INSERT INTO general_preferences (country, preferences) VALUES ('Japan', '{}')")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert load_general_preferences(db_path, 'Japan') == {}
+    # The connection went back to the pool and the store still writes
+    with store.transaction() as conn:
+        conn.execute("INSERT INTO general_preferences (country, preferences) VALUES ('Japan', '{}')")
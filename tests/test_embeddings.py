@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from libraries.ann import load_dedup_index
+from libraries.data import Item, save_data_to_db
+from libraries.embeddings import EmbeddingCache, FakeEmbedder, batch_embedder, embed_texts, embedding_text
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def test_fake_embedder_is_deterministic_and_title_aware():
+    embed = FakeEmbedder(dim=128)
+    tower, tower_again, similar, other = embed(['tokyo tower', 'tokyo tower', 'tokyo towers', 'fushimi inari taisha'])
+
+    assert np.array_equal(tower, tower_again)
+    assert np.array_equal(tower, FakeEmbedder(dim=128)(['tokyo tower'])[0])
+    assert cosine(tower, similar) > cosine(tower, other)
+
+
+def test_embedding_text_is_normalized():
+    assert embedding_text('Japan', 'Tokyo', '  Tokyo   TOWER ') == embedding_text('japan', 'tokyo', 'tokyo tower')
+
+
+def test_known_texts_cost_no_embedding_calls(db_path):
+    embed = FakeEmbedder()
+    cache = EmbeddingCache(db_path)
+    texts = [embedding_text('Japan', 'Tokyo', title) for title in ('Tokyo Tower', 'Senso-ji', 'Tokyo Tower', 'Meiji Shrine')]
+
+    first = embed_texts(texts, embed.model_name, embed, cache, batch_size=2)
+    # Three distinct texts in batches of two
+    assert embed.calls == 2
+    assert np.array_equal(first[0], first[2])
+
+    again = embed_texts(texts, embed.model_name, embed, cache)
+    assert embed.calls == 2
+    assert all(np.array_equal(a, b) for a, b in zip(first, again))
+
+
+def test_cache_is_keyed_by_model(db_path):
+    cache = EmbeddingCache(db_path)
+    embed_texts(['japan tokyo tokyo tower'], 'model-a', FakeEmbedder(), cache)
+
+    embed = FakeEmbedder()
+    embed_texts(['japan tokyo tokyo tower'], 'model-b', embed, cache)
+    assert embed.calls == 1
+
+
+def test_batch_embedder_keeps_text_order():
+    calls = []
+
+    def embed_one(text):
+        calls.append(text)
+        return [float(len(text)), 1.0]
+
+    vectors = batch_embedder(embed_one, max_workers=4)(['a', 'bbb', 'cc'])
+    assert [vector[0] for vector in vectors] == [1.0, 3.0, 2.0]
+    assert sorted(calls) == ['a', 'bbb', 'cc']
+
+
+def test_failed_batch_raises_and_is_not_cached(db_path):
+    cache = EmbeddingCache(db_path)
+    embed_batch = batch_embedder(lambda text: None if text == 'unknown' else [1.0, 0.0])
+    with pytest.raises(ValueError, match='unknown'):
+        embed_texts(['known', 'unknown'], 'model', embed_batch, cache)
+    assert cache.get_many(['known', 'unknown'], 'model') == {}
+
+
+@pytest.mark.parametrize('ann_threshold', [100_000, 0])
+def test_backfilled_embeddings_survive_an_unsaved_run(db_path, ann_threshold):
+    embed = FakeEmbedder(dim=32)
+    places = [
+        (None if title == 'Senso-ji' else vector, 'Japan', 'Tokyo',
+         Item(item_title=title, proper_title=title, description=title, is_specific_location=True, type='activity'), {})
+        for title, vector in zip(('Tokyo Tower', 'Senso-ji'), embed(['tokyo tower', 'senso ji']))
+    ]
+    save_data_to_db(db_path, places)
+    load_dedup_index(db_path, ann_threshold).save(db_path)
+
+    # A run backfills Senso-ji's embedding and stops before saving its index
+    save_data_to_db(db_path, [(embed(['senso ji'])[0],) + places[1][1:]])
+    index = load_dedup_index(db_path, ann_threshold)
+    assert index.best_match('Japan', 'Tokyo', embed(['senso ji'])[0]) == 2
+    assert len(index) == 2
+
+    # Once saved it is part of the stored index and is not added twice
+    index.save(db_path)
+    assert len(load_dedup_index(db_path, ann_threshold)) == 2
@@ -0,0 +1,75 @@
+import sqlite3
+
+from libraries.batch import BatchManifest, manifest_preferences
+from libraries.data import get_store
+from libraries.jobs import JOB_DONE, ResearchJobs
+from libraries.research import ResearchTask
+
+
+def test_changed_prompt_starts_the_job_over(db_path):
+    jobs = ResearchJobs(db_path)
+    task = ResearchTask('Japan', 'Tokyo', 'activity', 'Find activities')
+    jobs.enqueue([task])
+    jobs.start(task)
+    jobs.items_done(task, ['Tokyo Tower'])
+    jobs.link_places(task, [1])
+    jobs.finish(task)
+    assert jobs.with_state([task], JOB_DONE) == [task]
+
+    changed = ResearchTask('Japan', 'Tokyo', 'activity', 'Find quiet activities')
+    jobs.enqueue([changed])
+    assert jobs.runnable([changed]) == [changed]
+    assert jobs.done_items(changed) == set()
+    assert jobs.places('Japan', 'Tokyo', ['activity']) == set()
+
+
+def test_scopes_keep_their_own_jobs_and_places(db_path):
+    jobs = ResearchJobs(db_path)
+    alice = ResearchTask('Japan', 'Tokyo', 'activity', 'Museums', 'alice')
+    bob = ResearchTask('Japan', 'Tokyo', 'activity', 'Nightlife', 'bob')
+    jobs.enqueue([alice, bob])
+    jobs.start(alice)
+    jobs.link_places(alice, [1, 2])
+    jobs.finish(alice)
+    jobs.link_places(bob, [2, 3])
+
+    assert jobs.runnable([alice, bob]) == [bob]
+    assert jobs.places('Japan', 'Tokyo', ['activity'], scope='alice') == {1, 2}
+    assert jobs.places('Japan', 'Tokyo', ['activity', 'food'], scope='bob') == {2, 3}
+    assert jobs.places('Japan', 'Tokyo', ['activity']) == set()
+
+
+def test_jobs_table_without_scope_is_migrated(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+    CREATE TABLE research_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, country TEXT, destination TEXT, prompt_type TEXT, prompt_hash TEXT, state TEXT,
+        attempts INTEGER DEFAULT 0, next_attempt_at REAL DEFAULT 0, last_error TEXT, updated_at REAL,
+        UNIQUE(country, destination, prompt_type)
+    )''')
+    conn.execute("INSERT INTO research_jobs (id, country, destination, prompt_type, prompt_hash, state) VALUES (7, 'Japan', 'Tokyo', 'activity', 'x', 'done')")
+    conn.commit()
+    conn.close()
+
+    jobs = ResearchJobs(db_path)
+    with get_store(db_path).connection() as conn:
+        assert conn.execute('SELECT id, scope, state FROM research_jobs').fetchall() == [(7, '', 'done')]
+    jobs.enqueue([ResearchTask('Japan', 'Tokyo', 'activity', 'Museums', 'alice')])
+    with get_store(db_path).connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM research_jobs').fetchone() == (2,)
+
+
+def test_manifest_preferences_are_per_traveller_and_report_conflicts():
+    manifest = BatchManifest(trips=[
+        {'traveller': 'alice', 'country': 'Japan', 'preferences': {'activity': 'museums'},
+         'destinations': [{'name': 'Tokyo', 'start_date': '2026-04-01', 'preferences': {'activity': 'art'}}]},
+        {'traveller': 'bob', 'country': 'Japan', 'preferences': {'activity': 'nightlife'}, 'destinations': [{'name': 'Tokyo'}]},
+        {'traveller': 'alice', 'country': 'Japan', 'preferences': {'activity': 'hiking'},
+         'destinations': [{'name': 'Tokyo', 'start_date': '2026-05-01', 'preferences': {'activity': 'art'}}]},
+    ])
+    general, by_destination, conflicts = manifest_preferences(manifest)
+
+    assert general == {('alice', 'Japan'): {'activity': 'museums'}, ('bob', 'Japan'): {'activity': 'nightlife'}}
+    assert by_destination[('alice', 'Japan', 'Tokyo')] == {'start_date': '2026-04-01', 'end_date': None, 'activity': 'art'}
+    # Only alice's general preferences differ; other dates alone are not a conflict
+    assert len(conflicts) == 1 and 'alice' in conflicts[0]
@@ -0,0 +1,34 @@
+import json
+
+from libraries.data import ItemList
+from libraries.llm_cache import LLMResponseCache
+
+DOCUMENT = json.dumps({'list_title': 'Tokyo', 'items': [
+    {'item_title': 'Tokyo Tower', 'proper_title': 'Tokyo Tower', 'description': 'About Tokyo Tower', 'is_specific_location': True,
+     'street_address': '4-2-8 Shibakoen', 'type': 'activity'}
+]})
+
+
+def chunked(text, size=16):
+    return lambda: (text[i:i + size] for i in range(0, len(text), size))
+
+
+def test_complete_stream_is_replayed(db_path):
+    cache = LLMResponseCache(db_path)
+    assert ''.join(cache.stream('model', 'prompt', ItemList, chunked(DOCUMENT))) == DOCUMENT
+    assert list(cache.stream('model', 'prompt', ItemList, lambda: iter(()))) == [DOCUMENT]
+
+
+def test_truncated_or_invalid_stream_is_not_stored(db_path):
+    cache = LLMResponseCache(db_path)
+    for response in (DOCUMENT[:-20], '{"list_title": "Tokyo", "items": [}', ''):
+        assert ''.join(cache.stream('model', 'prompt', ItemList, chunked(response))) == response
+        assert cache.get('model', 'prompt', ItemList) is None
+
+
+def test_complete_document_with_an_invalid_item_is_stored(db_path):
+    # stream_items repairs the bad item with its own (cached) request, so the list is not generated again
+    cache = LLMResponseCache(db_path)
+    response = DOCUMENT.replace('"type": "activity"', '"type": null')
+    ''.join(cache.stream('model', 'prompt', ItemList, chunked(response)))
+    assert cache.get('model', 'prompt', ItemList) == response
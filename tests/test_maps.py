@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+from libraries import maps
+from libraries.maps import MapsResponseCache, fetch_place_details_batch
+
+
+class StubClient:
+    """Stands in for googlemaps.Client: geocodes any query except the unknown ones and counts the requests."""
+
+    def __init__(self, unknown=()):
+        self.unknown = set(unknown)
+        self.requests = []
+
+    def geocode(self, address):
+        self.requests.append(address)
+        if address.split(',')[0] in self.unknown:
+            return []
+        return [{'formatted_address': address, 'geometry': {'location': {'lat': 35.0, 'lng': 139.0}}}]
+
+
+def fetch(gmaps, query, destination):
+    """Same contract as tools.get_place_details: the responses of a place, ValueError if it cannot be found."""
+    results = gmaps.geocode(f"{query}, {destination}")
+    if not results:
+        raise ValueError(f"{query} not found")
+    return {'geocode': results[0]}
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_one_fetch_per_normalized_query(db_path):
+    gmaps = StubClient()
+    results = fetch_place_details_batch(gmaps, ['Tokyo Tower', '  tokyo   TOWER', 'Senso-ji'], 'Tokyo', fetch, MapsResponseCache(db_path))
+
+    assert len(gmaps.requests) == 2
+    assert results[0] == results[1]
+    assert results[2]['geocode']['formatted_address'] == 'Senso-ji, Tokyo'
+
+
+def test_rerun_is_served_from_cache(db_path):
+    cache = MapsResponseCache(db_path)
+    first = fetch_place_details_batch(StubClient(unknown={'Nowhere'}), ['Tokyo Tower', 'Nowhere'], 'Tokyo', fetch, cache)
+
+    gmaps = StubClient()
+    second = fetch_place_details_batch(gmaps, ['tokyo tower', 'Nowhere'], 'tokyo', fetch, cache)
+
+    assert gmaps.requests == []
+    assert second == first
+    # Places Google Maps could not find are cached as well
+    assert second[1] is None
+
+
+def test_expired_entries_are_fetched_again(db_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(maps, 'time', SimpleNamespace(time=clock.time))
+    cache = MapsResponseCache(db_path, ttl=60)
+    fetch_place_details_batch(StubClient(), ['Tokyo Tower'], 'Tokyo', fetch, cache)
+
+    clock.now += 59
+    assert cache.get('Tokyo Tower', 'Tokyo') is not None
+
+    clock.now += 2
+    assert cache.get('Tokyo Tower', 'Tokyo') is None
+    gmaps = StubClient()
+    fetch_place_details_batch(gmaps, ['Tokyo Tower'], 'Tokyo', fetch, cache)
+    assert len(gmaps.requests) == 1
+
+
+def test_least_recently_used_lookups_are_evicted(db_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(maps, 'time', SimpleNamespace(time=clock.time))
+    cache = MapsResponseCache(db_path, max_entries=2)
+    for query in ('Tokyo Tower', 'Senso-ji'):
+        clock.now += 1
+        fetch_place_details_batch(StubClient(), [query], 'Tokyo', fetch, cache)
+
+    # Reading Tokyo Tower makes Senso-ji the least recently used lookup
+    clock.now += 1
+    assert cache.get('Tokyo Tower', 'Tokyo') is not None
+    clock.now += 1
+    fetch_place_details_batch(StubClient(), ['Meiji Shrine'], 'Tokyo', fetch, cache)
+
+    assert cache.get('Senso-ji', 'Tokyo') is None
+    assert cache.get('Tokyo Tower', 'Tokyo') is not None
+    assert cache.get('Meiji Shrine', 'Tokyo') is not None
@@ -0,0 +1,58 @@
+import numpy as np
+
+from libraries.data import Item, PlaceTable, load_data_from_db, load_place_table, save_data_to_db
+from libraries.geo import place_coordinates
+
+
+def place(title, destination, place_type, location=None, embedding=None):
+    item = Item(item_title=f"Visit {title}", proper_title=title, description=f"About {title}", is_specific_location=True,
+                street_address=f"1 {title} Street", type=place_type)
+    responses = {'geocode': {'geometry': {'location': {'lat': location[0], 'lng': location[1]}}}} if location else {}
+    return embedding, 'Japan', destination, item, responses
+
+
+PLACES = [
+    place('Tokyo Tower', 'Tokyo', 'activity', (35.6586, 139.7454), np.ones(4, dtype=np.float32)),
+    place('Ichiran', 'Tokyo', 'food', (35.6938, 139.7034)),
+    place('Kinkaku-ji', 'Kyoto', 'activity', (35.0394, 135.7292), np.arange(4, dtype=np.float32)),
+    place('Nishiki Market', 'Kyoto', 'food'),
+]
+
+
+def test_place_table_matches_the_tuple_loader(db_path):
+    save_data_to_db(db_path, PLACES)
+    rows = load_data_from_db(db_path)
+    table = load_place_table(db_path)
+
+    assert len(table) == len(rows)
+    for i, (row, table_row) in enumerate(zip(rows, table)):
+        assert table_row[1:3] == row[1:3]
+        assert table_row[3].json() == row[3].json()
+        assert table.item(i) == row[3]
+        assert table.api_responses(i) == row[4]
+        assert (table_row[0] is None) == (row[0] is None)
+        assert row[0] is None or np.array_equal(table_row[0], row[0])
+        assert table.index(row) == i
+        assert table.position_of(table.place_id(i)) == i
+
+    # Ids follow insertion order, as in the places table
+    assert [table.place_id(i) for i in range(len(table))] == [1, 2, 3, 4]
+    assert np.array_equal(table.has_embedding, [row[0] is not None for row in rows])
+    assert np.allclose(table.coordinates(), place_coordinates(rows), equal_nan=True)
+    assert np.flatnonzero(table.mask(destination='Kyoto', place_type='food')).tolist() == [3]
+    assert np.flatnonzero(table.mask(place_type=['activity', 'food'], destination=['Tokyo'])).tolist() == [0, 1]
+    assert not table.dirty_rows()
+
+
+def test_saved_rows_learn_their_ids(db_path):
+    save_data_to_db(db_path, PLACES[:2])
+    table = PlaceTable(load_data_from_db(db_path))
+    assert table.place_id(0) is None
+
+    table.append(PLACES[2])
+    save_data_to_db(db_path, table)
+    stored = load_place_table(db_path)
+    assert [table.place_id(i) for i in range(len(table))] == [stored.place_id(i) for i in range(len(stored))]
+    assert table.position_of(stored.place_id(2)) == 2
+    assert not table.dirty_rows()
+    assert stored.item(2) == PLACES[2][3]
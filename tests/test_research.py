@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from libraries.research import ResearchTask, TokenBucket, stream_research
+from libraries.streaming import stream_items
+
+
+class StubModel:
+    """Stands in for genai.GenerativeModel: streams a canned ItemList per prompt in small chunks.
+
+    delays[prompt] is the pause before each chunk, so tasks can be made to finish in any order.
+    Tracks the highest number of responses being generated at once.
+    """
+
+    def __init__(self, titles, delays=None, failing=()):
+        self.titles = titles
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        if prompt in self.failing:
+            raise RuntimeError(f"429 quota exceeded for {prompt}")
+        document = json.dumps({'list_title': prompt, 'items': [
+            {'item_title': title, 'proper_title': title, 'description': f"About {title}", 'is_specific_location': True,
+             'street_address': f"1 {title} Street", 'type': 'activity'}
+            for title in self.titles[prompt]
+        ]})
+        return self._chunks(document, self.delays.get(prompt, 0))
+
+    def _chunks(self, document, delay):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            for start in range(0, len(document), 40):
+                time.sleep(delay)
+                yield SimpleNamespace(text=document[start:start + 40])
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def research_with(model):
+    def fetch_items(task):
+        return stream_items(lambda text: (chunk.text for chunk in model.generate_content(text, stream=True)), task.prompt)
+    return fetch_items
+
+
+def tasks_for(*prompts):
+    return [ResearchTask('Japan', prompt.split()[0], 'activity', prompt) for prompt in prompts]
+
+
+def merged_titles(tasks, model, **options):
+    data = []
+    for task, items in stream_research(tasks, research_with(model), **options):
+        data.extend((task.destination, item.proper_title) for item in items)
+    return data
+
+
+def test_batches_are_merged_in_task_order():
+    titles = {'Tokyo activities': [f"Tokyo {i}" for i in range(12)], 'Kyoto activities': [f"Kyoto {i}" for i in range(5)]}
+    expected = [('Tokyo', title) for title in titles['Tokyo activities']] + [('Kyoto', title) for title in titles['Kyoto activities']]
+
+    # Kyoto finishes long before Tokyo, then the other way round; data ends up the same either way
+    slow_tokyo = StubModel(titles, delays={'Tokyo activities': 0.01})
+    slow_kyoto = StubModel(titles, delays={'Kyoto activities': 0.01})
+    tasks = tasks_for('Tokyo activities', 'Kyoto activities')
+    assert merged_titles(tasks, slow_tokyo, batch_size=4) == expected
+    assert merged_titles(tasks, slow_kyoto, batch_size=4) == expected
+
+
+def test_each_task_ends_with_an_empty_batch():
+    model = StubModel({'Tokyo activities': ['Tokyo Tower'], 'Osaka activities': []})
+    batches = [(task.destination, len(items)) for task, items in stream_research(tasks_for('Tokyo activities', 'Osaka activities'), research_with(model))]
+    assert batches == [('Tokyo', 1), ('Tokyo', 0), ('Osaka', 0)]
+
+
+def test_concurrency_is_limited_by_max_workers():
+    prompts = [f"City{i} activities" for i in range(6)]
+    model = StubModel({prompt: [f"{prompt} {j}" for j in range(3)] for prompt in prompts}, delays=dict.fromkeys(prompts, 0.005))
+    merged_titles(tasks_for(*prompts), model, max_workers=2)
+    assert model.max_active == 2
+
+
+def test_failure_is_raised_when_its_task_is_reached():
+    model = StubModel({'Tokyo activities': ['Tokyo Tower', 'Senso-ji']}, failing={'Kyoto activities'})
+    merged = []
+    with pytest.raises(RuntimeError, match='429'):
+        for task, items in stream_research(tasks_for('Tokyo activities', 'Kyoto activities'), research_with(model)):
+            merged.extend(item.proper_title for item in items)
+    assert merged == ['Tokyo Tower', 'Senso-ji']
+
+
+def test_token_bucket_spaces_requests_at_its_rate():
+    bucket = TokenBucket(rate=100.0)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # The first token is available at once, the other five arrive every 10ms
+    assert time.monotonic() - start >= 0.045
+
+
+def test_token_bucket_is_shared_between_threads():
+    bucket = TokenBucket(rate=200.0)
+    times = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(5):
+            bucket.acquire()
+            with lock:
+                times.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 acquisitions across all threads still come out at 200 per second
+    assert len(times) == 20
+    assert max(times) - start >= 19 / 200 * 0.9
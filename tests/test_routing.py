@@ -0,0 +1,90 @@
+import itertools
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+from libraries import routing
+from libraries.routing import calculate_location_route, solve_route, tour_length
+
+
+def euclidean(points):
+    return np.linalg.norm(points[:, np.newaxis] - points[np.newaxis], axis=2)
+
+
+def brute_force(dist, closed):
+    n = len(dist)
+    if closed:
+        return min(tour_length(dist, (0,) + order) for order in itertools.permutations(range(1, n)))
+    return min(tour_length(dist, order, closed=False) for order in itertools.permutations(range(n)))
+
+
+@pytest.mark.parametrize('closed', [True, False])
+@pytest.mark.parametrize('seed', range(10))
+def test_small_days_are_solved_optimally(seed, closed):
+    rng = np.random.default_rng(seed)
+    dist = euclidean(rng.uniform(0, 10, (int(rng.integers(3, 9)), 2)))
+    order = solve_route(dist, closed=closed)
+
+    assert sorted(order) == list(range(len(dist)))
+    if closed:
+        assert order[0] == 0
+    assert tour_length(dist, order, closed=closed) == pytest.approx(brute_force(dist, closed))
+
+
+def test_large_days_are_improved_by_local_search():
+    dist = euclidean(np.random.default_rng(0).uniform(0, 10, (60, 2)))
+    order = solve_route(dist, time_budget=5.0, closed=True)
+    assert sorted(order) == list(range(60)) and order[0] == 0
+    # 2-opt leaves no crossing edges, so it beats the greedy seed
+    assert tour_length(dist, order) < tour_length(dist, routing.nearest_neighbour_tour(dist, 0))
+
+
+def place(title, lat, lng):
+    return None, 'Japan', 'Tokyo', title, {'geocode': {'geometry': {'location': {'lat': lat, 'lng': lng}}}}
+
+
+def trip(days=3, stops=12, seed=0):
+    rng = np.random.default_rng(seed)
+    return [[place(f'{day}-{i}', 35.6 + rng.uniform(0, 0.1), 139.7 + rng.uniform(0, 0.1)) for i in range(stops)]
+            for day in range(days)]
+
+
+class BrokenPool:
+    def __init__(self):
+        self.shut_down = False
+
+    def map(self, *args):
+        raise BrokenProcessPool("a worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_pool_and_in_process_solving_agree(monkeypatch):
+    clusters = trip()
+    expected = calculate_location_route(clusters, time_budget=2.0)
+
+    monkeypatch.setattr(routing, 'PARALLEL_MIN_STOPS', 10)
+    assert calculate_location_route(clusters, time_budget=2.0, processes=2) == expected
+    assert 2 in routing._pools
+    routing._discard_pool(2, routing._pools[2])
+
+
+def test_broken_pool_falls_back_to_solving_in_process(monkeypatch):
+    clusters = trip()
+    expected = calculate_location_route(clusters, time_budget=2.0)
+
+    pool = BrokenPool()
+    monkeypatch.setattr(routing, 'PARALLEL_MIN_STOPS', 10)
+    monkeypatch.setitem(routing._pools, 3, pool)
+    assert calculate_location_route(clusters, time_budget=2.0, processes=3) == expected
+    # The broken pool is dropped, so the next trip starts a fresh one
+    assert pool.shut_down and 3 not in routing._pools
+
+
+def test_unlocated_stops_are_kept_at_the_end_of_their_day():
+    day = trip(days=1, stops=5)[0]
+    unlocated = (None, 'Japan', 'Tokyo', 'Unknown', {})
+    route = calculate_location_route([day[:2] + [unlocated] + day[2:]])[0]
+    assert route[-1] is unlocated and sorted(stop[3] for stop in route[:-1]) == sorted(stop[3] for stop in day)
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+
+from libraries.data import Item
+from libraries.streaming import MAX_REPAIR_ROUNDS, ItemStreamParser, repair_prompt, stream_items
+
+
+def raw_item(title, **extra):
+    return dict(item_title=title, proper_title=title, description=f'About {title}',
+                is_specific_location=True, street_address='', type='activity', **extra)
+
+
+def document(items, list_title='Things to do'):
+    return json.dumps({'list_title': list_title, 'items': items}, ensure_ascii=False)
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 1000])
+def test_items_are_split_out_across_chunk_boundaries(size):
+    items = [raw_item('Tokyo Tower'), raw_item('Senso-ji'), raw_item('Meiji Shrine')]
+    text = document(items)
+    parser = ItemStreamParser()
+    parsed = [raw for chunk in chunked(text, size) for raw in parser.feed(chunk)]
+
+    assert parsed == items
+    assert parser.finish() == json.loads(text)
+
+
+def test_each_item_is_returned_by_the_chunk_that_closes_it():
+    text = document([raw_item('Tokyo Tower'), raw_item('Senso-ji')])
+    end_of_first = text.index('}') + 1
+    parser = ItemStreamParser()
+
+    assert parser.feed(text[:end_of_first - 1]) == []
+    assert [raw['item_title'] for raw in parser.feed(text[end_of_first - 1:end_of_first])] == ['Tokyo Tower']
+    assert [raw['item_title'] for raw in parser.feed(text[end_of_first:])] == ['Senso-ji']
+
+
+def test_nested_values_and_brackets_in_strings_stay_inside_their_item():
+    items = [
+        raw_item('Bar "{[Tricky]}"', tags=['a', {'items': [1, 2]}], hours={'mon': [9, 17], 'note': 'closed }]'}),
+        raw_item('Back\\slash \\"quote\\"'),
+    ]
+    text = json.dumps({'list_title': 'Nested', 'meta': {'items': [{'not': 'an item'}]}, 'items': items})
+    parser = ItemStreamParser()
+
+    assert [raw for chunk in chunked(text, 5) for raw in parser.feed(chunk)] == items
+
+
+def test_truncated_document_yields_complete_items_only():
+    text = document([raw_item('Tokyo Tower'), raw_item('Senso-ji')])
+    cut = text.index('Senso-ji')
+    parser = ItemStreamParser()
+
+    assert [raw['item_title'] for raw in parser.feed(text[:cut])] == ['Tokyo Tower']
+    assert parser.finish() == {}
+
+
+class StubModel:
+    """Request stub that answers each prompt with the next response, in chunks, and records the prompts."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return chunked(self.responses.pop(0), 4)
+
+
+def test_only_invalid_items_are_repaired():
+    broken = {'item_title': 'Senso-ji', 'type': 'activity'}
+    model = StubModel(document([raw_item('Tokyo Tower'), broken, raw_item('Meiji Shrine')]),
+                      document([raw_item('Senso-ji')], list_title='Repaired'))
+
+    items = list(stream_items(model, 'List places'))
+
+    assert [item.proper_title for item in items] == ['Tokyo Tower', 'Meiji Shrine', 'Senso-ji']
+    assert all(isinstance(item, Item) for item in items)
+    assert len(model.prompts) == 2
+    assert model.prompts[1].startswith('List places')
+    assert json.dumps(broken) in model.prompts[1] and 'Tokyo Tower' not in model.prompts[1]
+
+
+def test_items_still_invalid_after_the_repair_rounds_are_dropped():
+    broken = {'item_title': 'Senso-ji'}
+    model = StubModel(*[document([raw_item('Tokyo Tower'), broken])] + [document([broken])] * MAX_REPAIR_ROUNDS)
+
+    items = list(stream_items(model, 'List places'))
+
+    assert [item.proper_title for item in items] == ['Tokyo Tower']
+    assert len(model.prompts) == 1 + MAX_REPAIR_ROUNDS
+    assert model.responses == []
+
+
+def test_unparseable_items_are_repaired():
+    text = document([raw_item('Tokyo Tower')]).replace('true', 'tru')
+    model = StubModel(text, document([raw_item('Tokyo Tower')]))
+
+    assert [item.proper_title for item in stream_items(model, 'List places')] == ['Tokyo Tower']
+    assert 'not valid JSON' in model.prompts[1]
+
+
+def test_repair_prompt_quotes_each_item_with_its_error():
+    prompt = repair_prompt('List places', [({'item_title': 'A'}, 'missing type'), ({'item_title': 'B'}, 'missing description')])
+    assert '2 items' in prompt
+    assert '"item_title": "A"' in prompt and 'Error: missing description' in prompt
+
+
+def test_empty_response_raises():
+    with pytest.raises(ValueError, match='Empty response'):
+        list(stream_items(StubModel('  '), 'List places'))
@@ -0,0 +1,34 @@
+from libraries.data import Item, iter_places, load_place_table, save_data_to_db
+from libraries.titles import TitleIndex, normalize_title
+
+
+def place(title, street_address, destination='Kyoto'):
+    item = Item(item_title=title, proper_title=title, description=f"About {title}", is_specific_location=True,
+                street_address=street_address, type='activity')
+    return None, 'Japan', destination, item, {}
+
+
+PLACES = [place('Kiyomizu-dera', '1-294 Kiyomizu'), place('Kinkaku-ji', '1 Kinkakujicho'),
+          place('Fushimi Inari Taisha', '68 Fukakusa Yabunouchicho'), place('Shinbashi', '1 Shinbashi', 'Tokyo')]
+
+
+def test_normalize_title_folds_romanization_variants():
+    assert normalize_title('Kyōto') == normalize_title('Kyouto') == normalize_title('キョウト') == 'kyoto'
+    assert normalize_title('Shimbashi') == normalize_title('Shinbashi')
+
+
+def test_index_from_table_columns_matches_tuples_without_parsing_items(db_path):
+    save_data_to_db(db_path, PLACES)
+    table = load_place_table(db_path)
+    from_table = TitleIndex.from_places(table)
+    from_tuples = TitleIndex.from_places(PLACES)
+
+    for query, street_address in (('Kiyomizudera', None), ('Kinkakuji Temple', '1 Kinkakujicho'), ('Fushimi Inari', None)):
+        assert from_table.candidates('Japan', 'Kyoto', query, street_address) == from_tuples.candidates('Japan', 'Kyoto', query, street_address)
+    assert [key for key, _ in from_table.candidates('Japan', 'Kyoto', 'Kiyomizu dera')][:1] == [0]
+    assert from_table.candidates('Japan', 'Tokyo', 'Shimbashi')[0][0] == 3
+
+    # Street addresses come from their column, like proper_title and type
+    for row in (table[1], next(iter_places(db_path, ids=[2]))):
+        assert row[3].street_address == '1 Kinkakujicho'
+        assert row[3]._item is None
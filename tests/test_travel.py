@@ -0,0 +1,86 @@
+import numpy as np
+
+from libraries.data import Item, PlaceTable, get_store, load_place_table, save_data_to_db
+from libraries.travel import StubProvider, TravelTimeCache, haversine_estimate
+
+
+def place(title, lat, lng, destination='Tokyo'):
+    item = Item(item_title=title, proper_title=title, description=f"About {title}", is_specific_location=True,
+                street_address=f"1 {title} Street", type='activity')
+    return None, 'Japan', destination, item, {'geocode': {'geometry': {'location': {'lat': lat, 'lng': lng}}}}
+
+
+PLACES = [place('Tokyo Tower', 35.6586, 139.7454), place('Senso-ji', 35.7148, 139.7967),
+          place('Meiji Shrine', 35.6764, 139.6993), place('Ueno Park', 35.7156, 139.7745)]
+
+
+def test_stub_provider_is_deterministic():
+    coords = np.array([[35.6586, 139.7454], [35.7148, 139.7967]])
+    first, second = StubProvider(seed=3)(coords, coords, 'walking'), StubProvider(seed=3)(coords, coords, 'walking')
+    assert np.array_equal(first[1], second[1])
+    # The noise only ever lengthens the estimate
+    assert (first[1] >= haversine_estimate(coords, coords, 'walking')[1]).all()
+
+
+def test_routing_after_precompute_only_does_lookups(db_path):
+    save_data_to_db(db_path, PLACES + [place('Kinkaku-ji', 35.0394, 135.7292, 'Kyoto'), place('Gion', 35.0037, 135.7788, 'Kyoto')])
+    provider = StubProvider()
+    cache = TravelTimeCache(db_path, 'walking', provider)
+
+    # Every ordered pair within each destination: 4 * 3 in Tokyo and 2 * 1 in Kyoto
+    assert cache.precompute(country='Japan') == 14
+    assert cache.precompute(country='Japan') == 0
+    calls = provider.calls
+
+    matrix = cache.matrix(PLACES, symmetric=False)
+    assert provider.calls == calls
+    coords = np.array([p[4]['geocode']['geometry']['location'][key] for p in PLACES for key in ('lat', 'lng')]).reshape(-1, 2)
+    _, durations = StubProvider()(coords, coords, 'walking')
+    np.fill_diagonal(durations, 0.0)
+    assert np.allclose(matrix, durations)
+    assert np.allclose(cache.matrix(PLACES), (durations + durations.T) / 2)
+
+
+def test_estimates_are_replaced_once_a_provider_is_set(db_path):
+    save_data_to_db(db_path, PLACES)
+    estimates = TravelTimeCache(db_path, 'walking').matrix(PLACES)
+
+    provider = StubProvider()
+    cache = TravelTimeCache(db_path, 'walking', provider)
+    # Matrix lookups keep using the stored estimates; precompute swaps them for provider answers
+    assert np.allclose(cache.matrix(PLACES), estimates)
+    assert provider.calls == 0
+    assert cache.precompute() == 12
+    assert provider.calls > 0
+    assert not np.allclose(cache.matrix(PLACES), estimates)
+
+
+def test_unsaved_places_get_the_estimate(db_path):
+    save_data_to_db(db_path, PLACES[:2])
+    provider = StubProvider()
+    matrix = TravelTimeCache(db_path, 'walking', provider).matrix(PLACES[:3], symmetric=False)
+
+    # Only the saved pair goes to the provider; the unsaved place is estimated
+    assert provider.calls == 4
+    coords = np.array([[35.6586, 139.7454], [35.7148, 139.7967], [35.6764, 139.6993]])
+    _, estimate = haversine_estimate(coords, coords, 'walking')
+    assert np.allclose(matrix[2, :2], estimate[2, :2])
+    assert np.allclose(matrix[:2, 2], estimate[:2, 2])
+
+
+def test_place_ids_come_from_the_table_without_queries(db_path):
+    save_data_to_db(db_path, PLACES[:3])
+    table = load_place_table(db_path)
+    statements = []
+    with get_store(db_path).connection() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        ids = TravelTimeCache(db_path, 'walking', table=table).place_ids(PLACES)
+        assert ids == [1, 2, 3, None]
+        # Only the place missing from the table is looked up, in one batched query
+        assert [sql for sql in statements if 'FROM places' in sql] == [statements[-1]]
+        assert TravelTimeCache(db_path, 'walking').place_ids(PLACES) == ids
+        assert TravelTimeCache(db_path, 'walking', table=PlaceTable(PLACES)).place_ids(PLACES) == ids
+    finally:
+        with get_store(db_path).connection() as conn:
+            conn.set_trace_callback(None)